@@ -0,0 +1,67 @@
+import os
+import threading
+
+import pytest
+
+from carreralib import ControlUnit
+from carreralib.sim import SimulatorConnection
+
+SIM_URL = "sim://?cars=8&laptime=4000,4100,4200,4300,4400,4500,4600,4700"
+
+
+class PtyServer(threading.Thread):
+    """Serve a simulated Control Unit on the master side of a pty."""
+
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.master, self.slave = os.openpty()
+        self.device = os.ttyname(self.slave)
+        self.sim = SimulatorConnection(url)
+
+    def run(self):
+        buf = bytearray()
+        try:
+            while True:
+                data = os.read(self.master, 1024)
+                if not data:
+                    break
+                buf += data
+                while b"$" in buf:
+                    end = buf.index(b"$")
+                    # strip leading '"' from request
+                    self.sim.send(buf[1:end])
+                    del buf[: end + 1]
+                    os.write(self.master, self.sim.recv() + b"$")
+        except OSError:
+            pass
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@pytest.fixture
+def sim_cu():
+    cu = ControlUnit(SIM_URL)
+    yield cu
+    cu.close()
+
+
+@pytest.fixture
+def pty_cu():
+    if not hasattr(os, "openpty"):
+        pytest.skip("pty not supported")
+    pytest.importorskip("serial")
+    server = PtyServer(SIM_URL)
+    server.start()
+    cu = ControlUnit(server.device, timeout=1.0)
+    yield cu
+    cu.close()
+    server.close()
+
+
+def start_race(cu):
+    cu.start()
+    cu.start()
+    while cu.poll().start != 0:
+        pass
@@ -0,0 +1,51 @@
+from carreralib import ControlUnit
+from carreralib.connection import Connection
+
+from .conftest import start_race
+
+STATUS = b"?:>>>>>>0006008<"
+TIMER = b"?2003037?>1="
+
+
+class ReplyConnection(Connection):
+    """Connection replying to every request with a fixed response."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def recv(self, maxlength=None):
+        return self.response
+
+    def send(self, buf, offset=0, size=None):
+        pass
+
+
+def test_poll_status(benchmark):
+    cu = ControlUnit(ReplyConnection(STATUS))
+    assert isinstance(benchmark(cu.poll), ControlUnit.Status)
+
+
+def test_poll_timer(benchmark):
+    cu = ControlUnit(ReplyConnection(TIMER))
+    assert isinstance(benchmark(cu.poll), ControlUnit.Timer)
+
+
+def test_setword(benchmark):
+    cu = ControlUnit(ReplyConnection(b"J"))
+    benchmark(cu.setword, 0, 5, 9, 2)
+
+
+def test_setwords(benchmark):
+    cu = ControlUnit(ReplyConnection(b"J"))
+    words = [(word, address, 9, 2) for word in (0, 1, 2) for address in range(8)]
+    benchmark(cu.setwords, words)
+
+
+def test_poll_loop_sim(benchmark, sim_cu):
+    start_race(sim_cu)
+
+    def loop():
+        for _ in range(100):
+            sim_cu.poll()
+
+    benchmark(loop)
@@ -0,0 +1,42 @@
+import pytest
+
+from carreralib import protocol
+
+PACK_FORMATS = [
+    ("cBC", (b":", 0xFF)),
+    ("cYC", (b"T", 2)),
+    ("cYYC", (b"=", 1, 0)),
+    ("ccC", (b"G", b"B")),
+    ("cBYYC", (b"J", 6 | 5 << 5, 9, 2)),
+    ("c4sC", (b"E", b"0123")),
+    ("cr18s", (b"F", 18, b"0123456789ABCDEFGH")),
+    ("cC", (b"E",)),
+]
+
+UNPACK_FORMATS = [
+    ("2x8YYYBYC", b"?:>>>>>>0006008<"),
+    ("2x8YYYBYxxC", b"?:>>>>>>000600800<"),
+    ("xYIYC", b"?2003037?>1="),
+    ("x4sC", b"053372"),
+]
+
+
+@pytest.mark.parametrize("fmt,args", PACK_FORMATS)
+def test_pack(benchmark, fmt, args):
+    benchmark(protocol.pack, fmt, *args)
+
+
+@pytest.mark.parametrize("fmt,buf", UNPACK_FORMATS)
+def test_unpack(benchmark, fmt, buf):
+    benchmark(protocol.unpack, fmt, buf)
+
+
+@pytest.mark.parametrize("fmt,buf", UNPACK_FORMATS)
+def test_struct_unpack(benchmark, fmt, buf):
+    benchmark(protocol.Struct(fmt).unpack, buf)
+
+
+@pytest.mark.parametrize("size", [5, 16, 256])
+def test_chksum(benchmark, size):
+    buf = bytes(range(48, 64)) * (size // 16 + 1)
+    benchmark(protocol.chksum, buf, 1, size - 1)
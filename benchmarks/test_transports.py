@@ -0,0 +1,25 @@
+from .conftest import start_race
+
+
+def test_poll_loop_pty(benchmark, pty_cu):
+    start_race(pty_cu)
+
+    def loop():
+        for _ in range(10):
+            pty_cu.poll()
+
+    benchmark.pedantic(loop, rounds=20)
+
+
+def test_setwords_pty(benchmark, pty_cu):
+    words = [(word, address, 9, 2) for word in (0, 1, 2) for address in range(8)]
+    benchmark.pedantic(pty_cu.setwords, args=(words,), rounds=20)
+
+
+def test_setword_pty(benchmark, pty_cu):
+    def setup():
+        for word in (0, 1, 2):
+            for address in range(8):
+                pty_cu.setword(word, address, 9, 2)
+
+    benchmark.pedantic(setup, rounds=20)
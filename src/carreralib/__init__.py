@@ -2,8 +2,8 @@
 
 from . import connection
 from . import protocol
-from .cu import ControlUnit
+from .cu import AsyncControlUnit, ControlUnit
 
-__all__ = ("ControlUnit", "connection", "protocol")
+__all__ = ("AsyncControlUnit", "ControlUnit", "connection", "protocol")
 
 __version__ = "1.0.3"
@@ -2,17 +2,18 @@ import argparse
 import contextlib
 import curses
 import errno
+import functools
 import logging
-import select
+import selectors
+import sys
 import time
 
-from . import ControlUnit
-
-
-def posgetter(driver):
-    return (-driver.laps, driver.time)
+from . import ControlUnit, connection, trace
+from .standings import Standings
+from .timing import LapStore
 
 
+@functools.lru_cache(maxsize=1024)
 def formattime(time, longfmt=False):
     if time is None:
         return "n/a"
@@ -44,35 +45,36 @@ class RMS(object):
     # FUEL_MASK = ControlUnit.Status.FUEL_MODE | ControlUnit.Status.REAL_MODE
     FUEL_MASK = ControlUnit.Status.PIT_LANE_MODE
 
+    # maximum number of screen updates per second
+    REFRESH_RATE = 20
+
+    # seconds between polls while no timer events are pending
+    POLL_INTERVAL = 0.02
+
+    # seconds to wait for the CU to become readable before blocking
+    RESPONSE_TIMEOUT = 0.1
+
     class Driver(object):
         def __init__(self, num):
             self.num = num
-            self.time = None
-            self.laptime = None
-            self.bestlap = None
-            self.laps = 0
             self.pits = 0
             self.fuel = 0
             self.pit = False
 
-        def newlap(self, timer):
-            if self.time is not None:
-                self.laptime = timer.timestamp - self.time
-                if self.bestlap is None or self.laptime < self.bestlap:
-                    self.bestlap = self.laptime
-                self.laps += 1
-            self.time = timer.timestamp
-
     def __init__(self, cu, window):
         self.cu = cu
         self.window = window
         self.titleattr = curses.A_STANDOUT
         self.lightattr = curses.color_pair(1)
+        self.rows = {}
+        self.size = None
+        self.rendered = 0.0
         self.reset()
 
     def reset(self):
         self.drivers = [self.Driver(num) for num in range(1, 9)]
-        self.maxlaps = 0
+        self.history = LapStore()
+        self.standings = Standings(self.cu)
         self.start = None
         # discard remaining timer messages
         status = self.cu.poll()
@@ -86,43 +88,113 @@ class RMS(object):
 
     def run(self):
         self.window.nodelay(1)
-        last = None
-        while True:
-            try:
-                self.update()
-                c = self.window.getch()
-                if c == ord("q"):
-                    break
-                elif c == ord("r"):
-                    self.reset()
-                elif c == ord(" "):
-                    self.cu.start()
-                elif c == 27:  # ESC
-                    self.cu.press(ControlUnit.PACE_CAR_ESC_BUTTON_ID)
-                elif c == ord("s"):
-                    self.cu.press(ControlUnit.SPEED_BUTTON_ID)
-                elif c == ord("b"):
-                    self.cu.press(ControlUnit.BRAKE_BUTTON_ID)
-                elif c == ord("f"):
-                    self.cu.press(ControlUnit.FUEL_BUTTON_ID)
-                elif c == ord("c"):
-                    self.cu.press(ControlUnit.CODE_BUTTON_ID)
-                data = self.cu.poll()
-                # prevent counting duplicate laps
-                if data == last:
-                    continue
-                elif isinstance(data, ControlUnit.Status):
-                    self.handle_status(data)
-                elif isinstance(data, ControlUnit.Timer):
-                    self.handle_timer(data)
-                else:
-                    logging.warn("Unknown data from CU: " + data)
-                last = data
-            except select.error:
-                pass
-            except IOError as e:
-                if e.errno != errno.EINTR:
-                    raise
+        fileno = None
+        with selectors.DefaultSelector() as selector:
+            # fall back to polling stdin if it cannot be selected
+            stdin = self.register(selector, sys.stdin)
+            last = None
+            pending = None
+            nextpoll = time.monotonic()
+            while True:
+                try:
+                    # file descriptor may change when reconnecting
+                    if fileno != self.cu.fileno():
+                        if fileno is not None:
+                            selector.unregister(fileno)
+                        fileno = self.cu.fileno()
+                        if fileno is not None:
+                            selector.register(fileno, selectors.EVENT_READ)
+                    now = time.monotonic()
+                    if pending is None and now >= nextpoll:
+                        pending = self.cu.submit_poll()
+                        deadline = now + self.RESPONSE_TIMEOUT
+                        if fileno is None:
+                            self.cu.flush()
+                    if pending is not None and pending.done():
+                        data = pending.result()
+                        pending = None
+                        # prevent counting duplicate laps
+                        if data != last:
+                            self.handle_data(data)
+                            last = data
+                        # more timer events may be pending
+                        if isinstance(data, ControlUnit.Timer):
+                            nextpoll = now
+                        else:
+                            nextpoll = now + self.POLL_INTERVAL
+                    self.update()
+                    render = self.rendered + 1.0 / self.REFRESH_RATE
+                    if pending is None:
+                        timeout = min(nextpoll, render) - now
+                    else:
+                        timeout = min(deadline, render) - now
+                    try:
+                        events = self.select(selector, max(timeout, 0))
+                    except OSError:
+                        if not stdin:
+                            raise
+                        # e.g. Windows, where only sockets can be selected
+                        logging.info("Cannot select stdin, polling instead")
+                        selector.unregister(sys.stdin)
+                        stdin = False
+                        continue
+                    ready = any(key.fd == fileno for key, _ in events)
+                    if pending is not None and (ready or time.monotonic() >= deadline):
+                        # receive response, or raise TimeoutError
+                        self.cu.flush()
+                    if not stdin or any(key.fileobj is sys.stdin for key, _ in events):
+                        c = self.window.getch()
+                        while c != -1:
+                            if c == ord("q"):
+                                return
+                            elif c == ord("r"):
+                                self.cu.flush()
+                                pending = None
+                                last = None
+                                self.reset()
+                            else:
+                                self.handle_key(c)
+                            c = self.window.getch()
+                except IOError as e:
+                    if e.errno != errno.EINTR:
+                        raise
+
+    def register(self, selector, fileobj):
+        try:
+            selector.register(fileobj, selectors.EVENT_READ)
+        except (OSError, ValueError):
+            return False
+        else:
+            return True
+
+    def select(self, selector, timeout):
+        if selector.get_map():
+            return selector.select(timeout)
+        else:
+            time.sleep(timeout)
+            return []
+
+    def handle_key(self, c):
+        if c == ord(" "):
+            self.cu.start()
+        elif c == 27:  # ESC
+            self.cu.press(ControlUnit.PACE_CAR_ESC_BUTTON_ID)
+        elif c == ord("s"):
+            self.cu.press(ControlUnit.SPEED_BUTTON_ID)
+        elif c == ord("b"):
+            self.cu.press(ControlUnit.BRAKE_BUTTON_ID)
+        elif c == ord("f"):
+            self.cu.press(ControlUnit.FUEL_BUTTON_ID)
+        elif c == ord("c"):
+            self.cu.press(ControlUnit.CODE_BUTTON_ID)
+
+    def handle_data(self, data):
+        if isinstance(data, ControlUnit.Status):
+            self.handle_status(data)
+        elif isinstance(data, ControlUnit.Timer):
+            self.handle_timer(data)
+        else:
+            logging.warning("Unknown data from CU: %r", data)
 
     def handle_status(self, status):
         for driver, fuel in zip(self.drivers, status.fuel):
@@ -134,51 +206,62 @@ class RMS(object):
         self.status = status
 
     def handle_timer(self, timer):
-        driver = self.drivers[timer.address]
-        driver.newlap(timer)
-        if self.maxlaps < driver.laps:
-            self.maxlaps = driver.laps
-            # position tower only handles 250 laps
-            self.cu.setlap(self.maxlaps % 250)
+        self.history.add(timer)
+        if timer.sector != 1:
+            return  # ignore Check Lane times
+        self.standings.update(timer)
         if self.start is None:
             self.start = timer.timestamp
 
-    def update(self, blink=lambda: (time.time() * 2) % 2 == 0):
+    def update(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.rendered < 1.0 / self.REFRESH_RATE:
+            return
+        self.rendered = now
         window = self.window
-        window.erase()
         nlines, ncols = window.getmaxyx()
-        window.addnstr(0, 0, self.HEADER.ljust(ncols), ncols, self.titleattr)
-        window.addnstr(nlines - 2, 0, self.FOOTER1, ncols - 1)
-        window.addnstr(nlines - 1, 0, self.FOOTER2, ncols - 1)
+        if self.size != (nlines, ncols):
+            window.erase()
+            self.rows.clear()
+            self.size = (nlines, ncols)
 
         start = self.status.start
         if start == 0 or start == 7:
-            pass
+            lights = 0
         elif start == 1:
-            window.chgat(nlines - 2, 0, 2 * 5, self.lightattr)
+            lights = 2 * 5
         elif start < 7:
-            window.chgat(nlines - 2, 0, 2 * (start - 1), self.lightattr)
-        elif int(time.time() * 2) % 2 == 0:  # A_BLINK may not be supported
-            window.chgat(nlines - 2, 0, 2 * 5, self.lightattr)
+            lights = 2 * (start - 1)
+        elif int(now * 2) % 2 == 0:  # A_BLINK may not be supported
+            lights = 2 * 5
+        else:
+            lights = 0
 
-        drivers = [driver for driver in self.drivers if driver.time]
-        for pos, driver in enumerate(sorted(drivers, key=posgetter), start=1):
+        rows = {
+            0: (self.HEADER.ljust(ncols), ncols, self.titleattr, 0),
+            nlines - 2: (self.FOOTER1, ncols - 1, 0, lights),
+            nlines - 1: (self.FOOTER2, ncols - 1, 0, 0),
+        }
+        history = self.history
+        for pos, address, laps, timestamp, gap, _ in self.standings.entries():
+            driver = self.drivers[address]
+            laptime = formattime(history.last(address))
+            best = history.best(address)
+            bestlap = formattime(best[0][1] if best else None)
             if pos == 1:
-                leader = driver
-                t = formattime(driver.time - self.start, True)
-            elif driver.laps == leader.laps:
-                t = "+%ss" % formattime(driver.time - leader.time)
+                t = formattime(timestamp - self.start, True)
+            elif gap[0] == 0:
+                t = "+%ss" % formattime(gap[1])
             else:
-                gap = leader.laps - driver.laps
-                t = "+%d Lap%s" % (gap, "s" if gap != 1 else "")
+                t = "+%d Lap%s" % (gap[0], "s" if gap[0] != 1 else "")
             if (self.status.mode & self.FUEL_MASK) != 0:
                 text = self.FORMAT1.format(
                     pos=pos,
                     car=driver.num,
                     time=t,
-                    laps=driver.laps,
-                    laptime=formattime(driver.laptime),
-                    bestlap=formattime(driver.bestlap),
+                    laps=laps,
+                    laptime=laptime,
+                    bestlap=bestlap,
                     fuel=driver.fuel / 15.0,
                     pits=driver.pits,
                 )
@@ -187,12 +270,31 @@ class RMS(object):
                     pos=pos,
                     car=driver.num,
                     time=t,
-                    laps=driver.laps,
-                    laptime=formattime(driver.laptime),
-                    bestlap=formattime(driver.bestlap),
+                    laps=laps,
+                    laptime=laptime,
+                    bestlap=bestlap,
                 )
-            window.addnstr(pos, 0, text, ncols)
-        window.refresh()
+            rows.setdefault(pos, (text, ncols, 0, 0))
+
+        # only rewrite rows that changed since the last update
+        dirty = False
+        for y in set(self.rows) - set(rows):
+            window.move(y, 0)
+            window.clrtoeol()
+            del self.rows[y]
+            dirty = True
+        for y, row in rows.items():
+            if self.rows.get(y) != row:
+                text, n, attr, highlight = row
+                window.move(y, 0)
+                window.clrtoeol()
+                window.addnstr(y, 0, text, n, attr)
+                if highlight:
+                    window.chgat(y, 0, highlight, self.lightattr)
+                self.rows[y] = row
+                dirty = True
+        if dirty:
+            window.refresh()
 
 
 parser = argparse.ArgumentParser(prog="python -m carreralib")
@@ -205,6 +307,15 @@ parser.add_argument(
 parser.add_argument(
     "-l", "--logfile", default="carreralib.log", help="where to write log messages"
 )
+parser.add_argument(
+    "-r", "--record", metavar="FILE", help="record Control Unit traffic to FILE"
+)
+parser.add_argument(
+    "-R",
+    "--reconnect",
+    action="store_true",
+    help="reconnect automatically if the connection is lost",
+)
 parser.add_argument(
     "-t",
     "--timeout",
@@ -217,15 +328,13 @@ parser.add_argument(
 )
 args = parser.parse_args()
 
-logging.basicConfig(
+trace.start_logging(
+    args.logfile,
     level=logging.DEBUG if args.verbose else logging.WARN,
-    filename=args.logfile,
     format="%(asctime)s: %(message)s",
 )
 
 if args.device is None:
-    from . import connection
-
     parser.print_help()
     print("\ndevices:")
     nfound = 0
@@ -236,7 +345,20 @@ if args.device is None:
         print("  none found")
     quit()
 
-with contextlib.closing(ControlUnit(args.device, timeout=args.timeout)) as cu:
+if args.reconnect:
+    from .reconnect import ReconnectingConnection
+
+    conn = ReconnectingConnection(args.device, timeout=args.timeout)
+else:
+    conn = connection.open(args.device, timeout=args.timeout)
+if args.record:
+    from .capture import CaptureWriter, RecordingConnection
+
+    conn = RecordingConnection(conn, CaptureWriter(args.record))
+
+with contextlib.closing(ControlUnit(conn)) as cu:
+    if args.verbose:
+        cu.trace = trace.LogTrace(logging.getLogger("carreralib"))
     print("CU version %s" % cu.version())
 
     def run(win):
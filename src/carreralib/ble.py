@@ -1,112 +1,332 @@
+"""Bluetooth LE connections using Carrera AppConnect®."""
+
 import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import itertools
 import logging
-import queue
+import re
 import threading
+import time
+import types
+from collections import deque
 
-from .connection import BufferTooShort, Connection, TimeoutError
+from .connection import (
+    AsyncConnection,
+    BufferTooShort,
+    Connection,
+    ConnectionError,
+    TimeoutError,
+)
 
 SERVICE_UUID = "39df7777-b1b4-b90b-57f1-7144ae4e4a6a"
 OUTPUT_UUID = "39df8888-b1b4-b90b-57f1-7144ae4e4a6a"
 NOTIFY_UUID = "39df9999-b1b4-b90b-57f1-7144ae4e4a6a"
 
+# name advertised by Control Unit/AppConnect devices
+CU_NAME = "Control_Unit"
+
 logger = logging.getLogger(__name__)
 
+_manager = None
 
-class BleakThread(threading.Thread):
-    STOP_DATA = b""
+_manager_lock = threading.Lock()
 
-    def __init__(self, address):
-        super().__init__()
-        self.__address = address
-        self.__connected = threading.Event()
+
+class BLEManager(object):
+    """Shared event loop thread and connection pool for BLE devices.
+
+    All BLE connections managed by a :class:`BLEManager` are served
+    by a single event loop running in a background thread, which is
+    started when first needed.  When a connection is closed, the
+    underlying BLE link is kept open for `linger` seconds, so it may
+    be reused by a subsequent connection to the same device.  Devices
+    found by :meth:`discover` are cached for `ttl` seconds.
+
+    `backend` should provide ``BleakClient``, ``BleakScanner`` and
+    ``BleakError`` compatible with the :mod:`bleak` package, and
+    defaults to :mod:`bleak` itself.
+
+    """
+
+    def __init__(self, backend=None, ttl=30.0, linger=10.0):
+        self.__backend = backend
+        self.__ttl = ttl
+        self.__linger = linger
+        self.__lock = threading.Lock()
         self.__loop = None
-        self.__input = queue.Queue()
-        self.__output = None
+        self.__thread = None
+        self.__links = {}
+        self.__devices = None
 
-    def run(self):
-        asyncio.run(self.main())
+    def close(self):
+        """Close all BLE links and stop the event loop thread."""
+        with self.__lock:
+            loop, thread = self.__loop, self.__thread
+            self.__loop = self.__thread = None
+        if thread is not None and thread.is_alive():
+            future = asyncio.run_coroutine_threadsafe(self.__close(), loop)
+            try:
+                future.result()
+            finally:
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
 
-    def start(self, timeout=None):
-        super().start()
-        if not self.__connected.wait(timeout):
-            raise TimeoutError("Timeout waiting for BLE connection")
+    def connect(self, address, timeout=None):
+        """Return a link to the BLE device `address`, reusing an idle
+        link to the device if available.
 
-    def recv(self, timeout):
+        Each link may only be used by a single connection at a time.
+        This is used by :class:`BLEConnection`, and is usually not
+        called directly.
+
+        """
+        return self.__run(self.__connect(address), timeout)
+
+    def discover(self, timeout=5.0, refresh=False):
+        """Return a list of ``(address, name)`` tuples for all Control
+        Units found within `timeout` seconds.
+
+        Results are cached, so the scan is only repeated after `ttl`
+        seconds have passed, or if `refresh` is true.  Devices
+        currently connected are always included, since they are no
+        longer advertised.
+
+        """
+        cached = self.__devices
+        if refresh or cached is None or time.monotonic() - cached[0] >= self.__ttl:
+            devices = self.__run(self.__discover(timeout))
+            if devices is None:
+                return []
+            self.__devices = cached = (time.monotonic(), devices)
+        devices = list(cached[1])
+        for address in list(self.__links):
+            if address not in (a for a, _ in devices):
+                devices.append((address, CU_NAME))
+        return devices
+
+    def __bleak(self):
+        if self.__backend is None:
+            import bleak
+            import bleak.exc
+
+            self.__backend = types.SimpleNamespace(
+                BleakClient=bleak.BleakClient,
+                BleakScanner=bleak.BleakScanner,
+                BleakError=bleak.exc.BleakError,
+            )
+        return self.__backend
+
+    def __run(self, coro, timeout=None):
+        with self.__lock:
+            if self.__thread is None:
+                self.__loop = loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(
+                    target=loop.run_forever, name="BLEManager", daemon=True
+                )
+                self.__thread.start()
+            loop = self.__loop
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
         try:
-            return self.__input.get(timeout=timeout)
-        except queue.Empty:
-            raise TimeoutError("Timeout waiting for BLE input")
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError("Timeout waiting for BLE device")
 
-    def send(self, data, timeout):
-        # avoid RuntimeWarning if loop is already closed
-        if self.__loop.is_running():
+    async def __connect(self, address):
+        link = self.__links.get(address)
+        if link is not None and link.connected:
+            if link.busy:
+                raise ConnectionError("BLE device %s already in use" % address)
+            if link.idle is not None:
+                link.idle.cancel()
+                link.idle = None
+            link.discard()
+            link.busy = True
+            logger.debug("Reusing BLE link: %r", link.client)
+            return link
+        backend = self.__bleak()
+        loop = asyncio.get_running_loop()
+        link = _Link(self, loop)
+        link.client = client = backend.BleakClient(
+            address, disconnected_callback=link.disconnected
+        )
+        try:
+            await client.connect()
+        except (backend.BleakError, asyncio.TimeoutError) as e:
+            raise ConnectionError("Error connecting to %s: %s" % (address, e))
+        logger.info("Connected to BLE device: %r", client)
+        await client.start_notify(NOTIFY_UUID, link.notify)
+        link.writer = loop.create_task(link.write())
+        link.busy = True
+        self.__links[address] = link
+        return link
 
-            async def coro():
-                await self.__output.put(data)
+    async def __discover(self, timeout):
+        backend = self.__bleak()
+        try:
+            found = await backend.BleakScanner.discover(timeout=timeout)
+        except backend.BleakError as e:
+            logger.warning("Error scanning for BLE devices: %s", e)
+            return None
+        return [(d.address, d.name) for d in found if d.name == CU_NAME]
 
-            try:
-                f = asyncio.run_coroutine_threadsafe(coro(), self.__loop)
-                return f.result(timeout=timeout)
-            except RuntimeError:
-                if self.__loop.is_running():
-                    raise
+    async def __close(self):
+        links, self.__links = self.__links, {}
+        for link in links.values():
+            logger.info("Closing BLE connection: %r", link.client)
+            link.stop()
+            await link.client.disconnect()
 
-    def stop(self, timeout=None):
-        self.send(self.STOP_DATA, timeout)
+    def _release(self, address, link):
+        # called from the event loop thread
+        link.busy = False
+        if not link.connected:
+            if self.__links.get(address) is link:
+                del self.__links[address]
+        elif self.__linger:
+            link.idle = link.loop.call_later(
+                self.__linger,
+                lambda: link.loop.create_task(self._disconnect(address, link)),
+            )
+        else:
+            link.loop.create_task(self._disconnect(address, link))
 
-    async def main(self):
-        from bleak import BleakClient
+    async def _disconnect(self, address, link):
+        if self.__links.get(address) is link and not link.busy:
+            del self.__links[address]
+            logger.info("Closing BLE connection: %r", link.client)
+            link.stop()
+            await link.client.disconnect()
 
-        self.__loop = asyncio.get_running_loop()
-        self.__output = asyncio.Queue()
 
-        async with BleakClient(self.__address) as client:
-            logger.info("Connected to BLE device: %r", client)
+class _Link(object):
+    def __init__(self, manager, loop):
+        self.manager = manager
+        self.loop = loop
+        self.client = None
+        self.frames = _FrameBuffer()
+        self.ready = threading.Condition()
+        self.output = asyncio.Queue()
+        self.writer = None
+        self.connected = True
+        self.busy = False
+        self.idle = None
 
-            def notify(_, data: bytearray):
-                logger.debug("Received BLE notification: %r", data)
-                try:
-                    self.__input.put_nowait(data)
-                except asyncio.QueueFull:
-                    logger.error("BLE input queue is full")
+    def notify(self, _, data: bytearray):
+        with self.ready:
+            _feed(self.frames, data)
+            self.ready.notify()
 
-            await client.start_notify(NOTIFY_UUID, notify)
+    def disconnected(self, client):
+        if self.connected:
+            logger.warning("BLE device disconnected: %r", client)
+            self.stop()
 
-            self.__connected.set()
+    def stop(self):
+        if self.connected:
+            with self.ready:
+                self.connected = False
+                self.ready.notify()
+            if self.writer is not None:
+                self.writer.cancel()
 
-            while True:
-                data = await self.__output.get()
-                if data is not self.STOP_DATA:
-                    logger.debug("Writing BLE data: %r", data)
-                    await client.write_gatt_char(OUTPUT_UUID, data)
-                else:
-                    break
+    async def write(self):
+        while True:
+            data = await self.output.get()
+            try:
+                await self.client.write_gatt_char(OUTPUT_UUID, data)
+            except Exception as e:
+                logger.error("Error writing to BLE device: %s", e)
+                self.stop()
+                break
+
+    def discard(self):
+        with self.ready:
+            self.frames.clear()
+
+    @contextlib.contextmanager
+    def recv(self, timeout):
+        # message is only valid while the lock is held
+        with self.ready:
+            frame = self.ready.wait_for(
+                lambda: self.frames.next() or not self.connected, timeout
+            )
+            if not frame:
+                # responses to requests sent so far are considered lost
+                self.frames.untag()
+                raise TimeoutError("Timeout waiting for BLE input")
+            elif frame is True:
+                raise ConnectionError("BLE connection lost")
+            yield frame[1]
+
+    def send(self, data):
+        with self.ready:
+            if not self.connected:
+                raise ConnectionError("BLE connection lost")
+            self.frames.tag(data)
+        try:
+            self.loop.call_soon_threadsafe(self.output.put_nowait, data)
+        except RuntimeError:
+            raise ConnectionError("BLE connection lost")
+
+    def release(self, address):
+        try:
+            self.loop.call_soon_threadsafe(self.manager._release, address, self)
+        except RuntimeError:
+            pass  # event loop already closed
 
-            logger.info("Closing BLE connection: %r", client)
+
+def get_manager():
+    """Return the shared :class:`BLEManager` used by default."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BLEManager()
+            atexit.register(_manager.close)
+        return _manager
 
 
 class BLEConnection(Connection):
-    def __init__(self, address, timeout=1.0):
-        self.__thread = t = BleakThread(address)
+    """Connection to the BLE device `address` using `manager`, or the
+    shared :class:`BLEManager` returned by :func:`get_manager`."""
+
+    __link = None
+
+    def __init__(self, address, timeout=1.0, manager=None):
+        if manager is None:
+            manager = get_manager()
+        self.__address = address
         self.__timeout = timeout
-        t.start()
+        self.__link = manager.connect(address)
 
     def close(self):
-        self.__thread.stop()
-        self.__thread.join()
+        if self.__link is not None:
+            self.__link.release(self.__address)
+            self.__link = None
+
+    def discard(self):
+        self.__link.discard()
 
     def recv(self, maxlength=None):
-        buf = self.__thread.recv(self.__timeout)
-        # BLE notifications ending with '$' do not start with command letter
-        if buf.endswith(b"$"):
-            if len(buf) == 6:
-                buf = b"0" + buf[:-1]
+        with self.__link.recv(self.__timeout) as message:
+            if maxlength is not None and maxlength < len(message):
+                raise BufferTooShort("Buffer too short for data received")
             else:
-                buf = b"?" + buf[:-1]
-        if maxlength is not None and maxlength < len(buf):
-            raise BufferTooShort("Buffer too short for data received")
-        else:
-            return buf
+                return bytes(message)
+
+    def recv_into(self, buf, offset=0):
+        view = memoryview(buf).cast("B")
+        if offset < 0 or offset > len(view):
+            raise ValueError("offset out of range")
+        with self.__link.recv(self.__timeout) as message:
+            size = len(message)
+            if size > len(view) - offset:
+                raise BufferTooShort("Buffer too short for data received")
+            view[offset : offset + size] = message
+            return size
 
     def send(self, buf, offset=0, size=None):
         n = len(buf)
@@ -120,24 +340,196 @@ class BLEConnection(Connection):
             raise ValueError("size is negative")
         elif offset + size > n:
             raise ValueError("buffer length < offset + size")
-        self.__thread.send(buf[offset : offset + size], self.__timeout)
+        self.__link.send(bytes(buf[offset : offset + size]))
 
     max_fwu_block_size = 18
 
     @classmethod
     def scan(_):
-        from bleak import BleakScanner
-        from bleak.exc import BleakError
+        yield from get_manager().discover()
+
+
+class AsyncBLEConnection(AsyncConnection):
+    """Asynchronous connection to the BLE device `address`.
+
+    `timeout` applies to receiving messages.  Connecting may take
+    considerably longer, and is limited by `connect_timeout`, or only
+    by the BLE backend if :const:`None`.
 
-        def is_cu(device, *_):
-            return device.name == "Control_Unit"
+    """
 
-        async def discover():
-            # TODO: this will return only the first CU/AppConnect device found
+    def __init__(self, address, timeout=1.0, connect_timeout=None):
+        self.__address = address
+        self.__timeout = timeout
+        self.__connect_timeout = connect_timeout
+        self.__client = None
+        self.__frames = _FrameBuffer()
+        self.__ready = None
+
+    async def open(self):
+        from bleak import BleakClient
+
+        self.__ready = asyncio.Event()
+        self.__client = client = BleakClient(self.__address)
+        try:
+            await asyncio.wait_for(client.connect(), self.__connect_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timeout waiting for BLE connection")
+        logger.info("Connected to BLE device: %r", client)
+        await client.start_notify(NOTIFY_UUID, self.__notify)
+
+    async def close(self):
+        if self.__client is not None:
+            logger.info("Closing BLE connection: %r", self.__client)
+            await self.__client.disconnect()
+            self.__client = None
+
+    async def recv(self, maxlength=None):
+        frames = self.__frames
+        frame = frames.next()
+        while frame is None:
+            self.__ready.clear()
             try:
-                device = await BleakScanner.find_device_by_filter(is_cu)
-                return [(device.address, device.name)] if device else []
-            except BleakError:
-                return []
+                await asyncio.wait_for(self.__ready.wait(), self.__timeout)
+            except asyncio.TimeoutError:
+                frames.untag()
+                raise TimeoutError("Timeout waiting for BLE input")
+            frame = frames.next()
+        _, message = frame
+        if maxlength is not None and maxlength < len(message):
+            raise BufferTooShort("Buffer too short for data received")
+        else:
+            return bytes(message)
+
+    async def send(self, buf, offset=0, size=None):
+        n = len(buf)
+        if offset < 0:
+            raise ValueError("offset is negative")
+        elif n < offset:
+            raise ValueError("buffer length < offset")
+        elif size is None:
+            size = n - offset
+        elif size < 0:
+            raise ValueError("size is negative")
+        elif offset + size > n:
+            raise ValueError("buffer length < offset + size")
+        data = bytes(buf[offset : offset + size])
+        self.__frames.tag(data)
+        await self.__client.write_gatt_char(OUTPUT_UUID, data)
+
+    max_fwu_block_size = 18
+
+    def __notify(self, _, data: bytearray):
+        _feed(self.__frames, data)
+        self.__ready.set()
+
+
+class _FrameBuffer(object):
+    """Preallocated buffer for reassembling frames terminated by '$'
+    or '#' from BLE notifications.
+
+    Notifications may contain partial frames, or several frames at
+    once.  Frames terminated by '$' do not start with the command
+    letter they respond to, so each frame is tagged with the command
+    letter of the oldest request sent but not yet responded to.
+    Responses to some commands, e.g. ``J`` or ``T``, are echoes of
+    the command letter without a terminator.  At the start of a
+    notification and a frame boundary, each byte matching the command
+    letter of the next pending request is taken as such an echo.
+
+    """
+
+    TERMINATOR = re.compile(b"[$#]")
+
+    def __init__(self, size=4096):
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__tags = deque()
+        self.clear()
+
+    def clear(self):
+        """Discard all data received and requests sent."""
+        # keep one byte in front of the first frame for its tag
+        self.__start = self.__end = self.__pos = 1
+        self.__nframes = 0
+        self.__tags.clear()
+
+    def tag(self, data):
+        """Register a request expecting a response."""
+        self.__tags.append(data[0:1])
+
+    def untag(self):
+        """Discard all requests not yet responded to."""
+        self.__tags.clear()
+
+    def feed(self, data):
+        """Append notification `data` to the buffer."""
+        buffer = self.__buffer
+        end = self.__end
+        necho = 0
+        if self.__start == end or buffer[end - 1] in b"$#":
+            for tag in itertools.islice(self.__tags, self.__nframes, None):
+                if data[necho : necho + 1] != tag:
+                    break
+                necho += 1
+        nframes = necho + data.count(b"$", necho) + data.count(b"#", necho)
+        # terminate each echo as is, without prepending its tag
+        size = len(data) + necho
+        if end + size > len(buffer):
+            self.__compact()
+            end = self.__end
+            if end + size > len(buffer):
+                raise BufferTooShort("BLE input buffer overflow")
+        for index in range(necho):
+            buffer[end] = data[index]
+            buffer[end + 1] = 0x23  # '#'
+            end += 2
+        self.__view[end : self.__end + size] = memoryview(data)[necho:]
+        self.__end += size
+        self.__nframes += nframes
+
+    def next(self):
+        """Return the next complete frame as a ``(tag, message)``
+        tuple, or :const:`None`.
+
+        `tag` is the command letter of the request the frame responds
+        to, or an empty bytes object if unknown.  `message` is a
+        memoryview of the frame without its terminator, starting with
+        `tag` like messages received via a serial connection.  It
+        remains valid until :meth:`feed` or :meth:`clear` is called.
+
+        """
+        buffer = self.__buffer
+        match = self.TERMINATOR.search(buffer, self.__pos, self.__end)
+        if match is None:
+            self.__pos = self.__end
+            return None
+        start = self.__start
+        stop = match.start()
+        if stop + 1 == self.__end:
+            # reuse buffer from the start
+            self.__start = self.__end = self.__pos = 1
+        else:
+            self.__start = self.__pos = stop + 1
+        self.__nframes -= 1
+        tag = self.__tags.popleft() if self.__tags else b""
+        if tag and buffer[stop] == 0x24:  # '$'
+            # the preceding byte is either reserved or a terminator
+            start -= 1
+            buffer[start] = tag[0]
+        return tag, self.__view[start:stop]
+
+    def __compact(self):
+        start, end = self.__start, self.__end
+        size = end - start
+        self.__view[1 : 1 + size] = self.__view[start:end]
+        self.__pos -= start - 1
+        self.__start, self.__end = 1, 1 + size
+
 
-        yield from asyncio.run(discover())
+def _feed(frames, data):
+    try:
+        frames.feed(data)
+    except BufferTooShort:
+        logger.error("BLE input buffer overflow, discarding data")
+        frames.clear()
@@ -0,0 +1,318 @@
+"""Recording and replay of raw Control Unit traffic.
+
+Captures use a compact, append-only binary format, so they can be
+written while a race is running and read back while still being
+written.  A capture file starts with the 8-byte magic string
+``CRLCAP01``, followed by the wall clock time at which recording
+started as a little-endian IEEE 754 double, followed by any number of
+records.
+
+Each record consists of a direction byte (``>`` for messages sent to
+the CU, ``<`` for messages received from the CU), the time elapsed
+since the previous record in microseconds as a little-endian unsigned
+32-bit integer, the length of the message as a little-endian unsigned
+16-bit integer, and the message bytes.
+
+An optional index file, starting with the magic string ``CRLIDX01``,
+contains entries of three little-endian unsigned 64-bit integers: the
+record number, the time of the preceding record since the start of
+the capture in microseconds, and the offset of the record in the
+capture file.
+
+"""
+
+import struct
+import time
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlsplit
+
+from .connection import Connection, TimeoutError
+
+SENT = b">"
+"""Direction of messages sent to the CU."""
+
+RECEIVED = b"<"
+"""Direction of messages received from the CU."""
+
+CAPTURE_MAGIC = b"CRLCAP01"
+
+INDEX_MAGIC = b"CRLIDX01"
+
+_HEADER = struct.Struct("<d")
+
+_RECORD = struct.Struct("<cIH")
+
+_INDEX = struct.Struct("<QQQ")
+
+
+class Record(namedtuple("Record", "direction timestamp data")):
+    """A captured message.
+
+    :attr:`direction` is either :const:`SENT` or :const:`RECEIVED`,
+    :attr:`timestamp` is the time since the start of the capture in
+    seconds, and :attr:`data` is the message as a bytes object.
+
+    """
+
+    __slots__ = ()
+
+
+class CaptureWriter(object):
+    """Write a capture to `file`, which may be a path or a binary file
+    object opened for writing.
+
+    If `index` is given, an index entry is written to this path or
+    file object for every `index_interval` records.
+
+    """
+
+    def __init__(self, file, index=None, index_interval=256):
+        self.__file, self.__owned = _open(file, "wb")
+        if index is not None:
+            self.__index, self.__owns_index = _open(index, "wb")
+        else:
+            self.__index, self.__owns_index = None, False
+        self.__interval = index_interval
+        self.__count = 0
+        self.__elapsed = 0
+        self.__offset = len(CAPTURE_MAGIC) + _HEADER.size
+        self.__file.write(CAPTURE_MAGIC + _HEADER.pack(time.time()))
+        if self.__index is not None:
+            self.__index.write(INDEX_MAGIC)
+        self.__last = time.monotonic_ns() // 1000
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Flush and close the capture.
+
+        File objects passed to the constructor are flushed, but not
+        closed.
+
+        """
+        files = [(self.__file, self.__owned), (self.__index, self.__owns_index)]
+        for f, owned in files:
+            if f is not None and not f.closed:
+                f.flush()
+                if owned:
+                    f.close()
+
+    def flush(self):
+        """Flush buffered records to the underlying files."""
+        self.__file.flush()
+        if self.__index is not None:
+            self.__index.flush()
+
+    def write(self, direction, data):
+        """Append a record for message `data` sent in `direction`."""
+        now = time.monotonic_ns() // 1000
+        delta = min(now - self.__last, 0xFFFFFFFF)
+        self.__last = now
+        if self.__index is not None and self.__count % self.__interval == 0:
+            entry = _INDEX.pack(self.__count, self.__elapsed, self.__offset)
+            self.__index.write(entry)
+        self.__elapsed += delta
+        record = _RECORD.pack(direction, delta, len(data))
+        self.__file.write(record)
+        self.__file.write(data)
+        self.__offset += len(record) + len(data)
+        self.__count += 1
+
+
+class CaptureReader(object):
+    """Read a capture from `file`, which may be a path or a binary
+    file object opened for reading.
+
+    Iterating over a :class:`CaptureReader` yields :class:`Record`
+    instances.  A truncated final record, e.g. from a capture that is
+    still being written, is silently ignored.
+
+    """
+
+    def __init__(self, file, index=None):
+        self.__file, self.__owned = _open(file, "rb")
+        magic = self.__file.read(len(CAPTURE_MAGIC))
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("Not a capture file")
+        (self.started,) = _HEADER.unpack(self.__file.read(_HEADER.size))
+        self.__index = None if index is None else _read_index(index)
+        self.__elapsed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.read()
+        if record is None:
+            raise StopIteration
+        return record
+
+    def close(self):
+        """Close the capture."""
+        if self.__owned:
+            self.__file.close()
+
+    def read(self):
+        """Return the next record, or :const:`None` at the end of the
+        capture."""
+        f = self.__file
+        offset = f.tell()
+        header = f.read(_RECORD.size)
+        if len(header) == _RECORD.size:
+            direction, delta, size = _RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) == size:
+                self.__elapsed += delta
+                return Record(direction, self.__elapsed / 1e6, data)
+        # rewind to allow reading a record that is still being written
+        f.seek(offset)
+        return None
+
+    def seek(self, timestamp):
+        """Skip all records before `timestamp` seconds since the start
+        of the capture.
+
+        If an index was given, this will seek directly to the last
+        indexed record before `timestamp`.
+
+        """
+        micros = int(timestamp * 1e6)
+        if self.__index is not None:
+            best = None
+            for entry in self.__index:
+                if entry[1] > micros:
+                    break
+                best = entry
+            if best is not None and best[2] > self.__file.tell():
+                _, self.__elapsed, offset = best
+                self.__file.seek(offset)
+        while True:
+            offset = self.__file.tell()
+            elapsed = self.__elapsed
+            record = self.read()
+            if record is None:
+                return
+            if self.__elapsed >= micros:
+                self.__file.seek(offset)
+                self.__elapsed = elapsed
+                return
+
+
+class RecordingConnection(Connection):
+    """Connection wrapper recording all messages sent and received
+    over `connection` to `writer`, a :class:`CaptureWriter`."""
+
+    def __init__(self, connection, writer):
+        self.__connection = connection
+        self.__writer = writer
+        self.max_fwu_block_size = connection.max_fwu_block_size
+
+    def close(self):
+        self.__connection.close()
+        self.__writer.close()
+
+    def cork(self):
+        self.__connection.cork()
+
+    def uncork(self):
+        self.__connection.uncork()
+
+    def fileno(self):
+        return self.__connection.fileno()
+
+    def recv(self, maxlength=None):
+        buf = self.__connection.recv(maxlength)
+        self.__writer.write(RECEIVED, buf)
+        return buf
+
+    def send(self, buf, offset=0, size=None):
+        self.__connection.send(buf, offset, size)
+        if size is None:
+            size = len(buf) - offset
+        self.__writer.write(SENT, bytes(buf[offset : offset + size]))
+
+    def send_many(self, bufs):
+        bufs = [bytes(buf) for buf in bufs]
+        self.__connection.send_many(bufs)
+        for buf in bufs:
+            self.__writer.write(SENT, buf)
+
+
+class ReplayConnection(Connection):
+    """Connection replaying the messages received in a capture.
+
+    Messages sent over this connection are ignored, and each call to
+    :meth:`recv` returns the next message received in the capture.  If
+    `speed` is zero, messages are replayed as fast as possible;
+    otherwise, messages are replayed in real time multiplied by
+    `speed`.  When the end of the capture is reached,
+    :exc:`carreralib.connection.TimeoutError` is raised.
+
+    """
+
+    def __init__(self, file, speed=1.0, timeout=None):
+        if speed < 0:
+            raise ValueError("Replay speed out of range")
+        self.__reader = CaptureReader(file)
+        self.__speed = speed
+        self.__start = None
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """Create a :class:`ReplayConnection` from a URL of the form
+        ``replay:PATH?speed=SPEED``."""
+        parts = urlsplit(url)
+        params = dict(parse_qsl(parts.query))
+        speed = float(params.get("speed", 1.0))
+        return cls(parts.path, speed=speed, **kwargs)
+
+    def close(self):
+        self.__reader.close()
+
+    def recv(self, maxlength=None):
+        for record in self.__reader:
+            if record.direction == RECEIVED:
+                break
+        else:
+            raise TimeoutError("End of capture reached")
+        if self.__speed:
+            now = time.monotonic()
+            if self.__start is None:
+                self.__start = now - record.timestamp / self.__speed
+            delay = self.__start + record.timestamp / self.__speed - now
+            if delay > 0:
+                time.sleep(delay)
+        return record.data
+
+    def send(self, buf, offset=0, size=None):
+        pass
+
+
+def _open(file, mode):
+    if isinstance(file, (str, bytes)) or hasattr(file, "__fspath__"):
+        return open(file, mode), True
+    else:
+        return file, False
+
+
+def _read_index(index):
+    f, owned = _open(index, "rb")
+    try:
+        if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError("Not a capture index file")
+        data = f.read()
+    finally:
+        if owned:
+            f.close()
+    n = len(data) // _INDEX.size
+    return [_INDEX.unpack_from(data, i * _INDEX.size) for i in range(n)]
@@ -30,6 +30,45 @@ class Connection(object):
         """Close the connection."""
         pass
 
+    def cork(self):
+        """Queue subsequently sent messages until :meth:`uncork` is
+        called.
+
+        This allows connections to transmit several messages with a
+        single write.  Queued messages are also transmitted before
+        waiting for data in :meth:`recv`.  Calls to :meth:`cork` and
+        :meth:`uncork` may be nested.  The default implementation
+        does nothing.
+
+        """
+        pass
+
+    def uncork(self):
+        """Transmit any messages queued since the matching call to
+        :meth:`cork`."""
+        pass
+
+    def discard(self):
+        """Discard any data received but not yet returned by
+        :meth:`recv`, including partially received messages.
+
+        This may be used to resynchronize with the other end of the
+        connection after an error.  The default implementation does
+        nothing.
+
+        """
+        pass
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable when data
+        is received, e.g. for use with :mod:`selectors`, or
+        :const:`None` if the connection does not provide one.
+
+        The default implementation returns :const:`None`.
+
+        """
+        return None
+
     def recv(self, maxlength=None):
         """Return a complete message of byte data sent from the other
         end of the connection as a bytes object.
@@ -37,18 +76,95 @@ class Connection(object):
         """
         raise NotImplementedError
 
+    def recv_into(self, buf, offset=0):
+        """Read into `buf` a complete message of byte data sent from
+        the other end of the connection and return the number of
+        bytes in the message.
+
+        `buf` must be a writable object supporting the buffer
+        interface.  If `offset` is given, the message will be written
+        into the buffer from that position.  If the buffer is too
+        short, raise :exc:`BufferTooShort`.
+
+        The default implementation copies the result of :meth:`recv`.
+
+        """
+        view = memoryview(buf).cast("B")
+        if offset < 0 or offset > len(view):
+            raise ValueError("offset out of range")
+        data = self.recv(len(view) - offset)
+        size = len(data)
+        view[offset : offset + size] = data
+        return size
+
     def send(self, buf, offset=0, size=None):
         """Send byte data rom an object supporting the buffer
         interface as a complete message."""
         raise NotImplementedError
 
+    def send_many(self, bufs):
+        """Send byte data from a sequence of objects supporting the
+        buffer interface, each as a complete message.
+
+        The default implementation calls :meth:`send` for each
+        message.  Subclasses may override this to send all messages
+        with a single write.
+
+        """
+        for buf in bufs:
+            self.send(buf)
+
+    max_fwu_block_size = None
+    """Maximum number of bytes in one firmware update frame."""
+
+
+class AsyncConnection(object):
+    """Base class for asynchronous connections to a Carrera digital
+    slotcar system.
+
+    The methods of this class are coroutines to be awaited from an
+    :mod:`asyncio` event loop.
+
+    """
+
+    def __init__(self, device, **kwargs):
+        pass
+
+    async def open(self):
+        """Establish the connection."""
+        pass
+
+    async def close(self):
+        """Close the connection."""
+        pass
+
+    async def recv(self, maxlength=None):
+        """Return a complete message of byte data sent from the other
+        end of the connection as a bytes object.
+
+        """
+        raise NotImplementedError
+
+    async def send(self, buf, offset=0, size=None):
+        """Send byte data from an object supporting the buffer
+        interface as a complete message."""
+        raise NotImplementedError
+
     max_fwu_block_size = None
     """Maximum number of bytes in one firmware update frame."""
 
 
 def open(device, **kwargs):
     """Open a connection to the given device."""
-    if len(device.split(":")) == 6 or len(device.split("-")) == 5:
+    if device.startswith("sim:"):
+        from .sim import SimulatorConnection
+
+        return SimulatorConnection(device, **kwargs)
+    elif device.startswith("replay:"):
+        from .capture import ReplayConnection
+
+        return ReplayConnection.from_url(device, **kwargs)
+    elif isble(device):
         from .ble import BLEConnection
 
         return BLEConnection(device, **kwargs)
@@ -58,6 +174,20 @@ def open(device, **kwargs):
         return SerialConnection(device, **kwargs)
 
 
+async def open_async(device, **kwargs):
+    """Open an asynchronous connection to the given device."""
+    if isble(device):
+        from .ble import AsyncBLEConnection
+
+        conn = AsyncBLEConnection(device, **kwargs)
+    else:
+        from .serial import AsyncSerialConnection
+
+        conn = AsyncSerialConnection(device, **kwargs)
+    await conn.open()
+    return conn
+
+
 def scan():
     """Search for potential devices."""
     from itertools import chain
@@ -65,3 +195,9 @@ def scan():
     from .serial import SerialConnection
 
     return chain(SerialConnection.scan(), BLEConnection.scan())
+
+
+def isble(device):
+    """Return whether `device` is the address of a Bluetooth LE
+    device."""
+    return len(device.split(":")) == 6 or len(device.split("-")) == 5
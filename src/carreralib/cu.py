@@ -1,11 +1,23 @@
+import asyncio
+import contextlib
 import logging
-from collections import namedtuple
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
 
 from . import connection
 from . import protocol
+from .capture import RECEIVED, SENT
 
 logger = logging.getLogger(__name__)
 
+# precompiled formats for the poll hot path
+_STATUS = protocol.Struct("2x8YYYBYC")
+# recent CU versions report two extra unknown bytes with '?:'
+_STATUS_EXT = protocol.Struct("2x8YYYBYxxC")
+_TIMER = protocol.Struct("xYIYC")
+
 
 class ControlUnit(object):
     """Interface to a Carrera Digital 124/132 Control Unit."""
@@ -85,7 +97,22 @@ class ControlUnit(object):
     CODE_BUTTON_ID = 8
     """The Control Unit's CODE button ID."""
 
+    trace = None
+    """Optional callable invoked as ``trace(direction, data)`` for
+    each message sent to or received from the CU; see
+    :mod:`carreralib.trace`."""
+
+    metrics = None
+    """Optional :class:`carreralib.metrics.Metrics` instance for
+    collecting request statistics."""
+
+    window = 1
+    """Maximum number of requests in flight."""
+
     def __init__(self, device, **kwargs):
+        self.__inflight = deque()
+        self.__pipelined = False
+        self.__lock = threading.RLock()
         if isinstance(device, connection.Connection):
             self.__connection = device
         else:
@@ -96,6 +123,9 @@ class ControlUnit(object):
     def close(self):
         """Close the connection to the CU."""
         logger.debug("Closing connection")
+        while self.__inflight:
+            error = connection.ConnectionError("Connection closed")
+            self.__inflight.popleft()[1].set_exception(error)
         self.__connection.close()
 
     def clrpos(self):
@@ -104,7 +134,53 @@ class ControlUnit(object):
 
     def ignore(self, mask):
         """Ignore the controllers represented by bitmask `mask`."""
-        self.request(protocol.pack("cBC", b":", mask))
+        self.__command(protocol.pack("cBC", b":", mask))
+
+    def flush(self):
+        """Wait for the responses to all requests in flight."""
+        with self.__lock:
+            while self.__inflight:
+                self.__receive()
+
+    def events(self, rate=50.0, maxsize=64):
+        """Return an iterator over CU events polled by a background
+        thread.
+
+        The CU is polled at most `rate` times per second, or as fast
+        as possible while timer events are pending.  Repeated
+        :class:`ControlUnit.Timer` and :class:`ControlUnit.Status`
+        responses are only reported once, and at most `maxsize` events
+        are buffered before polling is suspended.  See
+        :class:`carreralib.poller.Poller` for details.
+
+        """
+        from .poller import Poller
+
+        return Poller(self, rate=rate, maxsize=maxsize)
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable when the CU
+        responds, or :const:`None` if the underlying connection does
+        not provide one.
+
+        This may be used to wait for the response to a request sent
+        with :meth:`submit` together with other files, e.g. using
+        :mod:`selectors`, before calling :meth:`flush`.
+
+        """
+        return self.__connection.fileno()
+
+    def pipeline(self, window=32):
+        """Return a context manager for pipelining commands.
+
+        Within the context, commands that do not return a value, such
+        as :meth:`setspeed` or :meth:`setpos`, are sent to the CU
+        without waiting for their responses, keeping up to `window`
+        requests in flight.  All responses have been received when
+        the context is left.
+
+        """
+        return self.__pipeline(window)
 
     def poll(self):
         """Poll the CU for pending messages.
@@ -114,21 +190,7 @@ class ControlUnit(object):
         depending on whether any timer events are pending.
 
         """
-        res = self.request(b"?")
-        if res.startswith(b"?:"):
-            # recent CU versions report two extra unknown bytes with '?:'
-            try:
-                parts = protocol.unpack("2x8YYYBYC", res)
-            except protocol.ChecksumError:
-                parts = protocol.unpack("2x8YYYBYxxC", res)
-            fuel, (start, mode, pitmask, display) = parts[:8], parts[8:]
-            pit = tuple(pitmask & (1 << n) != 0 for n in range(8))
-            return ControlUnit.Status(fuel, start, mode, pit, display)
-        elif res.startswith(b"?"):
-            address, timestamp, sector = protocol.unpack("xYIYC", res)
-            return ControlUnit.Timer(address - 1, timestamp, sector)
-        else:
-            return None  # TODO: raise?
+        return self.__decode_poll(self.request(b"?"))
 
     def press(self, button_id):
         """Simulate pressing the CU button with the given ID."""
@@ -136,23 +198,29 @@ class ControlUnit(object):
 
     def request(self, buf, maxlength=None):
         """Send a message to the CU and wait for a response."""
-        logger.debug("Sending message %r", buf)
-        self.__connection.send(buf)
-        while True:
-            res = self.__connection.recv(maxlength)
-            if not res:
-                logger.warn("Received unknown command response")
-                break
-            elif res.startswith(buf[0:1]):
-                break
-            else:
-                logger.warn("Received unexpected message %r", res)
-        logger.debug("Received message %r", res)
-        return res
+        with self.__lock:
+            if self.__inflight:
+                future = self.submit(buf, maxlength)
+                while not future.done():
+                    self.__receive(maxlength)
+                return future.result()
+            if self.trace is not None:
+                self.trace(SENT, buf)
+            metrics = self.metrics
+            if metrics is None:
+                self.__connection.send(buf)
+                return self.__response(buf[0:1], maxlength)
+            metrics.inc("requests")
+            metrics.sent(buf)
+            start = time.perf_counter()
+            self.__connection.send(buf)
+            res = self.__response(buf[0:1], maxlength)
+            metrics.observe_rtt(buf[0:1], time.perf_counter() - start)
+            return res
 
     def reset(self):
         """Reset the CU timer."""
-        self.request(protocol.pack("cYYC", b"=", 1, 0))
+        self.__command(protocol.pack("cYYC", b"=", 1, 0))
 
     def setbrake(self, address, value):
         """Set the brake value for controller `address`."""
@@ -188,28 +256,97 @@ class ControlUnit(object):
         self.setword(0, address, value, repeat=2)
 
     def setword(self, word, address, value, repeat=1):
-        if word < 0 or word > 31:
-            raise ValueError("Command word out of range")
-        if address < 0 or address > 7:
-            raise ValueError("Address out of range")
-        if value < 0 or value > 15:
-            raise ValueError("Value out of range")
-        if repeat < 1 or repeat > 15:
-            raise ValueError("Repeat count out of range")
-        buf = protocol.pack("cBYYC", b"J", word | address << 5, value, repeat)
-        return self.request(buf)
+        return self.__command(_encode_setword(word, address, value, repeat))
+
+    def setwords(self, words):
+        """Set multiple command words with a single transport write.
+
+        `words` should be a sequence of `(word, address, value)` or
+        `(word, address, value, repeat)` tuples, as would be passed to
+        :meth:`setword`.  All arguments are validated before anything
+        is sent to the CU.  Return the list of responses.
+
+        """
+        bufs = [_encode_setword(*args) for args in words]
+        with self.__lock:
+            self.flush()
+            if self.trace is not None:
+                for buf in bufs:
+                    self.trace(SENT, buf)
+            metrics = self.metrics
+            if metrics is None:
+                self.__connection.send_many(bufs)
+                return [self.__response(buf[0:1]) for buf in bufs]
+            start = time.perf_counter()
+            self.__connection.send_many(bufs)
+            result = []
+            for buf in bufs:
+                metrics.inc("requests")
+                metrics.sent(buf)
+                result.append(self.__response(buf[0:1]))
+                metrics.observe_rtt(buf[0:1], time.perf_counter() - start)
+            return result
 
     def start(self):
         """Initiate the CU start sequence."""
         self.press(self.START_ENTER_BUTTON_ID)
 
+    def submit(self, buf, maxlength=None):
+        """Send a message to the CU without waiting for a response.
+
+        Return a :class:`concurrent.futures.Future` which will be
+        resolved with the response once it has been received, either
+        by a subsequent call to :meth:`request` or :meth:`flush`, or
+        when the number of requests in flight exceeds :attr:`window`.
+        Responses are matched to requests by their command letter in
+        the order the requests were sent.  If the connection is closed
+        before a response has been received, the future raises
+        :exc:`carreralib.connection.ConnectionError`.
+
+        """
+        with self.__lock:
+            while len(self.__inflight) >= self.window:
+                self.__receive(maxlength)
+            future = Future()
+            future.set_running_or_notify_cancel()
+            if self.trace is not None:
+                self.trace(SENT, buf)
+            if self.metrics is not None:
+                self.metrics.inc("requests")
+                self.metrics.sent(buf)
+            self.__connection.send(buf)
+            self.__inflight.append((bytes(buf[0:1]), future, time.perf_counter()))
+            return future
+
+    def submit_poll(self):
+        """Poll the CU without waiting for a response.
+
+        Return a :class:`concurrent.futures.Future` which will be
+        resolved with the value :meth:`poll` would return.  See
+        :meth:`submit` for when the response is received.
+
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def decode(f):
+            try:
+                future.set_result(self.__decode_poll(f.result()))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.submit(b"?").add_done_callback(decode)
+        return future
+
     def version(self):
         """Retrieve the CU version as a string."""
-        res = self.request(b"0")
-        if res:
-            return protocol.unpack("x4sC", res)[0].decode()
-        else:
-            return None  # TODO: raise here?
+        return _decode_version(self.request(b"0"))
+
+    @property
+    def max_fwu_block_size(self):
+        """Maximum number of bytes in one firmware update frame, or
+        :const:`None` if not limited by the connection."""
+        return self.__connection.max_fwu_block_size
 
     def fwu_start(self):
         """Initiate a CU firmware update."""
@@ -218,10 +355,294 @@ class ControlUnit(object):
 
     def fwu_write(self, data):
         """Write CU firmware update data."""
-        if self.__connection.max_fwu_block_size is None:
-            self.request(protocol.pack(f"c{len(data)}sC", b"E", data))
+        for buf in _encode_fwu(data, self.__connection.max_fwu_block_size):
+            self.request(buf)
+
+    def __command(self, buf):
+        if self.__pipelined:
+            return self.submit(buf)
         else:
-            n = self.__connection.max_fwu_block_size
-            for block in (data[i : i + n] for i in range(0, len(data), n)):
-                self.request(protocol.pack(f"cr{len(block)}s", b"F", len(block), block))
-            self.request(protocol.pack("cC", b"E"))
+            return self.request(buf)
+
+    @contextlib.contextmanager
+    def __pipeline(self, window):
+        if window < 1:
+            raise ValueError("Window size out of range")
+        saved = (self.window, self.__pipelined)
+        self.window = window
+        self.__pipelined = True
+        self.__connection.cork()
+        try:
+            try:
+                yield self
+            finally:
+                self.__connection.uncork()
+            self.flush()
+        finally:
+            self.window, self.__pipelined = saved
+
+    def __recv(self, maxlength):
+        try:
+            res = self.__connection.recv(maxlength)
+        except connection.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.inc("timeouts")
+            raise
+        if self.trace is not None:
+            self.trace(RECEIVED, res)
+        if self.metrics is not None:
+            self.metrics.received(res)
+        return res
+
+    def __response(self, cmd, maxlength=None):
+        while True:
+            res = self.__recv(maxlength)
+            if not res:
+                logger.warning("Received unknown command response")
+                self.__count("unknown_responses")
+                break
+            elif res.startswith(cmd):
+                break
+            else:
+                logger.warning("Received unexpected message %r", res)
+                self.__count("unexpected_messages")
+        return res
+
+    def __decode_poll(self, res):
+        metrics = self.metrics
+        if metrics is None:
+            return _decode_poll(res)
+        metrics.inc("polls")
+        try:
+            return _decode_poll(res, metrics)
+        except protocol.ChecksumError:
+            metrics.inc("checksum_errors")
+            raise
+
+    def __count(self, name):
+        if self.metrics is not None:
+            self.metrics.inc(name)
+
+    def __receive(self, maxlength=None):
+        inflight = self.__inflight
+        try:
+            res = self.__recv(maxlength)
+        except connection.ConnectionError as e:
+            while inflight:
+                inflight.popleft()[1].set_exception(e)
+            raise
+        if not res:
+            logger.warning("Received unknown command response")
+            self.__count("unknown_responses")
+            if inflight:
+                inflight.popleft()[1].set_result(res)
+            return
+        cmd = res[0:1]
+        for index, (c, future, start) in enumerate(inflight):
+            if c == cmd:
+                del inflight[index]
+                if self.metrics is not None:
+                    self.metrics.observe_rtt(c, time.perf_counter() - start)
+                future.set_result(res)
+                break
+        else:
+            logger.warning("Received unexpected message %r", res)
+            self.__count("unexpected_messages")
+
+
+class AsyncControlUnit(object):
+    """Asynchronous interface to a Carrera Digital 124/132 Control Unit.
+
+    This provides the same methods as :class:`ControlUnit`, but as
+    coroutines to be awaited from an :mod:`asyncio` event loop, and
+    operates on an :class:`carreralib.connection.AsyncConnection`.
+    Use :meth:`open` to create an instance for a given device.
+
+    """
+
+    Status = ControlUnit.Status
+
+    Timer = ControlUnit.Timer
+
+    PACE_CAR_ESC_BUTTON_ID = ControlUnit.PACE_CAR_ESC_BUTTON_ID
+
+    START_ENTER_BUTTON_ID = ControlUnit.START_ENTER_BUTTON_ID
+
+    SPEED_BUTTON_ID = ControlUnit.SPEED_BUTTON_ID
+
+    BRAKE_BUTTON_ID = ControlUnit.BRAKE_BUTTON_ID
+
+    FUEL_BUTTON_ID = ControlUnit.FUEL_BUTTON_ID
+
+    CODE_BUTTON_ID = ControlUnit.CODE_BUTTON_ID
+
+    trace = None
+    """Optional callable invoked as ``trace(direction, data)`` for
+    each message sent to or received from the CU; see
+    :mod:`carreralib.trace`."""
+
+    def __init__(self, connection):
+        self.__connection = connection
+        self.__lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @classmethod
+    async def open(cls, device, **kwargs):
+        """Open a connection to the CU at `device`."""
+        logger.debug("Connecting to %s", device)
+        conn = await connection.open_async(device, **kwargs)
+        logger.debug("Connection established")
+        return cls(conn)
+
+    async def close(self):
+        """Close the connection to the CU."""
+        logger.debug("Closing connection")
+        await self.__connection.close()
+
+    async def clrpos(self):
+        """Clear/reset the Position Tower display."""
+        await self.setword(6, 0, 9)
+
+    async def ignore(self, mask):
+        """Ignore the controllers represented by bitmask `mask`."""
+        await self.request(protocol.pack("cBC", b":", mask))
+
+    async def poll(self):
+        """Poll the CU for pending messages."""
+        return _decode_poll(await self.request(b"?"))
+
+    async def press(self, button_id):
+        """Simulate pressing the CU button with the given ID."""
+        return await self.request(protocol.pack("cYC", b"T", button_id))
+
+    async def request(self, buf, maxlength=None):
+        """Send a message to the CU and wait for a response."""
+        if self.__lock is None:
+            # create lock lazily within the running event loop
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            if self.trace is not None:
+                self.trace(SENT, buf)
+            await self.__connection.send(buf)
+            while True:
+                res = await self.__connection.recv(maxlength)
+                if self.trace is not None:
+                    self.trace(RECEIVED, res)
+                if not res:
+                    logger.warning("Received unknown command response")
+                    break
+                elif res.startswith(buf[0:1]):
+                    break
+                else:
+                    logger.warning("Received unexpected message %r", res)
+            return res
+
+    async def reset(self):
+        """Reset the CU timer."""
+        await self.request(protocol.pack("cYYC", b"=", 1, 0))
+
+    async def setbrake(self, address, value):
+        """Set the brake value for controller `address`."""
+        await self.setword(1, address, value, repeat=2)
+
+    async def setfuel(self, address, value):
+        """Set the fuel value for controller `address`."""
+        await self.setword(2, address, value, repeat=2)
+
+    async def setlap(self, value):
+        """Set the current lap displayed by the Position Tower."""
+        if value < 0 or value > 255:
+            raise ValueError("Lap value out of range")
+        await self.setlap_hi(value >> 4)
+        await self.setlap_lo(value & 0xF)
+
+    async def setlap_hi(self, value):
+        """Set the high nibble of the current lap."""
+        await self.setword(17, 7, value)
+
+    async def setlap_lo(self, value):
+        """Set the low nibble of the current lap."""
+        await self.setword(18, 7, value)
+
+    async def setpos(self, address, position):
+        """Set the controller's position displayed by the Position Tower."""
+        if position < 1 or position > 8:
+            raise ValueError("Position out of range")
+        await self.setword(6, address, position)
+
+    async def setspeed(self, address, value):
+        """Set the speed value for controller address."""
+        await self.setword(0, address, value, repeat=2)
+
+    async def setword(self, word, address, value, repeat=1):
+        return await self.request(_encode_setword(word, address, value, repeat))
+
+    async def start(self):
+        """Initiate the CU start sequence."""
+        await self.press(self.START_ENTER_BUTTON_ID)
+
+    async def version(self):
+        """Retrieve the CU version as a string."""
+        return _decode_version(await self.request(b"0"))
+
+    async def fwu_start(self):
+        """Initiate a CU firmware update."""
+        # G: start update, B: control unit
+        await self.request(protocol.pack("ccC", b"G", b"B"))
+
+    async def fwu_write(self, data):
+        """Write CU firmware update data."""
+        for buf in _encode_fwu(data, self.__connection.max_fwu_block_size):
+            await self.request(buf)
+
+
+def _decode_poll(res, metrics=None):
+    if res.startswith(b"?:"):
+        try:
+            parts = _STATUS.unpack(res)
+        except protocol.ChecksumError:
+            if metrics is not None:
+                metrics.inc("checksum_retries")
+            parts = _STATUS_EXT.unpack(res)
+        fuel, (start, mode, pitmask, display) = parts[:8], parts[8:]
+        pit = tuple(pitmask & (1 << n) != 0 for n in range(8))
+        return ControlUnit.Status(fuel, start, mode, pit, display)
+    elif res.startswith(b"?"):
+        address, timestamp, sector = _TIMER.unpack(res)
+        return ControlUnit.Timer(address - 1, timestamp, sector)
+    else:
+        return None  # TODO: raise?
+
+
+def _decode_version(res):
+    if res:
+        return protocol.unpack("x4sC", res)[0].decode()
+    else:
+        return None  # TODO: raise here?
+
+
+def _encode_setword(word, address, value, repeat=1):
+    if word < 0 or word > 31:
+        raise ValueError("Command word out of range")
+    if address < 0 or address > 7:
+        raise ValueError("Address out of range")
+    if value < 0 or value > 15:
+        raise ValueError("Value out of range")
+    if repeat < 1 or repeat > 15:
+        raise ValueError("Repeat count out of range")
+    return protocol.pack("cBYYC", b"J", word | address << 5, value, repeat)
+
+
+def _encode_fwu(data, max_block_size):
+    if max_block_size is None:
+        yield protocol.pack(f"c{len(data)}sC", b"E", data)
+    else:
+        n = max_block_size
+        for block in (data[i : i + n] for i in range(0, len(data), n)):
+            yield protocol.pack(f"cr{len(block)}s", b"F", len(block), block)
+        yield protocol.pack("cC", b"E")
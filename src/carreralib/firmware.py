@@ -0,0 +1,456 @@
+"""Control Unit firmware updates.
+
+:class:`FirmwareImage` validates a firmware update file as a whole and
+encodes all update frames for a given transport block size up front,
+optionally caching the encoded image in a compact binary form.
+:func:`upload` writes an image to a Control Unit, keeping several
+update frames in flight instead of waiting for each response in turn.
+Progress may be recorded in a checkpoint file, so an interrupted
+update can be resumed where it left off.
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from . import connection
+from .cu import ControlUnit, _encode_fwu
+
+CACHE_MAGIC = b"CRLFWI01"
+
+# digest, block size, file size, number of lines and frames
+_HEADER = struct.Struct("<32sHIII")
+
+# characters that may not appear in update data
+_INVALID = bytes(range(0x20)) + b'#$"' + bytes(range(0x7F, 0x100))
+
+
+class FirmwareError(Exception):
+    """Raised if a firmware update file is invalid."""
+
+    pass
+
+
+class Progress(
+    namedtuple("Progress", "lines bytes total elapsed resumed", defaults=(0,))
+):
+    """Firmware update progress.
+
+    :attr:`lines` and :attr:`bytes` are the number of update lines and
+    file bytes acknowledged by the CU so far, :attr:`total` is the size
+    of the update file in bytes, and :attr:`elapsed` is the time spent
+    writing in seconds.  When resuming an interrupted update,
+    :attr:`resumed` is the number of file bytes acknowledged before,
+    which are included in :attr:`bytes` but not in :attr:`elapsed`.
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def rate(self):
+        """Throughput in file bytes per second written since the
+        update was started or resumed."""
+        if self.elapsed > 0:
+            return (self.bytes - self.resumed) / self.elapsed
+        else:
+            return 0.0
+
+
+def readlines(file, start=0):
+    """Return an iterator over the update lines of the firmware update
+    file `file` as ``(offset, data)`` tuples, skipping the first
+    `start` lines.
+
+    `offset` is the file offset following the line, and `data` the
+    line's content as a bytes object without surrounding whitespace
+    and double quotes.  Empty lines are skipped.  The file is read
+    lazily, so it is never held in memory as a whole.
+
+    """
+    offset = 0
+    n = 0
+    with open(file, "rb") as f:
+        for line in f:
+            offset += len(line)
+            data = line.strip().replace(b'"', b"")
+            if data:
+                if n >= start:
+                    yield offset, data
+                n += 1
+
+
+class Result(namedtuple("Result", "device progress error")):
+    """Result of updating a single device with :func:`update_many`.
+
+    :attr:`progress` is the final :class:`Progress` for :attr:`device`,
+    or :const:`None` if no lines were written, and
+    :attr:`error` is the exception that caused the update to fail, or
+    :const:`None` if the update succeeded.
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        """Whether the update succeeded."""
+        return self.error is None
+
+
+class FirmwareImage(object):
+    """Validated firmware update image with pre-encoded update frames.
+
+    Use :meth:`load` to create an image from a firmware update file.
+
+    """
+
+    def __init__(self, digest, block_size, size, lines, offsets, ends, data):
+        self.digest = digest
+        self.block_size = block_size
+        self.size = size
+        self.__lines = lines
+        self.__offsets = offsets
+        self.__ends = ends
+        self.__data = data
+
+    def __len__(self):
+        return len(self.__lines)
+
+    def __repr__(self):
+        return "%s(%r, block_size=%r, lines=%d, frames=%d)" % (
+            type(self).__name__,
+            self.digest,
+            self.block_size,
+            len(self.__lines),
+            len(self.__ends),
+        )
+
+    @classmethod
+    def load(cls, file, block_size=None, cache=None):
+        """Load the firmware update file `file`, encoding update frames
+        for connections with a maximum block size of `block_size`.
+
+        The whole file is validated before any frames are encoded, and
+        :exc:`FirmwareError` is raised if it contains invalid data.  If
+        `cache` names a directory, encoded images are stored there,
+        keyed by a hash of the file's content and the block size, so
+        subsequent loads only need to hash the file.
+
+        """
+        digest = _digest(file)
+        if cache is not None:
+            path = os.path.join(cache, "%s-%d.bin" % (digest, block_size or 0))
+            try:
+                with open(path, "rb") as f:
+                    image = cls.frombytes(f.read())
+            except (OSError, ValueError):
+                pass
+            else:
+                if image.digest == digest and image.block_size == block_size:
+                    return image
+        image = cls.parse(file, block_size, digest)
+        if cache is not None:
+            os.makedirs(cache, exist_ok=True)
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(image.tobytes())
+            os.replace(tmp, path)
+        return image
+
+    @classmethod
+    def parse(cls, file, block_size=None, digest=None):
+        """Parse and validate the firmware update file `file`, and
+        encode its update frames for `block_size`."""
+        if digest is None:
+            digest = _digest(file)
+        lines = array("I")
+        offsets = array("I")
+        ends = array("I")
+        data = bytearray()
+        for n, (offset, line) in enumerate(readlines(file), start=1):
+            if line.translate(None, _INVALID) != line:
+                raise FirmwareError("Invalid character in line %d" % n)
+            for buf in _encode_fwu(line, block_size):
+                data += buf
+                ends.append(len(data))
+            lines.append(len(ends))
+            offsets.append(offset)
+        if not lines:
+            raise FirmwareError("No firmware update data")
+        size = os.path.getsize(file)
+        return cls(digest, block_size, size, lines, offsets, ends, bytes(data))
+
+    @classmethod
+    def frombytes(cls, buf):
+        """Create an image from its binary representation."""
+        if buf[: len(CACHE_MAGIC)] != CACHE_MAGIC:
+            raise ValueError("Not a firmware image")
+        start = len(CACHE_MAGIC)
+        if len(buf) < start + _HEADER.size:
+            raise ValueError("Truncated firmware image")
+        digest, block_size, size, nlines, nframes = _HEADER.unpack_from(buf, start)
+        start += _HEADER.size
+        columns = []
+        for n in (nlines, nlines, nframes):
+            column = array("I")
+            column.frombytes(buf[start : start + n * column.itemsize])
+            if len(column) != n:
+                raise ValueError("Truncated firmware image")
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns.append(column)
+            start += n * column.itemsize
+        lines, offsets, ends = columns
+        data = bytes(buf[start:])
+        if ends and ends[-1] != len(data):
+            raise ValueError("Truncated firmware image")
+        return cls(digest.hex(), block_size or None, size, lines, offsets, ends, data)
+
+    def tobytes(self):
+        """Return the binary representation of the image."""
+        header = _HEADER.pack(
+            bytes.fromhex(self.digest),
+            self.block_size or 0,
+            self.size,
+            len(self.__lines),
+            len(self.__ends),
+        )
+        parts = [CACHE_MAGIC, header]
+        for column in (self.__lines, self.__offsets, self.__ends):
+            if sys.byteorder != "little":
+                column = array("I", column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append(self.__data)
+        return b"".join(parts)
+
+    def frames(self, line):
+        """Return a list of the encoded update frames for `line`."""
+        lines, ends, data = self.__lines, self.__ends, self.__data
+        first = lines[line - 1] if line else 0
+        starts = [ends[i - 1] if i else 0 for i in range(first, lines[line])]
+        return [data[start:end] for start, end in zip(starts, ends[first:])]
+
+    def offset(self, line):
+        """Return the offset in the update file following `line`."""
+        return self.__offsets[line]
+
+
+def upload(
+    cu,
+    image,
+    window=8,
+    checkpoint=None,
+    progress=None,
+    ready_timeout=5.0,
+    cache=None,
+):
+    """Write the firmware update `image` to :class:`ControlUnit` `cu`.
+
+    `image` should be a :class:`FirmwareImage` encoded for
+    :attr:`ControlUnit.max_fwu_block_size`, or the path of a firmware
+    update file, which is loaded using :meth:`FirmwareImage.load` with
+    the given `cache` directory.  Since images are validated when
+    loaded, an invalid update file is detected before the update is
+    started.
+
+    Up to `window` update frames are kept in flight while waiting for
+    the CU's acknowledgements.  After initiating the update, the CU is
+    polled until it responds or `ready_timeout` seconds have elapsed,
+    instead of waiting for a fixed time.
+
+    If `checkpoint` is given, the number of lines acknowledged is
+    recorded in this file, together with a hash of the update file.
+    If the checkpoint file exists and matches the update file, the
+    update resumes after the last line recorded, without initiating
+    a new update.  The checkpoint file is removed when the update is
+    complete.
+
+    Updates are resumed at line granularity, so any frames of a line
+    not acknowledged before the interruption are sent again.
+
+    If given, `progress` is called with a :class:`Progress` object
+    whenever a line has been acknowledged.  Return the final
+    :class:`Progress`.
+
+    """
+    if window < 1:
+        raise ValueError("Window size out of range")
+    if not isinstance(image, FirmwareImage):
+        image = FirmwareImage.load(image, cu.max_fwu_block_size, cache)
+    elif image.block_size != cu.max_fwu_block_size:
+        raise ValueError("Firmware image block size does not match connection")
+    total = image.size
+    digest = image.digest
+    lines, nbytes = _restore(checkpoint, digest)
+    resumed = nbytes
+    if lines == 0:
+        cu.fwu_start()
+        _wait_ready(cu, ready_timeout)
+    inflight = deque()
+    start = time.monotonic()
+
+    def acknowledge(entry):
+        nonlocal lines, nbytes
+        future, offset = entry
+        future.result()
+        lines += 1
+        nbytes = offset
+        if checkpoint is not None:
+            _save(checkpoint, digest, lines, nbytes)
+        if progress is not None:
+            elapsed = time.monotonic() - start
+            progress(Progress(lines, nbytes, total, elapsed, resumed))
+
+    saved, cu.window = cu.window, window
+    try:
+        for line in range(lines, len(image)):
+            for buf in image.frames(line):
+                future = cu.submit(buf)
+            inflight.append((future, image.offset(line)))
+            while inflight and inflight[0][0].done():
+                acknowledge(inflight.popleft())
+        cu.flush()
+        while inflight:
+            acknowledge(inflight.popleft())
+    finally:
+        cu.window = saved
+        # record lines acknowledged before an error occurred
+        while inflight and inflight[0][0].done():
+            if inflight[0][0].exception() is not None:
+                break
+            acknowledge(inflight.popleft())
+    if checkpoint is not None:
+        os.remove(checkpoint)
+    return Progress(lines, total, total, time.monotonic() - start, resumed)
+
+
+def update_many(
+    devices,
+    file,
+    jobs=4,
+    ble_jobs=1,
+    progress=None,
+    checkpoints=None,
+    cache=None,
+    window=8,
+    **kwargs,
+):
+    """Update the firmware of several devices concurrently.
+
+    `devices` should be a sequence of devices accepted by
+    :func:`carreralib.connection.open`, e.g. the device names returned
+    by :func:`carreralib.connection.scan`.  At most `jobs` devices are
+    updated at the same time, and at most `ble_jobs` of them using
+    Bluetooth LE, so a single adapter is not saturated.  The update
+    file is loaded and validated only once for each block size needed.
+
+    If given, `progress` is called as ``progress(device, progress)``
+    from worker threads with a :class:`Progress` object for each line
+    acknowledged.  If `checkpoints` names a directory, a checkpoint
+    file is kept there for each device, so interrupted updates are
+    resumed when called again.  Additional keyword arguments are
+    passed to :func:`carreralib.connection.open`.
+
+    Return a list of :class:`Result` objects in the order of
+    `devices`.  Errors updating a device do not affect the others, and
+    are reported in the corresponding result.
+
+    """
+    if jobs < 1 or ble_jobs < 1:
+        raise ValueError("Number of jobs out of range")
+    images = {}
+    lock = threading.Lock()
+    slots = threading.Semaphore(jobs)
+
+    def load(block_size):
+        with lock:
+            if block_size not in images:
+                images[block_size] = FirmwareImage.load(file, block_size, cache)
+            return images[block_size]
+
+    def update(device):
+        last = None
+
+        def report(p):
+            nonlocal last
+            last = p
+            if progress is not None:
+                progress(device, p)
+
+        if checkpoints is not None:
+            os.makedirs(checkpoints, exist_ok=True)
+            name = re.sub(r"[^\w.-]", "_", device) + ".json"
+            checkpoint = os.path.join(checkpoints, name)
+        else:
+            checkpoint = None
+        try:
+            with slots:
+                cu = ControlUnit(device, **kwargs)
+                try:
+                    image = load(cu.max_fwu_block_size)
+                    last = upload(cu, image, window, checkpoint, report)
+                finally:
+                    cu.close()
+        except Exception as e:
+            return Result(device, last, e)
+        return Result(device, last, None)
+
+    # fail early if the update file itself is invalid
+    load(None)
+    # separate workers, so queued BLE devices do not hold up the others
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        with ThreadPoolExecutor(max_workers=min(jobs, ble_jobs)) as ble_executor:
+            futures = []
+            for device in devices:
+                pool = ble_executor if connection.isble(device) else executor
+                futures.append(pool.submit(update, device))
+            return [future.result() for future in futures]
+
+
+def _digest(file):
+    h = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _restore(checkpoint, digest):
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return 0, 0
+    with open(checkpoint) as f:
+        state = json.load(f)
+    if state.get("sha256") != digest:
+        return 0, 0
+    return state["lines"], state["bytes"]
+
+
+def _save(checkpoint, digest, lines, nbytes):
+    state = {"sha256": digest, "lines": lines, "bytes": nbytes}
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, checkpoint)
+
+
+def _wait_ready(cu, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            cu.request(b"?")
+        except connection.TimeoutError:
+            if time.monotonic() >= deadline:
+                raise
+        else:
+            return
@@ -1,27 +1,107 @@
 import argparse
 import contextlib
 import logging
+import sys
+import threading
 import time
 
-from . import ControlUnit
+from . import ControlUnit, connection, firmware, trace
+
+
+def update_fleet(args, devices, interval=1.0):
+    lock = threading.Lock()
+    start = time.monotonic()
+    reported = {}
+
+    def report(device, p):
+        now = time.monotonic()
+        with lock:
+            # print at most one status line per device and interval
+            last = reported.get(device)
+            if last is not None and now - last < interval:
+                return
+            reported[device] = now
+            print(
+                "%s: %3d%% (%.0f bytes/s)" % (device, p.bytes * 100 // p.total, p.rate)
+            )
+
+    print("Starting firmware update of %d devices" % len(devices))
+    results = firmware.update_many(
+        devices,
+        args.fleet,
+        jobs=args.jobs,
+        ble_jobs=args.ble_jobs,
+        progress=report,
+        checkpoints=args.checkpoint,
+        cache=args.cache,
+        window=args.window,
+        timeout=args.timeout,
+    )
+    elapsed = time.monotonic() - start
+    # bytes written before resuming do not count towards throughput
+    nbytes = sum(r.progress.bytes - r.progress.resumed for r in results if r.progress)
+    print(
+        "Firmware update done: %d bytes in %.1fs (%.0f bytes/s)"
+        % (nbytes, elapsed, nbytes / elapsed if elapsed else 0.0)
+    )
+    for r in results:
+        print("  %s\t%s" % (r.device, "OK" if r.ok else "FAILED: %s" % r.error))
+    return all(r.ok for r in results)
+
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(prog="python -m carreralib.fw")
+    parser = argparse.ArgumentParser(
+        prog="python -m carreralib.fw",
+        usage="%(prog)s [options] DEVICE [FILE]\n"
+        "       %(prog)s [options] --fleet FILE [--scan] [DEVICE ...]",
+    )
     parser.add_argument(
-        "device",
+        "args",
         metavar="DEVICE",
-        help="the Control Unit device, e.g. a serial port or MAC address",
+        nargs="*",
+        help="the Control Unit device, e.g. a serial port or MAC address,"
+        " optionally followed by a firmware update file",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="cache encoded firmware update images in DIR",
+    )
+    parser.add_argument(
+        "-c",
+        "--checkpoint",
+        metavar="PATH",
+        help="record progress in PATH to resume interrupted updates;"
+        " with --fleet, PATH is a directory",
     )
     parser.add_argument(
-        "file",
+        "-F",
+        "--fleet",
         metavar="FILE",
-        nargs="?",
-        default=None,
-        help="a Control Unit firmware update file",
+        help="write firmware update FILE to all devices given",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=4,
+        type=int,
+        help="maximum number of devices updated in parallel",
+    )
+    parser.add_argument(
+        "--ble-jobs",
+        default=1,
+        type=int,
+        help="maximum number of Bluetooth devices updated in parallel",
     )
     parser.add_argument(
         "-l", "--logfile", default="carreralib.log", help="where to write log messages"
     )
+    parser.add_argument(
+        "-s",
+        "--scan",
+        action="store_true",
+        help="with --fleet, also update all devices found",
+    )
     parser.add_argument(
         "-t",
         "--timeout",
@@ -32,30 +112,66 @@ if __name__ == "__main__":
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="write more log messages"
     )
+    parser.add_argument(
+        "-w",
+        "--window",
+        default=8,
+        type=int,
+        help="maximum number of update frames in flight",
+    )
     args = parser.parse_args()
 
-    logging.basicConfig(
+    trace.start_logging(
+        args.logfile,
         level=logging.DEBUG if args.verbose else logging.INFO,
-        filename=args.logfile,
         format="%(asctime)s: %(message)s",
     )
 
-    with contextlib.closing(ControlUnit(args.device, timeout=args.timeout)) as cu:
-        if args.file:
-            with open(args.file) as f:
-                # remove double quotes wrapping each line
-                lines = [line.rstrip().replace('"', "") for line in f.readlines()]
-                # skip empty lines
-                lines = [line for line in lines if len(line)]
-            if lines:
-                print("Starting firmware update")
-                cu.fwu_start()
-                time.sleep(2.0)  # wait for two seconds...
-                for n, line in enumerate(lines):
-                    # encode to bytes and write to CU
-                    cu.fwu_write(line.encode())
-                    # print progress
-                    print("Writing firmware update block %d/%d" % (n + 1, len(lines)))
-                print("Firmware update done")
+    if args.fleet:
+        devices = list(args.args)
+        if args.scan:
+            devices.extend(d for d, _ in connection.scan() if d not in devices)
+        if not devices:
+            parser.error("no devices given")
+        try:
+            ok = update_fleet(args, devices)
+        except firmware.FirmwareError as e:
+            parser.exit(1, "Invalid firmware update file: %s\n" % e)
+        sys.exit(0 if ok else 1)
+    elif not 1 <= len(args.args) <= 2 or args.scan:
+        parser.error("expected DEVICE [FILE] without --fleet")
+
+    device, file = (args.args + [None])[:2]
+    with contextlib.closing(ControlUnit(device, timeout=args.timeout)) as cu:
+        if args.verbose:
+            cu.trace = trace.LogTrace(logging.getLogger("carreralib"))
+        if file:
+
+            def report(p):
+                print(
+                    "Writing firmware update: %3d%% (%.0f bytes/s)"
+                    % (p.bytes * 100 // p.total, p.rate),
+                    end="\r",
+                )
+
+            try:
+                image = firmware.FirmwareImage.load(
+                    file, cu.max_fwu_block_size, args.cache
+                )
+            except firmware.FirmwareError as e:
+                parser.exit(1, "Invalid firmware update file: %s\n" % e)
+            print("Starting firmware update")
+            result = firmware.upload(
+                cu,
+                image,
+                window=args.window,
+                checkpoint=args.checkpoint,
+                progress=report,
+            )
+            print()
+            print(
+                "Firmware update done: %d lines in %.1fs (%.0f bytes/s)"
+                % (result.lines, result.elapsed, result.rate)
+            )
         else:
             print("CU version %s" % cu.version())
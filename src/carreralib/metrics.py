@@ -0,0 +1,218 @@
+"""Request metrics for Control Unit connections.
+
+Setting the :attr:`carreralib.ControlUnit.metrics` attribute to a
+:class:`Metrics` instance will collect request round-trip times per
+command letter, message and byte counts, timeouts, unexpected
+messages and checksum errors.  Collecting metrics only adds a few
+integer operations and a histogram lookup per request, so it may be
+left enabled during races.
+
+"""
+
+import bisect
+import json
+import threading
+import time
+
+RTT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+)
+"""Default upper bounds of round-trip time histogram buckets in
+seconds."""
+
+COUNTERS = (
+    "requests",
+    "polls",
+    "frames_sent",
+    "frames_received",
+    "bytes_sent",
+    "bytes_received",
+    "timeouts",
+    "unexpected_messages",
+    "unknown_responses",
+    "checksum_retries",
+    "checksum_errors",
+    "retries",
+)
+"""Names of the counters maintained by :class:`Metrics`."""
+
+
+class Histogram(object):
+    """Histogram with fixed bucket upper bounds `buckets`."""
+
+    def __init__(self, buckets=RTT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Record `value`."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Return an estimate of the `q`-th percentile, 0 <= q <= 100,
+        or :const:`None` if no values have been recorded.
+
+        Values are interpolated linearly within buckets, and clamped
+        to the observed minimum and maximum.
+
+        """
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        total = 0
+        lower = 0.0
+        for upper, n in zip(self.buckets + (self.max,), self.counts):
+            if n and total + n >= rank:
+                value = lower + (upper - lower) * (rank - total) / n
+                return min(max(value, self.min), self.max)
+            total += n
+            lower = upper
+        return self.max
+
+    def snapshot(self):
+        """Return a dictionary describing the histogram."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+        }
+
+
+class Metrics(object):
+    """Counters and round-trip time histograms for a Control Unit."""
+
+    def __init__(self, buckets=RTT_BUCKETS, clock=time.monotonic):
+        self.__buckets = buckets
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def inc(self, name, n=1):
+        """Increment the counter `name` by `n`."""
+        self.counters[name] += n
+
+    def observe_rtt(self, cmd, seconds):
+        """Record the round-trip time for a request with command
+        letter `cmd`."""
+        try:
+            histogram = self.rtt[cmd]
+        except KeyError:
+            with self.__lock:
+                histogram = self.rtt.setdefault(cmd, Histogram(self.__buckets))
+        histogram.observe(seconds)
+
+    def sent(self, buf):
+        """Record a message sent to the CU."""
+        counters = self.counters
+        counters["frames_sent"] += 1
+        counters["bytes_sent"] += len(buf)
+
+    def received(self, buf):
+        """Record a message received from the CU."""
+        counters = self.counters
+        counters["frames_received"] += 1
+        counters["bytes_received"] += len(buf)
+
+    def reset(self):
+        """Reset all counters and histograms."""
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.rtt = {}
+        self.started = self.__clock()
+
+    def snapshot(self):
+        """Return a dictionary of all metrics.
+
+        Besides counters and round-trip time histograms keyed by
+        command letter, this includes the time elapsed since creation
+        or the last :meth:`reset`, and message and poll rates per
+        second over that time.
+
+        """
+        elapsed = self.__clock() - self.started
+        counters = dict(self.counters)
+        rates = {}
+        for name in ("polls", "frames_sent", "frames_received"):
+            rates[name] = counters[name] / elapsed if elapsed > 0 else 0.0
+        with self.__lock:
+            rtt = {cmd: h.snapshot() for cmd, h in self.rtt.items()}
+        return {
+            "elapsed": elapsed,
+            "counters": counters,
+            "rates": rates,
+            "rtt": {cmd.decode("latin-1"): h for cmd, h in rtt.items()},
+        }
+
+    def to_json(self, **kwargs):
+        """Return a JSON representation of :meth:`snapshot`."""
+        snapshot = self.snapshot()
+        for h in snapshot["rtt"].values():
+            h["buckets"] = {_le(k): v for k, v in h["buckets"].items()}
+        return json.dumps(snapshot, **kwargs)
+
+    def to_prometheus(self, prefix="carreralib", labels=None):
+        """Return a snapshot in Prometheus text exposition format.
+
+        If given, `labels` should be a mapping of additional label
+        names and values, e.g. to identify a particular CU.
+
+        """
+        snapshot = self.snapshot()
+        base = sorted((labels or {}).items())
+        lines = []
+        for name, value in snapshot["counters"].items():
+            metric = "%s_%s_total" % (prefix, name)
+            lines.append("# TYPE %s counter" % metric)
+            lines.append("%s%s %d" % (metric, _braces(base), value))
+        metric = "%s_rtt_seconds" % prefix
+        lines.append("# TYPE %s histogram" % metric)
+        for cmd, h in sorted(snapshot["rtt"].items()):
+            labels = base + [("command", cmd)]
+            total = 0
+            for le, n in h["buckets"].items():
+                total += n
+                bucket = _braces(labels + [("le", _le(le))])
+                lines.append("%s_bucket%s %d" % (metric, bucket, total))
+            lines.append("%s_sum%s %r" % (metric, _braces(labels), h["sum"]))
+            lines.append("%s_count%s %d" % (metric, _braces(labels), h["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def _braces(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+
+
+def _escape(value):
+    value = str(value).replace("\\", "\\\\")
+    return value.replace('"', '\\"').replace("\n", "\\n")
+
+
+def _le(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+import time
+
+from .cu import ControlUnit
+
+logger = logging.getLogger(__name__)
+
+
+class Poller(object):
+    """Iterator over Control Unit events polled by a background thread.
+
+    The thread polls `cu` at most `rate` times per second.  After a
+    :class:`ControlUnit.Timer` event, the CU is polled again
+    immediately, since more timer events may be pending.  Repeated
+    timer and status responses are reported only once.
+
+    Events are delivered through a queue holding at most `maxsize`
+    events; while the queue is full, polling is suspended.  Any
+    exception raised while polling is re-raised by :meth:`get`, after
+    which the poller is closed.
+
+    """
+
+    __STOP = object()
+
+    def __init__(self, cu, rate=50.0, maxsize=64):
+        if rate <= 0:
+            raise ValueError("Poll rate out of range")
+        self._interval = 1.0 / rate
+        self._stopped = threading.Event()
+        self.__queue = queue.Queue(maxsize)
+        self.__threads = []
+        self._start(cu)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self.get()
+        if event is None:
+            raise StopIteration
+        return event
+
+    def close(self):
+        """Stop polling and wait for the background threads to exit."""
+        self._stopped.set()
+        for thread in self.__threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        try:
+            self.__queue.put_nowait(self.__STOP)
+        except queue.Full:
+            pass
+
+    def get(self, timeout=None):
+        """Return the next event, or :const:`None` if the poller was
+        closed.
+
+        If `timeout` is not :const:`None` and no event becomes
+        available within `timeout` seconds, raise :exc:`queue.Empty`.
+
+        """
+        if self._stopped.is_set():
+            return None
+        event = self.__queue.get(timeout=timeout)
+        if event is self.__STOP:
+            return None
+        elif isinstance(event, Exception):
+            self.close()
+            raise event
+        else:
+            return event
+
+    def _put(self, event):
+        # wait for space in the queue; return false if closed meanwhile
+        while not self._stopped.is_set():
+            try:
+                self.__queue.put(event, timeout=self._interval)
+            except queue.Full:
+                continue
+            else:
+                return True
+        return False
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.__threads.append(thread)
+
+    def _start(self, cu):
+        # start the background threads; overridden by subclasses
+        self._spawn(self.__run, cu)
+
+    def __run(self, cu):
+        try:
+            _poll(cu, self._interval, self._put, self._stopped)
+        except Exception as e:
+            logger.error("Error polling CU: %s", e)
+            self._put(e)
+
+
+def _poll(cu, interval, put, stopped):
+    # poll `cu` until `stopped` is set or `put` returns false
+    timer = status = None
+    deadline = time.monotonic()
+    while not stopped.is_set():
+        event = cu.poll()
+        if isinstance(event, ControlUnit.Timer):
+            if event != timer and not put(event):
+                break
+            timer = event
+            # more timer events may be pending
+            continue
+        elif isinstance(event, ControlUnit.Status):
+            if event != status and not put(event):
+                break
+            status = event
+        else:
+            logger.warning("Unknown data from CU: %r", event)
+        deadline = max(deadline + interval, time.monotonic())
+        stopped.wait(deadline - time.monotonic())
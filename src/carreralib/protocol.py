@@ -1,3 +1,4 @@
+import functools
 import re
 
 
@@ -14,19 +15,54 @@ class ChecksumError(Exception):
 
 
 def chksum(buf, offset=0, size=None):
-    """Compute the protocol checksum for the buffer `buf`."""
-    n = len(buf)
-    if offset < 0:
-        raise ValueError("offset is negative")
-    elif n < offset:
-        raise ValueError("buffer length < offset")
-    elif size is None:
-        size = n - offset
-    elif size < 0:
-        raise ValueError("size is negative")
-    elif offset + size > n:
-        raise ValueError("buffer length < offset + size")
-    return sum(memoryview(buf[offset : offset + size]).tolist()) & 0x0F
+    """Compute the protocol checksum for the buffer `buf`.
+
+    `buf` may be any object supporting the buffer interface; no copy
+    of the data is made.
+
+    """
+    view = memoryview(buf)
+    if view.format != "B":
+        view = view.cast("B")
+    size = _checkrange(len(view), offset, size)
+    return sum(view[offset : offset + size]) & 0x0F
+
+
+class Checksum(object):
+    """Incremental protocol checksum.
+
+    This allows computing the checksum of a message while its bytes
+    are received, instead of scanning the complete message afterwards.
+
+    """
+
+    def __init__(self, buf=None, offset=0, size=None):
+        self.__sum = 0
+        if buf is not None:
+            self.update(buf, offset, size)
+
+    def __repr__(self):
+        return "%s(%#x)" % (self.__class__.__name__, self.digest())
+
+    def digest(self):
+        """Return the checksum of the data passed to :meth:`update`."""
+        return self.__sum & 0x0F
+
+    def reset(self):
+        """Reset the checksum to its initial state."""
+        self.__sum = 0
+
+    def update(self, buf, offset=0, size=None):
+        """Update the checksum with data from the buffer `buf`."""
+        view = memoryview(buf)
+        if view.format != "B":
+            view = view.cast("B")
+        size = _checkrange(len(view), offset, size)
+        self.__sum += sum(view[offset : offset + size])
+
+    def update_byte(self, value):
+        """Update the checksum with a single byte value."""
+        self.__sum += value
 
 
 def pack(fmt, *args):
@@ -34,48 +70,100 @@ def pack(fmt, *args):
     the format string `fmt.`
 
     """
-    buf = bytearray()
-    argiter = iter(args)
-    for match in re.finditer(_FORMAT_RE, fmt):
-        count, conv = match.groups()
-        if count is None:
-            count = 1
-        else:
-            count = int(count)
-        if conv in _PACK_FORMATS:
-            _PACK_FORMATS[conv](buf, argiter, count)
-        else:
-            raise ValueError("bad character in pack format")
-    # TODO: check all args used
-    return bytes(buf)
+    return _compile(fmt).pack(*args)
 
 
 def unpack(fmt, buf):
     """Unpack from the buffer `buf` according to the format string `fmt`."""
-    offset = 0
-    result = []
-    values = memoryview(buf).tolist()
-    for match in re.finditer(_FORMAT_RE, fmt):
-        count, conv = match.groups()
-        if count is None:
-            count = 1
-        else:
-            count = int(count)
-        if conv in _UNPACK_FORMATS:
-            offset += _UNPACK_FORMATS[conv](result, buf, values, offset, count)
+    return _compile(fmt).unpack(buf)
+
+
+class Struct(object):
+    """Compiled protocol format object.
+
+    Similar to :class:`struct.Struct`, creating a :class:`Struct`
+    object parses the format string `fmt` only once, so calling its
+    :meth:`pack` and :meth:`unpack` methods is more efficient than
+    calling the module-level functions with the same format.
+
+    """
+
+    def __init__(self, fmt):
+        packers = []
+        unpackers = []
+        offset = 0
+        for match in re.finditer(_FORMAT_RE, fmt):
+            count, conv = match.groups()
+            if count is None:
+                count = 1
+            else:
+                count = int(count)
+            if conv not in _PACK_FORMATS or conv not in _UNPACK_FORMATS:
+                raise ValueError("bad character in format string")
+            packers.append((_PACK_FORMATS[conv], count))
+            unpackers.append((_UNPACK_FORMATS[conv], offset, count))
+            offset += _FORMAT_SIZES[conv](count)
+        self.__packers = tuple(packers)
+        self.__unpackers = tuple(unpackers)
+        self.format = fmt
+        self.size = offset
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.format)
+
+    def pack(self, *args):
+        """Return a bytes object containing the arguments packed
+        according to the compiled format.
+
+        """
+        buf = bytearray()
+        argiter = iter(args)
+        for func, count in self.__packers:
+            func(buf, argiter, count)
+        # TODO: check all args used
+        return bytes(buf)
+
+    def unpack(self, buf):
+        """Unpack from the buffer `buf` according to the compiled format."""
+        if isinstance(buf, (bytes, bytearray)):
+            values = buf
         else:
-            raise ValueError("bad character in unpack format")
-    # TODO: check all buf used
-    return tuple(result)
+            values = memoryview(buf).cast("B")
+        if len(values) < self.size:
+            raise ProtocolError("buffer too short for format")
+        result = []
+        for func, offset, count in self.__unpackers:
+            func(result, buf, values, offset, count)
+        # TODO: check all buf used
+        return tuple(result)
 
 
-def _pack_B(buf, args, count, base=ord("0")):
+def _checkrange(n, offset, size):
+    if offset < 0:
+        raise ValueError("offset is negative")
+    elif n < offset:
+        raise ValueError("buffer length < offset")
+    elif size is None:
+        return n - offset
+    elif size < 0:
+        raise ValueError("size is negative")
+    elif offset + size > n:
+        raise ValueError("buffer length < offset + size")
+    else:
+        return size
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(fmt):
+    return Struct(fmt)
+
+
+def _pack_B(buf, args, count):
     for _ in range(count):
         arg = next(args)
         if arg < 0 or arg > 0xFF:
             raise ValueError("'B' format argument out of range")
-        buf.append(base + (arg & 0xF))
-        buf.append(base + (arg >> 4))
+        buf.extend(_BYTE_NIBBLES[arg])
 
 
 def _pack_C(buf, args, offset, base=ord("0")):
@@ -90,19 +178,14 @@ def _pack_c(buf, args, count):
         buf.append(arg[0])
 
 
-def _pack_I(buf, args, count, base=ord("0")):
+def _pack_I(buf, args, count):
     for _ in range(count):
         arg = next(args)
         if arg < 0 or arg > 0xFFFFFFFF:
             raise ValueError("'I' format argument out of range")
-        buf.append(base + ((arg >> 24) & 0xF))
-        buf.append(base + ((arg >> 28) & 0xF))
-        buf.append(base + ((arg >> 16) & 0xF))
-        buf.append(base + ((arg >> 20) & 0xF))
-        buf.append(base + ((arg >> 8) & 0xF))
-        buf.append(base + ((arg >> 12) & 0xF))
-        buf.append(base + ((arg >> 0) & 0xF))
-        buf.append(base + ((arg >> 4) & 0xF))
+        # low nibble first within each byte, most significant byte first
+        arg = ((arg & 0x0F0F0F0F) << 4) | ((arg >> 4) & 0x0F0F0F0F)
+        buf.extend((b"%08x" % arg).translate(_FROM_HEX))
 
 
 def _pack_r(buf, args, count):
@@ -134,15 +217,16 @@ def _pack_Y(buf, args, count, base=ord("0")):
 
 
 def _unpack_B(result, buf, values, offset, count):
-    for i in range(count):
-        b = values[offset + i * 2] & 0x0F
-        b |= (values[offset + i * 2 + 1] & 0x0F) << 4
-        result.append(b)
+    if count:
+        n = int(bytes(values[offset : offset + count * 2]).translate(_TO_HEX), 16)
+        mask = int.from_bytes(b"\x0f" * count, "big")
+        n = ((n & mask) << 4) | ((n >> 4) & mask)
+        result.extend(n.to_bytes(count, "big"))
     return count * 2
 
 
 def _unpack_C(result, buf, values, offset, count):
-    c = chksum(buf, count, offset - count)
+    c = chksum(values, count, offset - count)
     if values[offset] & 0xF != c:
         raise ChecksumError()
     return 1
@@ -155,16 +239,9 @@ def _unpack_c(result, buf, values, offset, count):
 
 
 def _unpack_I(result, buf, values, offset, count):
-    for _ in range(count):
-        n = (values[offset + 0] & 0x0F) << 24
-        n |= (values[offset + 1] & 0x0F) << 28
-        n |= (values[offset + 2] & 0x0F) << 16
-        n |= (values[offset + 3] & 0x0F) << 20
-        n |= (values[offset + 4] & 0x0F) << 8
-        n |= (values[offset + 5] & 0x0F) << 12
-        n |= (values[offset + 6] & 0x0F) << 0
-        n |= (values[offset + 7] & 0x0F) << 4
-        result.append(n)
+    for i in range(offset, offset + count * 8, 8):
+        n = int(bytes(values[i : i + 8]).translate(_TO_HEX), 16)
+        result.append(((n & 0x0F0F0F0F) << 4) | ((n >> 4) & 0x0F0F0F0F))
     return count * 8
 
 
@@ -184,13 +261,22 @@ def _unpack_x(result, buf, values, offset, count):
 
 
 def _unpack_Y(result, buf, values, offset, count):
-    for i in range(count):
-        result.append(values[offset + i] & 0xF)
+    result.extend(bytes(values[offset : offset + count]).translate(_NIBBLES))
     return count
 
 
 _FORMAT_RE = re.compile(r"\s*([1-9]\d*|0)?(.)\s*")
 
+# translation tables for nibble-encoded values; the protocol only uses
+# the low nibble of each byte, i.e. "0123456789:;<=>?" for 0x0..0xF
+_NIBBLES = bytes(b & 0x0F for b in range(256))
+
+_TO_HEX = bytes(b"0123456789abcdef"[b & 0x0F] for b in range(256))
+
+_FROM_HEX = bytes.maketrans(b"abcdef", b":;<=>?")
+
+_BYTE_NIBBLES = tuple(bytes((0x30 + (b & 0x0F), 0x30 + (b >> 4))) for b in range(256))
+
 _PACK_FORMATS = {
     "B": _pack_B,
     "C": _pack_C,
@@ -202,6 +288,17 @@ _PACK_FORMATS = {
     "Y": _pack_Y,
 }
 
+_FORMAT_SIZES = {
+    "B": lambda count: count * 2,
+    "C": lambda count: 1,
+    "c": lambda count: count,
+    "I": lambda count: count * 8,
+    "r": lambda count: count,
+    "s": lambda count: count,
+    "x": lambda count: count,
+    "Y": lambda count: count,
+}
+
 _UNPACK_FORMATS = {
     "B": _unpack_B,
     "C": _unpack_C,
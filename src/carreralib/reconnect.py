@@ -0,0 +1,240 @@
+"""Automatic reconnection for dropped Control Unit connections.
+
+:class:`ReconnectingConnection` wraps a serial or BLE connection and
+transparently reopens it when the underlying transport fails, so a
+glitching cable or a Bluetooth dropout does not end a race session.
+
+"""
+
+import logging
+import time
+from collections import deque
+
+from . import connection, protocol
+from .connection import BufferTooShort, Connection
+
+logger = logging.getLogger(__name__)
+
+# commands that may safely be sent more than once
+IDEMPOTENT = frozenset([b"?", b"0", b"J", b":"])
+
+# speed, brake and fuel words restored after reconnecting
+STATE_WORDS = frozenset([0, 1, 2])
+
+_TIMER = protocol.Struct("cYIYC")
+
+_SETWORD = protocol.Struct("cBYYC")
+
+
+class ReconnectingConnection(Connection):
+    """Connection to `device` that reconnects on failure.
+
+    `device` may be anything accepted by
+    :func:`carreralib.connection.open`, or a callable returning a
+    :class:`carreralib.connection.Connection`.  Additional keyword
+    arguments are passed to :func:`carreralib.connection.open`.
+
+    If sending or receiving fails, the connection is reopened after
+    `retry` seconds, doubling the delay for every failed attempt up to
+    `maxretry` seconds.  If `attempts` is not :const:`None`, the last
+    error is raised after this number of failed attempts.  A single
+    timeout only causes any partially received data to be discarded
+    and pending requests to be resent; the connection is reopened
+    after two consecutive timeouts.
+
+    After reconnecting, the last speed, brake and fuel settings and
+    the ignore mask sent are restored, and requests that did not
+    receive a response are resent, provided they may safely be sent
+    again.  Otherwise, the original error is raised.
+
+    If the CU's timer restarts while disconnected, e.g. due to a power
+    cycle, subsequent timer events are adjusted to continue from the
+    last timestamp received, using the host's clock to estimate the
+    time elapsed.
+
+    If `metrics` is given, the ``retries`` counter of this
+    :class:`carreralib.metrics.Metrics` instance is incremented for
+    every attempt to recover the connection.
+
+    """
+
+    __connection = None
+
+    def __init__(
+        self, device, retry=0.5, maxretry=30.0, attempts=None, metrics=None, **kwargs
+    ):
+        if callable(device):
+            self.__open = device
+        else:
+            self.__open = lambda: connection.open(device, **kwargs)
+        self.__device = device
+        self.__retry = retry
+        self.__maxretry = maxretry
+        self.__attempts = attempts
+        self.__metrics = metrics
+        self.__pending = deque()
+        self.__state = {}
+        self.__timeouts = 0
+        self.__last = None
+        self.__offset = 0
+        self.__connection = self.__open()
+
+    def close(self):
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+    def cork(self):
+        self.__connection.cork()
+
+    def uncork(self):
+        try:
+            self.__connection.uncork()
+        except BufferTooShort:
+            raise
+        except (connection.ConnectionError, OSError) as e:
+            self.__recover(e)
+
+    def discard(self):
+        self.__connection.discard()
+
+    def fileno(self):
+        return self.__connection.fileno()
+
+    def recv(self, maxlength=None):
+        while True:
+            try:
+                buf = self.__connection.recv(maxlength)
+            except BufferTooShort:
+                raise
+            except connection.TimeoutError as e:
+                self.__timeouts += 1
+                if self.__timeouts > 1:
+                    self.__recover(e)
+                elif not self.__resend(e):
+                    raise
+            except (connection.ConnectionError, OSError) as e:
+                self.__recover(e)
+            else:
+                self.__timeouts = 0
+                if self.__pending:
+                    self.__pending.popleft()
+                return self.__timer(buf)
+
+    def send(self, buf, offset=0, size=None):
+        if size is None:
+            size = len(buf) - offset
+        self.send_many([buf[offset : offset + size]])
+
+    def send_many(self, bufs):
+        bufs = [bytes(buf) for buf in bufs]
+        for buf in bufs:
+            self.__track(buf)
+        self.__pending.extend(bufs)
+        try:
+            self.__connection.send_many(bufs)
+        except (connection.ConnectionError, OSError) as e:
+            self.__recover(e)
+
+    @property
+    def max_fwu_block_size(self):
+        return self.__connection.max_fwu_block_size
+
+    def __track(self, buf):
+        cmd = buf[0:1]
+        if cmd == b"J":
+            try:
+                _, word, _, _ = _SETWORD.unpack(buf)
+            except protocol.ProtocolError:
+                return
+            if word & 0x1F in STATE_WORDS:
+                self.__state[word] = buf
+        elif cmd == b":":
+            self.__state[cmd] = buf
+        elif cmd == b"=":
+            # CU timer is reset on purpose
+            self.__last = None
+            self.__offset = 0
+
+    def __timer(self, buf):
+        if buf[0:1] != b"?" or len(buf) != _TIMER.size or buf[1:2] == b":":
+            return buf
+        try:
+            _, address, timestamp, sector = _TIMER.unpack(buf)
+        except protocol.ProtocolError:
+            return buf
+        now = time.monotonic()
+        if self.__last is not None:
+            last, when = self.__last
+            # allow for timer events reported slightly out of order
+            if 0x80000000 <= (timestamp - last + 1000) & 0xFFFFFFFF:
+                # timer restarted, continue from last known time
+                expected = last + int((now - when) * 1000)
+                self.__offset = (self.__offset + expected - timestamp) & 0xFFFFFFFF
+                logger.warning("CU timer discontinuity detected")
+        self.__last = (timestamp, now)
+        if self.__offset:
+            timestamp = (timestamp + self.__offset) & 0xFFFFFFFF
+            buf = _TIMER.pack(b"?", address, timestamp, sector)
+        return buf
+
+    def __resend(self, error):
+        # discard partial data and resend pending requests
+        pending = self.__pending
+        if not pending or any(buf[0:1] not in IDEMPOTENT for buf in pending):
+            pending.clear()
+            return False
+        self.__count()
+        logger.warning("Resending %d requests: %s", len(self.__pending), error)
+        self.__connection.discard()
+        try:
+            self.__connection.send_many(list(self.__pending))
+        except (connection.ConnectionError, OSError) as e:
+            self.__recover(e)
+        return True
+
+    def __recover(self, error):
+        delay = self.__retry
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.__attempts is not None and attempt > self.__attempts:
+                self.__pending.clear()
+                raise error
+            self.__count()
+            logger.warning("Reconnecting to %s: %s", self.__device, error)
+            try:
+                self.__connection.close()
+            except Exception as e:
+                logger.debug("Error closing connection: %s", e)
+            time.sleep(delay)
+            try:
+                self.__connection = self.__open()
+                self.__restore()
+            except BufferTooShort:
+                raise
+            except (connection.ConnectionError, OSError) as e:
+                error = e
+                delay = min(delay * 2, self.__maxretry)
+            else:
+                break
+        self.__timeouts = 0
+        pending = list(self.__pending)
+        if any(buf[0:1] not in IDEMPOTENT for buf in pending):
+            self.__pending.clear()
+            raise error
+        elif pending:
+            self.__connection.send_many(pending)
+
+    def __restore(self):
+        conn = self.__connection
+        conn.discard()
+        state = list(self.__state.values())
+        if state:
+            conn.send_many(state)
+            for _ in state:
+                conn.recv()
+
+    def __count(self):
+        if self.__metrics is not None:
+            self.__metrics.inc("retries")
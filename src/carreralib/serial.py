@@ -1,6 +1,11 @@
+import asyncio
+import concurrent.futures
+import re
+
 from serial import serial_for_url
 
-from .connection import BufferTooShort, Connection, TimeoutError
+from .connection import AsyncConnection, BufferTooShort, Connection, TimeoutError
+from .protocol import Checksum
 
 
 class SerialConnection(Connection):
@@ -8,24 +13,50 @@ class SerialConnection(Connection):
 
     def __init__(self, url, timeout=None):
         self.__serial = serial_for_url(url, baudrate=19200, timeout=timeout)
+        self.__reader = _FrameReader()
+        self.__output = bytearray()
+        self.__corked = 0
 
     def close(self):
         if self.__serial:
             self.__serial.close()
 
+    def cork(self):
+        self.__corked += 1
+
+    def uncork(self):
+        if self.__corked:
+            self.__corked -= 1
+        if not self.__corked:
+            self.__write()
+
+    def discard(self):
+        self.__serial.reset_input_buffer()
+        self.__reader.consume(len(self.__reader.buffer))
+
+    def fileno(self):
+        try:
+            return self.__serial.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
     def recv(self, maxlength=None):
-        buf = bytearray()
-        while True:
-            c = self.__serial.read()
-            if not c:
-                raise TimeoutError("Timeout waiting for serial data")
-            elif c == b"$" or c == b"#":
-                break
-            elif maxlength is not None and maxlength <= len(buf):
-                raise BufferTooShort("Buffer too short for data received")
-            else:
-                buf.extend(c)
-        return bytes(buf)
+        reader = self.__reader
+        size = self.__read(maxlength)
+        res = bytes(reader.buffer[:size])
+        reader.consume(size)
+        return res
+
+    def recv_into(self, buf, offset=0):
+        reader = self.__reader
+        view = memoryview(buf).cast("B")
+        if offset < 0 or offset > len(view):
+            raise ValueError("offset out of range")
+        size = self.__read(len(view) - offset)
+        with memoryview(reader.buffer) as data:
+            view[offset : offset + size] = data[:size]
+        reader.consume(size)
+        return size
 
     def send(self, buf, offset=0, size=None):
         n = len(buf)
@@ -39,13 +70,188 @@ class SerialConnection(Connection):
             raise ValueError("size is negative")
         elif offset + size > n:
             raise ValueError("buffer length < offset + size")
-        self.__serial.write(b'"')
-        self.__serial.write(buf[offset : offset + size])
-        self.__serial.write(b"$")
-        self.__serial.flush()
+        output = self.__output
+        output += b'"'
+        output += memoryview(buf).cast("B")[offset : offset + size]
+        output += b"$"
+        if not self.__corked:
+            self.__write()
+
+    def send_many(self, bufs):
+        self.cork()
+        try:
+            for buf in bufs:
+                self.send(buf)
+        finally:
+            self.uncork()
+
+    def __read(self, maxlength):
+        reader = self.__reader
+        if self.__output:
+            self.__write()
+        while True:
+            size = reader.find(maxlength)
+            if size >= 0:
+                return size
+            # read everything available, or wait for at least one byte
+            data = self.__serial.read(self.__serial.in_waiting or 1)
+            if not data:
+                raise TimeoutError("Timeout waiting for serial data")
+            reader.feed(data)
+
+    def __write(self):
+        if self.__output:
+            self.__serial.write(self.__output)
+            del self.__output[:]
 
     @classmethod
     def scan(_):
         from serial.tools.list_ports import comports
 
         return ((info.device, info.description) for info in comports())
+
+
+class AsyncSerialConnection(AsyncConnection):
+    POLL_INTERVAL = 0.005
+    """Interval in seconds for polling the serial port if the event
+    loop does not support waiting for the port to become readable."""
+
+    __serial = None
+
+    def __init__(self, url, timeout=None):
+        self.__serial = serial_for_url(url, baudrate=19200, timeout=0)
+        self.__timeout = timeout
+        self.__reader = _FrameReader()
+        # writes may block, so they are performed in order by a thread
+        self.__writer = concurrent.futures.ThreadPoolExecutor(1)
+        try:
+            self.__fileno = self.__serial.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.__fileno = None
+
+    async def close(self):
+        if self.__serial:
+            loop = asyncio.get_running_loop()
+            # close the port after pending writes have completed
+            await loop.run_in_executor(self.__writer, self.__serial.close)
+            self.__writer.shutdown()
+
+    async def recv(self, maxlength=None):
+        try:
+            return await asyncio.wait_for(self.__recv(maxlength), self.__timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timeout waiting for serial data")
+
+    async def send(self, buf, offset=0, size=None):
+        n = len(buf)
+        if offset < 0:
+            raise ValueError("offset is negative")
+        elif n < offset:
+            raise ValueError("buffer length < offset")
+        elif size is None:
+            size = n - offset
+        elif size < 0:
+            raise ValueError("size is negative")
+        elif offset + size > n:
+            raise ValueError("buffer length < offset + size")
+        data = b'"' + bytes(buf[offset : offset + size]) + b"$"
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.__writer, self.__serial.write, data)
+
+    async def __recv(self, maxlength):
+        reader = self.__reader
+        while True:
+            size = reader.find(maxlength)
+            if size >= 0:
+                res = bytes(reader.buffer[:size])
+                reader.consume(size)
+                return res
+            data = self.__serial.read(self.__serial.in_waiting or 1)
+            if data:
+                reader.feed(data)
+            else:
+                await self.__readable()
+
+    async def __readable(self):
+        loop = asyncio.get_running_loop()
+        if self.__fileno is not None:
+            future = loop.create_future()
+            try:
+                loop.add_reader(self.__fileno, _set_done, future)
+            except NotImplementedError:
+                # e.g. Windows proactor event loop
+                self.__fileno = None
+            else:
+                try:
+                    await future
+                finally:
+                    loop.remove_reader(self.__fileno)
+                return
+        await asyncio.sleep(self.POLL_INTERVAL)
+
+
+class _FrameReader(object):
+    """Buffer for splitting received data into frames terminated by
+    '$' or '#'.
+
+    While received data is scanned for terminators, the checksum of
+    the first frame is accumulated in :attr:`checksum`.  Since it
+    covers the whole frame, checksums over parts of the frame can be
+    verified by subtracting the remaining bytes.
+
+    """
+
+    TERMINATOR = re.compile(b"[$#]")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.checksum = Checksum()
+        self.__pos = 0
+        self.__discarding = False
+
+    def consume(self, size):
+        """Remove a frame of length `size` and its terminator."""
+        del self.buffer[: size + 1]
+        self.checksum.reset()
+        self.__pos = 0
+
+    def feed(self, data):
+        """Append received data to the buffer."""
+        self.buffer += data
+
+    def find(self, maxlength=None):
+        """Return the length of the first complete frame in the
+        buffer, or -1 if no complete frame has been received yet.
+
+        If the frame is longer than `maxlength`, it is dropped up to
+        and including its terminator, and :exc:`BufferTooShort` is
+        raised once the terminator has been received.
+
+        """
+        buffer = self.buffer
+        pos = self.__pos
+        match = self.TERMINATOR.search(buffer, pos)
+        if match is None:
+            if maxlength is not None and maxlength < len(buffer):
+                self.__discarding = True
+            if self.__discarding:
+                del buffer[:]
+                self.checksum.reset()
+            else:
+                self.checksum.update(buffer, pos)
+            # do not scan the same bytes again
+            self.__pos = len(buffer)
+            return -1
+        size = match.start()
+        self.checksum.update(buffer, pos, size - pos)
+        self.__pos = size
+        if self.__discarding or (maxlength is not None and maxlength < size):
+            self.__discarding = False
+            self.consume(size)
+            raise BufferTooShort("Buffer too short for data received")
+        return size
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,141 @@
+"""Managing several Control Units at once.
+
+A :class:`SessionManager` connects to any number of Control Units,
+e.g. for running several tracks from a single host, polls each of
+them from a background thread, and merges their events into a single
+stream of :class:`SessionEvent` objects tagged with the unit's name.
+Units that fail are reconnected independently, so a dropped cable or
+Bluetooth connection only affects a single track.
+
+"""
+
+import logging
+from collections import namedtuple
+
+from . import connection, protocol
+from .cu import ControlUnit
+from .poller import Poller, _poll
+
+logger = logging.getLogger(__name__)
+
+
+class SessionEvent(namedtuple("SessionEvent", "unit event")):
+    """An event reported by the Control Unit named :attr:`unit`.
+
+    :attr:`event` is either a :class:`carreralib.ControlUnit.Timer` or
+    :class:`carreralib.ControlUnit.Status` object, or one of
+    :class:`Connected` or :class:`Disconnected`.
+
+    """
+
+    __slots__ = ()
+
+
+class Connected(namedtuple("Connected", "version")):
+    """Event signaling that a unit with CU version :attr:`version` has
+    been connected."""
+
+    __slots__ = ()
+
+
+class Disconnected(namedtuple("Disconnected", "error")):
+    """Event signaling that a unit has been disconnected due to
+    :attr:`error`, and will be reconnected."""
+
+    __slots__ = ()
+
+
+class SessionManager(Poller):
+    """Poll several Control Units from background threads.
+
+    `devices` should be a mapping of unit names to devices, or a
+    sequence of devices which will also be used as names.  A device
+    may be anything accepted by :func:`carreralib.connection.open`,
+    or a callable returning a :class:`carreralib.connection.Connection`.
+    Additional keyword arguments are passed to
+    :func:`carreralib.connection.open`.
+
+    All units are opened concurrently and polled at most `rate` times
+    per second, as with :meth:`carreralib.ControlUnit.events`.  If a
+    unit fails with a :exc:`carreralib.connection.ConnectionError`,
+    :exc:`OSError` or a protocol error, e.g. due to a garbled message,
+    a :class:`Disconnected` event is reported, and reconnecting is
+    attempted after `retry` seconds, doubling the delay for every
+    failed attempt up to `maxretry` seconds.  Other units are not
+    affected by this.
+
+    At most `maxsize` events are buffered; while the buffer is full,
+    polling is suspended.  Otherwise, session managers behave like
+    :class:`carreralib.poller.Poller` objects.
+
+    """
+
+    def __init__(
+        self, devices, rate=50.0, maxsize=256, retry=1.0, maxretry=30.0, **kwargs
+    ):
+        if not hasattr(devices, "items"):
+            devices = {device: device for device in devices}
+        self.__retry = (retry, maxretry)
+        self.__units = dict.fromkeys(devices)
+        factories = {}
+        for name, device in devices.items():
+            factories[name] = device if callable(device) else _opener(device, kwargs)
+        Poller.__init__(self, factories, rate, maxsize)
+
+    def __getitem__(self, name):
+        cu = self.__units[name]
+        if cu is None:
+            raise connection.ConnectionError("Unit %r not connected" % name)
+        return cu
+
+    @property
+    def units(self):
+        """Mapping of unit names to connected
+        :class:`carreralib.ControlUnit` objects, or :const:`None` for
+        units currently not connected."""
+        return dict(self.__units)
+
+    def _start(self, factories):
+        for name, factory in factories.items():
+            self._spawn(self.__run, name, factory)
+
+    def __run(self, name, factory):
+        retry, maxretry = self.__retry
+        delay = retry
+        stopped = self._stopped
+
+        def put(event):
+            return self._put(SessionEvent(name, event))
+
+        while not stopped.is_set():
+            cu = None
+            try:
+                cu = ControlUnit(factory())
+                version = cu.version()
+                self.__units[name] = cu
+                delay = retry
+                if put(Connected(version)):
+                    _poll(cu, self._interval, put, stopped)
+                error = None
+            except (connection.ConnectionError, OSError) as e:
+                logger.warning("Error polling %s: %s", name, e)
+                error = e
+            except (protocol.ProtocolError, protocol.ChecksumError) as e:
+                logger.warning("Protocol error polling %s: %s", name, e)
+                error = e
+            except Exception as e:
+                logger.error("Error polling %s: %s", name, e)
+                self._put(e)
+                break
+            finally:
+                self.__units[name] = None
+                if cu is not None:
+                    cu.close()
+            if error is not None:
+                put(Disconnected(error))
+                stopped.wait(delay)
+                delay = min(delay * 2, maxretry)
+
+
+def _opener(device, kwargs):
+    return lambda: connection.open(device, **kwargs)
@@ -0,0 +1,285 @@
+import random
+import time
+from collections import deque
+from urllib.parse import parse_qsl, urlsplit
+
+from . import protocol
+from .connection import BufferTooShort, Connection, TimeoutError
+from .cu import ControlUnit
+
+# bits per byte on the wire, including start and stop bits
+BITS_PER_BYTE = 10
+
+# command words handled by the simulator
+SPEED_WORD = 0
+FUEL_WORD = 2
+
+# status mode bits
+FUEL_MODE = ControlUnit.Status.FUEL_MODE
+REAL_MODE = ControlUnit.Status.REAL_MODE
+PIT_LANE_MODE = ControlUnit.Status.PIT_LANE_MODE
+
+# start light sequence
+START_LIGHTS_ON = 1
+START_LIGHTS_GO = 6
+
+
+class SimulatorConnection(Connection):
+    """Connection to a simulated Control Unit.
+
+    The simulator is configured using a URL of the form
+    ``sim://?name=value&...``, with the following optional
+    parameters:
+
+    +--------------+----------+-----------------------------------------+
+    | Name         | Default  | Description                             |
+    +==============+==========+=========================================+
+    | ``cars``     | 2        | Number of cars on the track (1..8)      |
+    +--------------+----------+-----------------------------------------+
+    | ``laptime``  | 5000     | Comma-separated list of nominal lap     |
+    |              |          | times in milliseconds per car           |
+    +--------------+----------+-----------------------------------------+
+    | ``jitter``   | 0.02     | Relative standard deviation of lap      |
+    |              |          | times                                   |
+    +--------------+----------+-----------------------------------------+
+    | ``pittime``  | 4000     | Time in milliseconds spent refueling    |
+    +--------------+----------+-----------------------------------------+
+    | ``mode``     | 6        | Mode bit mask reported in status        |
+    +--------------+----------+-----------------------------------------+
+    | ``seed``     | 0        | Seed for the random number generator    |
+    +--------------+----------+-----------------------------------------+
+    | ``version``  | 5337     | Reported CU version                     |
+    +--------------+----------+-----------------------------------------+
+    | ``blocksize``| none     | Maximum firmware update block size, 18  |
+    |              |          | to emulate a BLE connection             |
+    +--------------+----------+-----------------------------------------+
+    | ``baudrate`` | 0        | Throttle data to the given baud rate    |
+    +--------------+----------+-----------------------------------------+
+    | ``latency``  | 0        | Additional delay in seconds for each    |
+    |              |          | response                                |
+    +--------------+----------+-----------------------------------------+
+
+    Simulated time is independent of wall clock time: every request
+    advances the CU clock by the time it would take to transmit the
+    request and its response at 19200 baud, so results are fully
+    reproducible for a given configuration.  Throttling by `baudrate`
+    and `latency` only affects the real time spent waiting for
+    responses.
+
+    """
+
+    BAUDRATE = 19200
+    """Baud rate used for advancing simulated time."""
+
+    def __init__(self, url="sim://", timeout=None):
+        params = dict(parse_qsl(urlsplit(url).query))
+        ncars = int(params.get("cars", 2))
+        if ncars < 1 or ncars > 8:
+            raise ValueError("Number of cars out of range")
+        laptimes = [int(t) for t in params.get("laptime", "5000").split(",")]
+        laptimes.extend(laptimes[-1:] * (ncars - len(laptimes)))
+        self.__rng = random.Random(int(params.get("seed", 0)))
+        self.__jitter = float(params.get("jitter", 0.02))
+        self.__pittime = int(params.get("pittime", 4000))
+        self.__mode = int(params.get("mode", 6))
+        self.__version = params.get("version", "5337").encode()
+        self.__baudrate = int(params.get("baudrate", 0))
+        self.__latency = float(params.get("latency", 0))
+        if "blocksize" in params:
+            self.max_fwu_block_size = int(params["blocksize"])
+        self.__cars = [_Car(laptime) for laptime in laptimes[:ncars]]
+        self.__output = deque()
+        self.__timers = deque()
+        self.__now = 0.0
+        self.__epoch = 0
+        self.__start = 0
+        self.__countdown = None
+        self.__racing = False
+        self.__ignore = 0
+        self.__words = {}
+        self.firmware = bytearray()
+        self.__handlers = {
+            b"?": self.__poll,
+            b"0": self.__get_version,
+            b"J": self.__setword,
+            b"T": self.__press,
+            b"=": self.__reset,
+            b":": self.__set_ignore,
+            b"G": self.__fwu_start,
+            b"E": self.__fwu_write,
+            b"F": self.__fwu_block,
+        }
+
+    def recv(self, maxlength=None):
+        if not self.__output:
+            raise TimeoutError("Timeout waiting for simulator data")
+        buf = self.__output.popleft()
+        self.__throttle(len(buf) + 1)
+        if self.__latency:
+            time.sleep(self.__latency)
+        if maxlength is not None and maxlength < len(buf):
+            raise BufferTooShort("Buffer too short for data received")
+        return buf
+
+    def send(self, buf, offset=0, size=None):
+        n = len(buf)
+        if offset < 0:
+            raise ValueError("offset is negative")
+        elif n < offset:
+            raise ValueError("buffer length < offset")
+        elif size is None:
+            size = n - offset
+        elif size < 0:
+            raise ValueError("size is negative")
+        elif offset + size > n:
+            raise ValueError("buffer length < offset + size")
+        buf = bytes(buf[offset : offset + size])
+        self.__throttle(len(buf) + 2)
+        handler = self.__handlers.get(buf[0:1])
+        res = handler(buf) if handler else b""
+        # request, response and framing bytes
+        nbytes = len(buf) + len(res) + 3
+        self.__advance(nbytes * BITS_PER_BYTE * 1000.0 / self.BAUDRATE)
+        self.__output.append(res)
+
+    @property
+    def settings(self):
+        """Mapping of `(word, address)` tuples to the values set by
+        ``J`` commands."""
+        return dict(self.__words)
+
+    @property
+    def time(self):
+        """The simulated CU time in milliseconds."""
+        return int(self.__now)
+
+    def __advance(self, dt):
+        end = self.__now + dt
+        if self.__countdown is not None:
+            self.__countdown -= dt
+            while self.__countdown is not None and self.__countdown <= 0:
+                self.__start += 1
+                self.__countdown += 1000.0
+                if self.__start > START_LIGHTS_GO:
+                    self.__start = 0
+                    self.__countdown = None
+                    self.__go(end)
+        if self.__racing:
+            events = []
+            for address, car in enumerate(self.__cars):
+                while car.next <= end:
+                    events.append((car.next, address))
+                    self.__lap(address, car.next)
+            for timestamp, address in sorted(events):
+                if not self.__ignore & (1 << address):
+                    self.__timers.append((address, int(timestamp)))
+        self.__now = end
+
+    def __go(self, now):
+        self.__racing = True
+        for address, car in enumerate(self.__cars):
+            if car.remaining is None:
+                car.remaining = self.__laptime(address)
+            car.next = now + car.remaining
+
+    def __pause(self):
+        self.__racing = False
+        for car in self.__cars:
+            car.remaining = car.next - self.__now
+
+    def __lap(self, address, timestamp):
+        car = self.__cars[address]
+        car.laps += 1
+        if self.__mode & (FUEL_MODE | REAL_MODE):
+            # higher fuel settings mean lower consumption
+            setting = self.__words.get((FUEL_WORD, address), 8)
+            car.fuel = max(car.fuel - (16 - setting) / 8.0, 0.0)
+        laptime = self.__laptime(address)
+        if self.__mode & PIT_LANE_MODE and car.fuel < 3:
+            # refuel halfway through the next lap
+            pitin = timestamp + laptime / 2
+            car.pit = (pitin, pitin + self.__pittime)
+            car.fuel = 15.0
+            laptime += self.__pittime
+        car.next = timestamp + laptime
+
+    def __laptime(self, address):
+        car = self.__cars[address]
+        # slower speed settings mean longer lap times
+        speed = self.__words.get((SPEED_WORD, address), 15)
+        laptime = car.laptime * (1.5 - speed / 30.0)
+        return max(laptime * self.__rng.gauss(1.0, self.__jitter), 1.0)
+
+    def __throttle(self, nbytes):
+        if self.__baudrate:
+            time.sleep(nbytes * BITS_PER_BYTE / self.__baudrate)
+
+    def __poll(self, buf):
+        if self.__timers:
+            address, timestamp = self.__timers.popleft()
+            timestamp = (timestamp - self.__epoch) & 0xFFFFFFFF
+            return protocol.pack("cYIYC", b"?", address + 1, timestamp, 1)
+        fuel = [int(car.fuel) for car in self.__cars]
+        fuel.extend([0] * (8 - len(fuel)))
+        pitmask = 0
+        for address, car in enumerate(self.__cars):
+            if car.pit and car.pit[0] <= self.__now < car.pit[1]:
+                pitmask |= 1 << address
+        display = 8 if len(self.__cars) > 6 else 6
+        return protocol.pack(
+            "2s8YYYBYC", b"?:", *fuel, self.__start, self.__mode, pitmask, display
+        )
+
+    def __get_version(self, buf):
+        return protocol.pack("c4sC", b"0", self.__version)
+
+    def __setword(self, buf):
+        _, word, value, _ = protocol.unpack("cBYYC", buf)
+        self.__words[(word & 0x1F, word >> 5)] = value
+        return buf[0:1]
+
+    def __press(self, buf):
+        _, button_id = protocol.unpack("cYC", buf)
+        if button_id == ControlUnit.START_ENTER_BUTTON_ID:
+            if self.__racing:
+                self.__pause()
+                self.__start = START_LIGHTS_ON
+            elif self.__start == 0:
+                self.__start = START_LIGHTS_ON
+            elif self.__countdown is None:
+                self.__countdown = 1000.0
+        return buf[0:1]
+
+    def __reset(self, buf):
+        self.__epoch = int(self.__now)
+        self.__timers.clear()
+        return buf[0:1]
+
+    def __set_ignore(self, buf):
+        self.__ignore = protocol.unpack("cBC", buf)[1]
+        return buf[0:1]
+
+    def __fwu_start(self, buf):
+        self.firmware = bytearray()
+        return buf[0:1]
+
+    def __fwu_write(self, buf):
+        if len(buf) > 2:
+            protocol.unpack(f"c{len(buf) - 2}sC", buf)
+            self.firmware += buf[1:-1]
+        return buf[0:1]
+
+    def __fwu_block(self, buf):
+        _, size = protocol.unpack("cr", buf)
+        self.firmware += buf[2 : 2 + size]
+        return buf[0:1]
+
+
+class _Car(object):
+    def __init__(self, laptime):
+        self.laptime = laptime
+        self.laps = 0
+        self.fuel = 15.0
+        self.pit = None
+        self.next = None
+        self.remaining = None
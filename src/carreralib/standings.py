@@ -0,0 +1,168 @@
+"""Incremental race standings.
+
+:class:`Standings` keeps race positions up to date as
+:class:`carreralib.ControlUnit.Timer` events arrive.  Since a car
+passing the start/finish line can only gain positions, each update
+moves a single car up the running order instead of sorting all cars.
+
+"""
+
+from collections import namedtuple
+
+
+class Entry(namedtuple("Entry", "position address laps time gap interval")):
+    """A car's entry in the standings.
+
+    :attr:`position` is the one-based race position, :attr:`address`
+    the controller address, :attr:`laps` the number of completed laps,
+    and :attr:`time` the timestamp of the car's last start/finish line
+    crossing.  :attr:`gap` and :attr:`interval` are `(laps, time)`
+    tuples holding the number of laps and the time in milliseconds
+    the car is behind the leader and the car ahead, respectively.
+
+    """
+
+    __slots__ = ()
+
+
+class PositionChange(namedtuple("PositionChange", "address old new")):
+    """Event signaling that the car with controller address
+    :attr:`address` moved from position :attr:`old` to :attr:`new`.
+
+    :attr:`old` is :const:`None` when a car enters the standings.
+
+    """
+
+    __slots__ = ()
+
+
+class Standings(object):
+    """Race standings for up to `naddresses` controller addresses.
+
+    If `cu` is given, the Position Tower connected to this
+    :class:`carreralib.ControlUnit` is updated as positions and the
+    leader's lap count change.  Only positions that differ from the
+    ones last displayed are sent to the CU.
+
+    """
+
+    def __init__(self, cu=None, naddresses=8):
+        self.cu = cu
+        self.naddresses = naddresses
+        self.reset()
+
+    def __len__(self):
+        return len(self.__order)
+
+    def __iter__(self):
+        return iter(self.entries())
+
+    def reset(self):
+        """Reset the standings.
+
+        This does not clear the Position Tower, which should be done
+        by calling :meth:`carreralib.ControlUnit.clrpos`.
+
+        """
+        self.__order = []
+        self.__laps = [0] * self.naddresses
+        self.__times = [None] * self.naddresses
+        self.__tower = {}
+        self.__leaderlaps = 0
+
+    def update(self, timer):
+        """Update the standings with a
+        :class:`carreralib.ControlUnit.Timer` event, and return a list
+        of :class:`PositionChange` events.
+
+        Only times reported for the start/finish line are taken into
+        account.
+
+        """
+        if timer.sector != 1:
+            return []
+        address = timer.address
+        order = self.__order
+        laps = self.__laps
+        times = self.__times
+        new = times[address] is None
+        if new:
+            index = len(order)
+            order.append(address)
+        else:
+            index = order.index(address)
+            laps[address] += 1
+        times[address] = timer.timestamp
+        key = (-laps[address], timer.timestamp)
+        pos = index
+        while pos > 0:
+            ahead = order[pos - 1]
+            if (-laps[ahead], times[ahead]) <= key:
+                break
+            order[pos] = ahead
+            pos -= 1
+        order[pos] = address
+        changes = []
+        if new:
+            changes.append(PositionChange(address, None, pos + 1))
+        elif pos != index:
+            changes.append(PositionChange(address, index + 1, pos + 1))
+        for i in range(pos + 1, index + 1):
+            changes.append(PositionChange(order[i], i, i + 1))
+        if self.cu is not None:
+            self.__sync()
+        return changes
+
+    def position(self, address):
+        """Return the position of `address`, or :const:`None`."""
+        try:
+            return self.__order.index(address) + 1
+        except ValueError:
+            return None
+
+    def leader(self):
+        """Return the controller address of the leader, or
+        :const:`None`."""
+        return self.__order[0] if self.__order else None
+
+    def entries(self):
+        """Return a list of :class:`Entry` objects in position
+        order."""
+        entries = []
+        laps = self.__laps
+        times = self.__times
+        prev = None
+        for pos, address in enumerate(self.__order, start=1):
+            if prev is None:
+                leader = address
+                gap = interval = (0, 0)
+            else:
+                gap = _gap(laps, times, leader, address)
+                interval = _gap(laps, times, prev, address)
+            entries.append(
+                Entry(pos, address, laps[address], times[address], gap, interval)
+            )
+            prev = address
+        return entries
+
+    def __sync(self):
+        words = []
+        tower = self.__tower
+        for pos, address in enumerate(self.__order, start=1):
+            # Position Tower only displays eight positions
+            if pos <= 8 and tower.get(address) != pos:
+                words.append((6, address, pos))
+                tower[address] = pos
+        leaderlaps = self.__laps[self.__order[0]]
+        if leaderlaps != self.__leaderlaps:
+            # position tower only handles 250 laps
+            value = leaderlaps % 250
+            words.append((17, 7, value >> 4))
+            words.append((18, 7, value & 0xF))
+            self.__leaderlaps = leaderlaps
+        if words:
+            self.cu.setwords(words)
+
+
+def _gap(laps, times, ahead, address):
+    return (laps[ahead] - laps[address], times[address] - times[ahead])
@@ -0,0 +1,169 @@
+"""Compact lap and sector time history.
+
+:class:`LapStore` records lap and sector times for all controller
+addresses in :class:`array.array` columns of unsigned 32-bit integers,
+so memory usage stays at a few bytes per lap even for endurance races.
+Since arrays support the buffer protocol, columns may be wrapped
+without copying, e.g. using ``numpy.frombuffer(a, dtype="uint32")``.
+
+"""
+
+import heapq
+import math
+from array import array
+from collections import namedtuple
+
+MASK = 0xFFFFFFFF
+
+
+class LapStats(namedtuple("LapStats", "count best worst mean stdev")):
+    """Lap time statistics as returned by :meth:`LapStore.stats`.
+
+    All times are in milliseconds.  :attr:`stdev` is the population
+    standard deviation, so a driver's consistency may be compared
+    using the coefficient of variation ``stdev / mean``.
+
+    """
+
+    __slots__ = ()
+
+
+class LapStore(object):
+    """Lap and sector time history for `naddresses` controller
+    addresses, with laps divided into `nsectors` sectors by Check
+    Lanes."""
+
+    def __init__(self, naddresses=8, nsectors=1):
+        if nsectors < 1:
+            raise ValueError("Number of sectors out of range")
+        self.__tracks = [_Track(nsectors) for _ in range(naddresses)]
+        self.nsectors = nsectors
+
+    def __len__(self):
+        return len(self.__tracks)
+
+    def add(self, timer):
+        """Record a :class:`carreralib.ControlUnit.Timer` event."""
+        self.append(timer.address, timer.timestamp, timer.sector)
+
+    def append(self, address, timestamp, sector=1):
+        """Record controller `address` passing `sector` at
+        `timestamp`.
+
+        Passing the start/finish line, i.e. sector 1, completes the
+        current lap.  Sector times of laps with missing Check Lane
+        events are recorded as zero.
+
+        """
+        track = self.__tracks[address]
+        if 1 <= sector <= self.nsectors:
+            track.append(timestamp, sector)
+
+    def clear(self):
+        """Remove all recorded times."""
+        self.__tracks = [_Track(self.nsectors) for _ in self.__tracks]
+
+    def laps(self, address):
+        """Return the number of laps completed by `address`."""
+        return len(self.__tracks[address].laptimes)
+
+    def timestamps(self, address, start=None, stop=None):
+        """Return the start/finish line timestamps of `address` as an
+        array, optionally sliced from lap `start` to `stop`.
+
+        The first timestamp marks the start of the first lap, so the
+        result has one element more than :meth:`laptimes`.
+
+        """
+        return self.__tracks[address].timestamps[start:stop]
+
+    def laptimes(self, address, start=None, stop=None):
+        """Return the lap times of `address` in milliseconds as an
+        array, optionally sliced from lap `start` to `stop`."""
+        return self.__tracks[address].laptimes[start:stop]
+
+    def sectortimes(self, address, sector, start=None, stop=None):
+        """Return the times of `address` for `sector` in milliseconds
+        as an array, optionally sliced from lap `start` to `stop`."""
+        if not 1 <= sector <= self.nsectors:
+            raise ValueError("Sector out of range")
+        return self.__tracks[address].sectors[sector - 1][start:stop]
+
+    def last(self, address):
+        """Return the last lap time of `address`, or :const:`None`."""
+        laptimes = self.__tracks[address].laptimes
+        return laptimes[-1] if laptimes else None
+
+    def best(self, address, n=1, sector=None):
+        """Return the `n` best laps of `address` as a list of
+        ``(lap, time)`` tuples, where `lap` is the zero-based lap
+        number.
+
+        If `sector` is given, return the best times for this sector
+        instead.
+
+        """
+        if sector is None:
+            values = self.__tracks[address].laptimes
+        else:
+            values = self.sectortimes(address, sector)
+        laps = ((t, i) for i, t in enumerate(values) if t)
+        return [(i, t) for t, i in heapq.nsmallest(n, laps)]
+
+    def rolling(self, address, window):
+        """Return the rolling average lap times of `address` over
+        `window` laps as a list of floats."""
+        if window < 1:
+            raise ValueError("Window size out of range")
+        laptimes = self.__tracks[address].laptimes
+        if len(laptimes) < window:
+            return []
+        total = sum(laptimes[:window])
+        result = [total / window]
+        for old, new in zip(laptimes, laptimes[window:]):
+            total += new - old
+            result.append(total / window)
+        return result
+
+    def stats(self, address, last=None):
+        """Return :class:`LapStats` for `address`, optionally for the
+        `last` laps only, or :const:`None` if no laps were
+        completed."""
+        laptimes = self.__tracks[address].laptimes
+        if last is not None:
+            laptimes = laptimes[-last:] if last else laptimes[:0]
+        if not laptimes:
+            return None
+        count = len(laptimes)
+        mean = sum(laptimes) / count
+        variance = sum((t - mean) ** 2 for t in laptimes) / count
+        return LapStats(count, min(laptimes), max(laptimes), mean, math.sqrt(variance))
+
+
+class _Track(object):
+    __slots__ = ("timestamps", "laptimes", "sectors", "splits", "last")
+
+    def __init__(self, nsectors):
+        self.timestamps = array("I")
+        self.laptimes = array("I")
+        self.sectors = [array("I") for _ in range(nsectors)]
+        self.splits = [0] * nsectors
+        self.last = None
+
+    def append(self, timestamp, sector):
+        last = self.last
+        if last is not None:
+            time, prev = last
+            # only consecutive Check Lanes define a sector time
+            if sector == prev % len(self.splits) + 1:
+                self.splits[prev - 1] = (timestamp - time) & MASK
+        if sector == 1:
+            if self.timestamps:
+                laptime = (timestamp - self.timestamps[-1]) & MASK
+                self.laptimes.append(laptime)
+                for column, split in zip(self.sectors, self.splits):
+                    column.append(split)
+            self.timestamps.append(timestamp)
+            self.splits = [0] * len(self.splits)
+        if sector == 1 or last is not None:
+            self.last = (timestamp, sector)
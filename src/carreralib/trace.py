@@ -0,0 +1,94 @@
+"""Message tracing and logging utilities.
+
+Setting the :attr:`carreralib.ControlUnit.trace` attribute to a
+callable will invoke it as ``trace(direction, data)`` for every
+message sent to or received from the Control Unit, where `direction`
+is either :const:`SENT` or :const:`RECEIVED`.  If :attr:`trace` is
+:const:`None`, which is the default, tracing has practically no
+overhead.
+
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from collections import deque, namedtuple
+
+from .capture import RECEIVED, SENT
+
+__all__ = (
+    "RECEIVED",
+    "SENT",
+    "LogTrace",
+    "TraceBuffer",
+    "TraceEntry",
+    "start_logging",
+)
+
+
+class TraceEntry(namedtuple("TraceEntry", "timestamp direction data")):
+    """A traced message.
+
+    :attr:`timestamp` is the value of :func:`time.monotonic` when the
+    message was traced.
+
+    """
+
+    __slots__ = ()
+
+
+class TraceBuffer(object):
+    """Ring buffer holding the last `maxlen` traced messages."""
+
+    def __init__(self, maxlen=1024):
+        self.__entries = deque(maxlen=maxlen)
+
+    def __call__(self, direction, data, clock=time.monotonic):
+        self.__entries.append((clock(), direction, data))
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        """Remove all entries from the buffer."""
+        self.__entries.clear()
+
+    def entries(self):
+        """Return a list of :class:`TraceEntry` objects, oldest first."""
+        return [TraceEntry(*entry) for entry in self.__entries]
+
+
+class LogTrace(object):
+    """Trace messages by logging them to `logger` with `level`."""
+
+    def __init__(self, logger, level=logging.DEBUG):
+        self.__log = logger.log
+        self.__level = level
+
+    def __call__(self, direction, data):
+        if direction == SENT:
+            self.__log(self.__level, "Sending message %r", data)
+        else:
+            self.__log(self.__level, "Received message %r", data)
+
+
+def start_logging(filename, level=logging.WARNING, format=None):
+    """Configure the root logger to write to `filename` from a
+    background thread.
+
+    Log records are passed to a :class:`logging.handlers.QueueHandler`,
+    so logging never blocks on file I/O.  Pending records are written
+    when the interpreter exits.
+
+    """
+    handler = logging.FileHandler(filename)
+    handler.setFormatter(logging.Formatter(format))
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
@@ -0,0 +1,294 @@
+import asyncio
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from carreralib import connection
+from carreralib.ble import (
+    AsyncBLEConnection,
+    BLEConnection,
+    BLEManager,
+    CU_NAME,
+    _FrameBuffer,
+)
+
+
+class FakeError(Exception):
+    pass
+
+
+class FakeBackend(object):
+    def __init__(self, devices=()):
+        self.devices = [types.SimpleNamespace(address=a, name=n) for a, n in devices]
+        self.scans = 0
+        self.clients = []
+        backend = self
+
+        class BleakClient(object):
+            def __init__(self, address, disconnected_callback=None):
+                self.address = address
+                self.disconnected_callback = disconnected_callback
+                self.is_connected = False
+                self.written = []
+                backend.clients.append(self)
+
+            async def connect(self):
+                if self.address == "unknown":
+                    raise FakeError("Device not found")
+                self.loop = asyncio.get_running_loop()
+                self.thread = threading.current_thread()
+                self.is_connected = True
+
+            async def disconnect(self):
+                self.is_connected = False
+
+            async def start_notify(self, uuid, callback):
+                self.callback = callback
+
+            async def write_gatt_char(self, uuid, data):
+                self.written.append(data)
+
+            def notify(self, data):
+                self.loop.call_soon_threadsafe(self.callback, None, bytearray(data))
+
+            def drop(self):
+                self.is_connected = False
+                self.loop.call_soon_threadsafe(self.disconnected_callback, self)
+
+        class BleakScanner(object):
+            @staticmethod
+            async def discover(timeout=5.0):
+                backend.scans += 1
+                return list(backend.devices)
+
+        self.BleakClient = BleakClient
+        self.BleakScanner = BleakScanner
+        self.BleakError = FakeError
+
+
+def wait(predicate, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timeout waiting for condition")
+        time.sleep(0.001)
+
+
+class BLEManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend(
+            [("A", CU_NAME), ("B", "Headphones"), ("C", CU_NAME)]
+        )
+        self.manager = BLEManager(self.backend, linger=10.0)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_discover(self):
+        devices = [("A", CU_NAME), ("C", CU_NAME)]
+        self.assertEqual(self.manager.discover(), devices)
+        self.assertEqual(self.manager.discover(), devices)
+        self.assertEqual(self.backend.scans, 1)
+        self.assertEqual(self.manager.discover(refresh=True), devices)
+        self.assertEqual(self.backend.scans, 2)
+        # connected devices are no longer advertised
+        conn = BLEConnection("D", manager=self.manager)
+        self.assertIn(("D", CU_NAME), self.manager.discover())
+        conn.close()
+        manager = BLEManager(self.backend, ttl=0)
+        try:
+            manager.discover()
+            manager.discover()
+            self.assertEqual(self.backend.scans, 4)
+        finally:
+            manager.close()
+
+    def test_send_recv(self):
+        conn = BLEConnection("A", timeout=0.1, manager=self.manager)
+        (client,) = self.backend.clients
+        conn.send(b"x0y", 1, 1)
+        conn.send(b"?")
+        conn.send(b"J0:420")
+        conn.send(b"T50")
+        wait(lambda: len(client.written) == 4)
+        self.assertEqual(client.written, [b"0", b"?", b"J0:420", b"T50"])
+        # coalesced and fragmented notifications
+        client.notify(b"53370$:1")
+        client.notify(b"23$")
+        self.assertEqual(conn.recv(), b"053370")
+        buf = bytearray(8)
+        self.assertEqual(conn.recv_into(buf, 1), 5)
+        self.assertEqual(buf, b"\0?:123\0\0")
+        # unterminated command echoes
+        client.notify(b"J")
+        client.notify(b"T")
+        self.assertEqual(conn.recv(), b"J")
+        self.assertEqual(conn.recv(), b"T")
+        # coalesced command echoes
+        conn.send(b"J0:420")
+        conn.send(b"T50")
+        client.notify(b"JT")
+        self.assertEqual(conn.recv(), b"J")
+        self.assertEqual(conn.recv(), b"T")
+        with self.assertRaises(connection.TimeoutError):
+            conn.recv()
+        client.notify(b"stale")
+        time.sleep(0.01)
+        conn.discard()
+        with self.assertRaises(connection.TimeoutError):
+            conn.recv()
+        conn.close()
+
+    def test_reuse(self):
+        conn = BLEConnection("A", manager=self.manager)
+        with self.assertRaises(connection.ConnectionError):
+            BLEConnection("A", manager=self.manager)
+        other = BLEConnection("C", manager=self.manager)
+        conn.close()
+        conn = BLEConnection("A", manager=self.manager)
+        self.assertEqual([c.address for c in self.backend.clients], ["A", "C"])
+        self.assertIs(self.backend.clients[0].thread, self.backend.clients[1].thread)
+        conn.close()
+        other.close()
+        self.manager.close()
+        self.assertFalse(any(c.is_connected for c in self.backend.clients))
+
+    def test_linger(self):
+        manager = BLEManager(self.backend, linger=0)
+        try:
+            BLEConnection("A", manager=manager).close()
+            (client,) = self.backend.clients
+            wait(lambda: not client.is_connected)
+            BLEConnection("A", manager=manager).close()
+            self.assertEqual(len(self.backend.clients), 2)
+        finally:
+            manager.close()
+
+    def test_disconnect(self):
+        conn = BLEConnection("A", timeout=0.1, manager=self.manager)
+        self.backend.clients[0].drop()
+        with self.assertRaises(connection.ConnectionError):
+            conn.recv()
+        with self.assertRaises(connection.ConnectionError):
+            conn.send(b"?")
+        conn.close()
+        conn = BLEConnection("A", manager=self.manager)
+        self.assertEqual(len(self.backend.clients), 2)
+        conn.close()
+
+    def test_connect_error(self):
+        with self.assertRaises(connection.ConnectionError):
+            BLEConnection("unknown", manager=self.manager)
+
+
+class AsyncBLEConnectionTest(unittest.TestCase):
+    def test_connect_timeout(self):
+        backend = FakeBackend()
+        connect = backend.BleakClient.connect
+
+        async def slow_connect(client):
+            await asyncio.sleep(0.05)
+            await connect(client)
+
+        async def main(**kwargs):
+            conn = AsyncBLEConnection("A", timeout=0.01, **kwargs)
+            await conn.open()
+            await conn.close()
+
+        with mock.patch.dict("sys.modules", bleak=backend):
+            with mock.patch.object(backend.BleakClient, "connect", slow_connect):
+                asyncio.run(main())
+                with self.assertRaises(connection.TimeoutError):
+                    asyncio.run(main(connect_timeout=0.01))
+
+
+class FrameBufferTest(unittest.TestCase):
+    def frames(self, frames):
+        result = []
+        frame = frames.next()
+        while frame is not None:
+            tag, message = frame
+            result.append((tag, bytes(message)))
+            frame = frames.next()
+        return result
+
+    def test_frames(self):
+        frames = _FrameBuffer()
+        for cmd in (b"0", b"?", b"J", b"X"):
+            frames.tag(cmd)
+        frames.feed(b"5337")
+        self.assertIsNone(frames.next())
+        frames.feed(b"0$:1")
+        frames.feed(b"23$")
+        self.assertEqual(self.frames(frames), [(b"0", b"053370"), (b"?", b"?:123")])
+        frames.feed(b"J")
+        frames.feed(b"#")
+        self.assertEqual(self.frames(frames), [(b"J", b"J"), (b"X", b"")])
+        # frames without a pending request are not tagged
+        frames.feed(b"1234$")
+        self.assertEqual(self.frames(frames), [(b"", b"1234")])
+
+    def test_echo(self):
+        frames = _FrameBuffer()
+        for cmd in (b"J", b"?", b"T", b"0"):
+            frames.tag(cmd)
+        frames.feed(b"J")
+        frames.feed(b"1234")
+        frames.feed(b"5$T")
+        self.assertEqual(self.frames(frames), [(b"J", b"J"), (b"?", b"?12345")])
+        # not at a frame boundary
+        self.assertEqual(self.frames(frames), [])
+        frames.feed(b"$")
+        self.assertEqual(self.frames(frames), [(b"T", b"TT")])
+        frames.feed(b"T")
+        self.assertEqual(self.frames(frames), [])
+        frames.feed(b"53370$")
+        self.assertEqual(self.frames(frames), [(b"0", b"0T53370")])
+
+    def test_coalesced_echo(self):
+        frames = _FrameBuffer()
+        for cmd in (b"J", b"J", b"J", b"?"):
+            frames.tag(cmd)
+        frames.feed(b"JJ")
+        self.assertEqual(self.frames(frames), [(b"J", b"J"), (b"J", b"J")])
+        frames.feed(b"J:>>>>>>0006008<$")
+        self.assertEqual(
+            self.frames(frames), [(b"J", b"J"), (b"?", b"?:>>>>>>0006008<")]
+        )
+        for cmd in (b"T", b"J", b"0"):
+            frames.tag(cmd)
+        frames.feed(b"TJ5337")
+        frames.feed(b"0$")
+        self.assertEqual(
+            self.frames(frames), [(b"T", b"T"), (b"J", b"J"), (b"0", b"053370")]
+        )
+
+    def test_untag(self):
+        frames = _FrameBuffer()
+        frames.tag(b"0")
+        frames.untag()
+        frames.tag(b"?")
+        frames.feed(b"1$")
+        self.assertEqual(self.frames(frames), [(b"?", b"?1")])
+
+    def test_wraparound(self):
+        frames = _FrameBuffer(16)
+        for n in range(20):
+            frames.tag(b"?")
+            frames.feed(b"%03d$" % n)
+            frames.feed(b"12")
+            self.assertEqual(frames.next(), (b"?", b"?%03d" % n))
+            frames.tag(b"0")
+            frames.feed(b"3$")
+            self.assertEqual(frames.next(), (b"0", b"0123"))
+
+    def test_overflow(self):
+        frames = _FrameBuffer(16)
+        frames.feed(b"0123456789")
+        with self.assertRaises(connection.BufferTooShort):
+            frames.feed(b"0123456789")
+        frames.clear()
+        frames.feed(b"0123456789$")
+        self.assertEqual(self.frames(frames), [(b"", b"0123456789")])
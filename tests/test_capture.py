@@ -0,0 +1,67 @@
+import io
+import unittest
+
+from carreralib import ControlUnit
+from carreralib.capture import (
+    CaptureReader,
+    CaptureWriter,
+    RECEIVED,
+    RecordingConnection,
+    ReplayConnection,
+    SENT,
+)
+from carreralib.connection import TimeoutError
+from carreralib.sim import SimulatorConnection
+
+
+def record(nrequests, index=None):
+    capture = io.BytesIO()
+    sim = SimulatorConnection("sim://?seed=1")
+    writer = CaptureWriter(capture, index, index_interval=16)
+    cu = ControlUnit(RecordingConnection(sim, writer))
+    cu.start()
+    cu.start()
+    results = [cu.poll() for _ in range(nrequests)]
+    writer.close()
+    capture.seek(0)
+    return capture, results
+
+
+class CaptureTest(unittest.TestCase):
+    def test_records(self):
+        capture, _ = record(10)
+        records = list(CaptureReader(capture))
+        self.assertEqual(len(records), 24)
+        self.assertEqual(records[0].direction, SENT)
+        self.assertEqual(records[0].data, b"T22")
+        self.assertEqual(records[1].direction, RECEIVED)
+        self.assertEqual(records[1].data, b"T")
+        timestamps = [r.timestamp for r in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_truncated(self):
+        capture, _ = record(10)
+        data = capture.getvalue()
+        reader = CaptureReader(io.BytesIO(data[:-3]))
+        self.assertEqual(len(list(reader)), 23)
+
+    def test_seek(self):
+        index = io.BytesIO()
+        capture, _ = record(100, index)
+        index.seek(0)
+        records = list(CaptureReader(capture))
+        capture.seek(0)
+        reader = CaptureReader(capture, index)
+        reader.seek(records[150].timestamp)
+        record150 = next(reader)
+        self.assertEqual(record150.timestamp, records[150].timestamp)
+        self.assertLessEqual(records.index(record150), 150)
+
+    def test_replay(self):
+        capture, results = record(100)
+        cu = ControlUnit(ReplayConnection(capture, speed=0))
+        cu.start()
+        cu.start()
+        self.assertEqual([cu.poll() for _ in range(100)], results)
+        with self.assertRaises(TimeoutError):
+            cu.poll()
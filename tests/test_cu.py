@@ -0,0 +1,148 @@
+import asyncio
+import unittest
+
+from carreralib import AsyncControlUnit, ControlUnit, connection
+from carreralib.connection import AsyncConnection, Connection
+
+RESPONSES = {
+    b"0": b"053372",
+    b"?": b"?:>>>>>>0006008<",
+    b"J": b"J",
+    b"T": b"T",
+}
+
+
+class FakeConnection(Connection):
+    def __init__(self, responses=None):
+        self.responses = list(responses or [])
+        self.sent = []
+        self.received = 0
+        self.maxinflight = 0
+
+    def recv(self, maxlength=None):
+        self.received += 1
+        if self.responses:
+            return self.responses.pop(0)
+        return RESPONSES[self.sent[-1][0:1]]
+
+    def send(self, buf, offset=0, size=None):
+        self.sent.append(bytes(buf))
+        inflight = len(self.sent) - self.received
+        self.maxinflight = max(self.maxinflight, inflight)
+
+
+class FakeAsyncConnection(AsyncConnection):
+    def __init__(self, responses=None):
+        self.__conn = FakeConnection(responses)
+        self.sent = self.__conn.sent
+
+    async def recv(self, maxlength=None):
+        await asyncio.sleep(0)
+        return self.__conn.recv(maxlength)
+
+    async def send(self, buf, offset=0, size=None):
+        self.__conn.send(buf, offset, size)
+
+
+class ControlUnitTest(unittest.TestCase):
+    def test_version(self):
+        cu = ControlUnit(FakeConnection())
+        self.assertEqual(cu.version(), "5337")
+
+    def test_poll(self):
+        cu = ControlUnit(FakeConnection([b"?2003037?>1="]))
+        self.assertEqual(cu.poll(), ControlUnit.Timer(1, 226287, 1))
+        status = cu.poll()
+        self.assertIsInstance(status, ControlUnit.Status)
+        self.assertEqual(status.fuel, (14,) * 6 + (0, 0))
+
+    def test_setword(self):
+        conn = FakeConnection()
+        cu = ControlUnit(conn)
+        cu.setspeed(5, 4)
+        self.assertEqual(conn.sent, [b"J0:420"])
+        with self.assertRaises(ValueError):
+            cu.setspeed(8, 4)
+
+    def test_pipeline(self):
+        conn = FakeConnection()
+        cu = ControlUnit(conn)
+        with cu.pipeline(window=4):
+            for address in range(8):
+                cu.setspeed(address, 4)
+        self.assertEqual(len(conn.sent), 8)
+        self.assertEqual(conn.received, 8)
+        self.assertEqual(conn.maxinflight, 4)
+        self.assertEqual(cu.window, 1)
+
+    def test_submit(self):
+        conn = FakeConnection([b"J", b"?2003037?>1=", b"0"])
+        cu = ControlUnit(conn)
+        cu.window = 3
+        futures = [cu.submit(b"0"), cu.submit(b"J"), cu.submit(b"?")]
+        self.assertFalse(any(f.done() for f in futures))
+        cu.flush()
+        results = [f.result() for f in futures]
+        self.assertEqual(results, [b"0", b"J", b"?2003037?>1="])
+
+    def test_submit_poll(self):
+        cu = ControlUnit(FakeConnection([b"?2003037?>1="]))
+        cu.window = 2
+        futures = [cu.submit_poll(), cu.submit_poll()]
+        self.assertFalse(any(f.done() for f in futures))
+        cu.flush()
+        self.assertEqual(futures[0].result(), ControlUnit.Timer(1, 226287, 1))
+        self.assertIsInstance(futures[1].result(), ControlUnit.Status)
+
+    def test_submit_close(self):
+        cu = ControlUnit(FakeConnection())
+        cu.window = 2
+        futures = [cu.submit(b"0"), cu.submit_poll()]
+        cu.close()
+        for future in futures:
+            self.assertTrue(future.done())
+            with self.assertRaises(connection.ConnectionError):
+                future.result(timeout=0)
+
+    def test_fileno(self):
+        cu = ControlUnit(FakeConnection())
+        self.assertIsNone(cu.fileno())
+
+    def test_setwords(self):
+        conn = FakeConnection()
+        cu = ControlUnit(conn)
+        words = [(0, 5, 4, 2), (1, 5, 3, 2), (6, 5, 1)]
+        self.assertEqual(cu.setwords(words), [b"J", b"J", b"J"])
+        self.assertEqual(conn.sent, [b"J0:420", b"J1:320", b"J6:112"])
+        self.assertEqual(conn.maxinflight, 3)
+        with self.assertRaises(ValueError):
+            cu.setwords([(0, 5, 4, 2), (0, 8, 4, 2)])
+        self.assertEqual(len(conn.sent), 3)
+
+
+class AsyncControlUnitTest(unittest.TestCase):
+    def test_version(self):
+        cu = AsyncControlUnit(FakeAsyncConnection())
+        self.assertEqual(asyncio.run(cu.version()), "5337")
+
+    def test_poll(self):
+        cu = AsyncControlUnit(FakeAsyncConnection([b"?2003037?>1="]))
+
+        async def poll():
+            return [await cu.poll(), await cu.poll()]
+
+        timer, status = asyncio.run(poll())
+        self.assertEqual(timer, ControlUnit.Timer(1, 226287, 1))
+        self.assertIsInstance(status, ControlUnit.Status)
+
+    def test_concurrent_requests(self):
+        conn = FakeAsyncConnection()
+        cu = AsyncControlUnit(conn)
+
+        async def run():
+            return await asyncio.gather(
+                cu.version(), cu.setspeed(5, 4), cu.press(2), cu.version()
+            )
+
+        self.assertEqual(asyncio.run(run()), ["5337", None, b"T", "5337"])
+        self.assertEqual(conn.sent, [b"0", b"J0:420", b"T22", b"0"])
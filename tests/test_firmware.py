@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from carreralib import ControlUnit, connection, firmware
+from carreralib.sim import SimulatorConnection
+
+LINES = [b"0123456789ABCDEF0123456789ABCDEF", b"FEDCBA9876543210", b"00FF"]
+
+
+class FailingConnection(SimulatorConnection):
+    def __init__(self, url, nframes):
+        SimulatorConnection.__init__(self, url)
+        self.nframes = nframes
+
+    def send(self, buf, offset=0, size=None):
+        if buf[0:1] == b"E":
+            if self.nframes == 0:
+                raise connection.ConnectionError("Connection lost")
+            self.nframes -= 1
+        SimulatorConnection.send(self, buf, offset, size)
+
+
+class FirmwareTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            for line in LINES:
+                f.write(b'"%s"\r\n\r\n' % line)
+        self.checkpoint = self.path + ".ckpt"
+
+    def tearDown(self):
+        os.remove(self.path)
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def test_readlines(self):
+        lines = list(firmware.readlines(self.path))
+        self.assertEqual([data for _, data in lines], LINES)
+        self.assertEqual(lines[-1][0], os.path.getsize(self.path) - 2)
+        self.assertEqual(list(firmware.readlines(self.path, 2)), lines[2:])
+
+    def test_image(self):
+        image = firmware.FirmwareImage.load(self.path, 18)
+        self.assertEqual(len(image), 3)
+        self.assertEqual(image.size, os.path.getsize(self.path))
+        self.assertEqual([len(image.frames(n)) for n in range(3)], [3, 2, 2])
+        self.assertEqual(image.frames(2), [b"F\x04" + LINES[2], b"E0"])
+        copy = firmware.FirmwareImage.frombytes(image.tobytes())
+        self.assertEqual(copy.digest, image.digest)
+        self.assertEqual(copy.block_size, 18)
+        for n in range(3):
+            self.assertEqual(copy.frames(n), image.frames(n))
+        self.assertEqual(copy.offset(2), image.offset(2))
+        with self.assertRaises(ValueError):
+            firmware.FirmwareImage.frombytes(image.tobytes()[:-1])
+
+    def test_invalid(self):
+        with open(self.path, "ab") as f:
+            f.write(b"0123$567\n")
+        conn = SimulatorConnection()
+        with self.assertRaises(firmware.FirmwareError) as cm:
+            firmware.upload(ControlUnit(conn), self.path)
+        self.assertIn("line 4", str(cm.exception))
+        self.assertEqual(conn.time, 0)
+        with open(self.path, "wb") as f:
+            f.write(b"\r\n")
+        with self.assertRaises(firmware.FirmwareError):
+            firmware.FirmwareImage.load(self.path)
+
+    def test_cache(self):
+        cache = tempfile.mkdtemp()
+        try:
+            image = firmware.FirmwareImage.load(self.path, cache=cache)
+            self.assertEqual(len(os.listdir(cache)), 1)
+            with mock.patch.object(firmware.FirmwareImage, "parse") as parse:
+                cached = firmware.FirmwareImage.load(self.path, cache=cache)
+                parse.assert_not_called()
+            self.assertEqual(cached.frames(0), image.frames(0))
+            firmware.FirmwareImage.load(self.path, 18, cache=cache)
+            self.assertEqual(len(os.listdir(cache)), 2)
+            # corrupt or truncated cache files are replaced
+            data = image.tobytes()
+            path = os.path.join(cache, "%s-0.bin" % image.digest)
+            for size in (len(firmware.CACHE_MAGIC) + 2, len(data) - 5):
+                with open(path, "wb") as f:
+                    f.write(data[:size])
+                with self.assertRaises(ValueError):
+                    firmware.FirmwareImage.frombytes(data[:size])
+                cached = firmware.FirmwareImage.load(self.path, cache=cache)
+                self.assertEqual(cached.frames(0), image.frames(0))
+        finally:
+            shutil.rmtree(cache)
+
+    def test_block_size(self):
+        image = firmware.FirmwareImage.load(self.path)
+        cu = ControlUnit(SimulatorConnection("sim://?blocksize=18"))
+        with self.assertRaises(ValueError):
+            firmware.upload(cu, image)
+
+    def test_upload(self):
+        for url in ("sim://", "sim://?blocksize=18"):
+            conn = SimulatorConnection(url)
+            cu = ControlUnit(conn)
+            reports = []
+            result = firmware.upload(cu, self.path, window=4, progress=reports.append)
+            self.assertEqual(conn.firmware, b"".join(LINES))
+            self.assertEqual([p.lines for p in reports], [1, 2, 3])
+            self.assertEqual(result.lines, 3)
+            self.assertEqual(result.bytes, result.total)
+            self.assertGreater(result.rate, 0)
+            self.assertEqual(cu.window, 1)
+
+    def test_resume(self):
+        conn = FailingConnection("sim://?blocksize=18", nframes=1)
+        cu = ControlUnit(conn)
+        with self.assertRaises(connection.ConnectionError):
+            firmware.upload(cu, self.path, window=1, checkpoint=self.checkpoint)
+        # second line's block was sent before failing
+        self.assertEqual(conn.firmware, LINES[0] + LINES[1])
+        conn.nframes = -1
+        result = firmware.upload(cu, self.path, checkpoint=self.checkpoint)
+        self.assertEqual(result.lines, 3)
+        self.assertEqual(result.resumed, next(firmware.readlines(self.path))[0])
+        self.assertFalse(os.path.exists(self.checkpoint))
+        # throughput only accounts for bytes written after resuming
+        self.assertEqual(firmware.Progress(3, 100, 100, 2.0, 60).rate, 20.0)
+        self.assertEqual(firmware.Progress(3, 100, 100, 2.0).rate, 50.0)
+        self.assertEqual(conn.firmware, LINES[0] + LINES[1] + b"".join(LINES[1:]))
+
+    def test_update_many(self):
+        devices = ["sim://", "sim://?blocksize=18", "/nonexistent/ttyUSB0"]
+        checkpoints = tempfile.mkdtemp()
+        reports = []
+        try:
+            results = firmware.update_many(
+                devices,
+                self.path,
+                jobs=2,
+                progress=lambda d, p: reports.append((d, p.lines)),
+                checkpoints=checkpoints,
+            )
+            self.assertEqual(os.listdir(checkpoints), [])
+        finally:
+            shutil.rmtree(checkpoints)
+        self.assertEqual([r.device for r in results], devices)
+        self.assertEqual([r.ok for r in results], [True, True, False])
+        self.assertEqual(results[0].progress.lines, 3)
+        self.assertEqual(results[1].progress.bytes, os.path.getsize(self.path))
+        self.assertIsNone(results[2].progress)
+        self.assertIsInstance(results[2].error, Exception)
+        for device in devices[:2]:
+            self.assertEqual([n for d, n in reports if d == device], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            firmware.update_many(devices, self.path, jobs=0)
+
+    def test_update_many_ble(self):
+        devices = ["sim://?version=5337", "sim://?version=5336", "sim://"]
+        started = threading.Event()
+        waited = []
+
+        def report(device, p):
+            if device == devices[2]:
+                started.set()
+            elif device == devices[0]:
+                # queued BLE devices must not hold up the serial device
+                waited.append(started.wait(1.0))
+
+        with mock.patch.object(firmware.connection, "isble", lambda d: "?" in d):
+            results = firmware.update_many(devices, self.path, jobs=2, progress=report)
+        self.assertEqual([r.ok for r in results], [True, True, True])
+        self.assertTrue(waited and all(waited))
+
+    def test_update_many_invalid(self):
+        with open(self.path, "ab") as f:
+            f.write(b"0123$567\n")
+        with self.assertRaises(firmware.FirmwareError):
+            firmware.update_many(["sim://"], self.path)
@@ -0,0 +1,112 @@
+import json
+import unittest
+
+from carreralib import ControlUnit, connection
+from carreralib.metrics import Histogram, Metrics
+
+from .test_cu import FakeConnection
+
+
+class HistogramTest(unittest.TestCase):
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(h.count, 0)
+        self.assertIsNone(h.percentile(50))
+
+    def test_percentile(self):
+        h = Histogram(buckets=(1.0, 2.0, 3.0))
+        for value in (0.5, 1.5, 1.5, 2.5):
+            h.observe(value)
+        self.assertEqual(h.counts, [1, 2, 1, 0])
+        self.assertEqual(h.count, 4)
+        self.assertEqual(h.sum, 6.0)
+        self.assertEqual(h.min, 0.5)
+        self.assertEqual(h.max, 2.5)
+        self.assertEqual(h.percentile(0), 0.5)
+        self.assertEqual(h.percentile(50), 1.5)
+        self.assertEqual(h.percentile(100), 2.5)
+
+    def test_overflow(self):
+        h = Histogram(buckets=(1.0,))
+        h.observe(5.0)
+        self.assertEqual(h.counts, [0, 1])
+        self.assertEqual(h.percentile(99), 5.0)
+
+
+class MetricsTest(unittest.TestCase):
+    def test_requests(self):
+        cu = ControlUnit(FakeConnection())
+        cu.metrics = Metrics()
+        cu.version()
+        cu.poll()
+        counters = cu.metrics.counters
+        self.assertEqual(counters["requests"], 2)
+        self.assertEqual(counters["polls"], 1)
+        self.assertEqual(counters["frames_sent"], 2)
+        self.assertEqual(counters["frames_received"], 2)
+        self.assertEqual(counters["bytes_sent"], 2)
+        self.assertEqual(set(cu.metrics.rtt), {b"0", b"?"})
+        self.assertEqual(cu.metrics.rtt[b"?"].count, 1)
+
+    def test_unexpected(self):
+        cu = ControlUnit(FakeConnection([b"?2003037?>1="]))
+        cu.metrics = Metrics()
+        cu.version()
+        self.assertEqual(cu.metrics.counters["unexpected_messages"], 1)
+        self.assertEqual(cu.metrics.counters["frames_received"], 2)
+
+    def test_timeout(self):
+        class TimeoutConnection(FakeConnection):
+            def recv(self, maxlength=None):
+                raise connection.TimeoutError("timeout")
+
+        cu = ControlUnit(TimeoutConnection())
+        cu.metrics = Metrics()
+        with self.assertRaises(connection.TimeoutError):
+            cu.version()
+        self.assertEqual(cu.metrics.counters["timeouts"], 1)
+        self.assertEqual(cu.metrics.rtt, {})
+
+    def test_pipeline(self):
+        cu = ControlUnit(FakeConnection())
+        cu.metrics = Metrics()
+        with cu.pipeline():
+            cu.setspeed(0, 8)
+            cu.setbrake(0, 8)
+        self.assertEqual(cu.metrics.counters["requests"], 2)
+        self.assertEqual(cu.metrics.rtt[b"J"].count, 2)
+
+    def test_reset(self):
+        clock = iter([0.0, 2.0, 2.0]).__next__
+        metrics = Metrics(clock=clock)
+        metrics.inc("polls", 10)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["elapsed"], 2.0)
+        self.assertEqual(snapshot["rates"]["polls"], 5.0)
+        metrics.reset()
+        self.assertEqual(metrics.counters["polls"], 0)
+
+    def test_json(self):
+        metrics = Metrics()
+        metrics.observe_rtt(b"?", 0.003)
+        data = json.loads(metrics.to_json())
+        self.assertEqual(data["rtt"]["?"]["count"], 1)
+        self.assertEqual(data["rtt"]["?"]["buckets"]["+Inf"], 0)
+        self.assertEqual(data["rtt"]["?"]["buckets"]["0.005"], 1)
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.inc("timeouts")
+        metrics.observe_rtt(b"?", 0.003)
+        text = metrics.to_prometheus(labels={"unit": "cu1"})
+        lines = text.splitlines()
+        self.assertIn('carreralib_timeouts_total{unit="cu1"} 1', lines)
+        self.assertIn(
+            'carreralib_rtt_seconds_bucket{unit="cu1",command="?",le="0.005"} 1',
+            lines,
+        )
+        self.assertIn(
+            'carreralib_rtt_seconds_bucket{unit="cu1",command="?",le="+Inf"} 1',
+            lines,
+        )
+        self.assertIn('carreralib_rtt_seconds_count{unit="cu1",command="?"} 1', lines)
@@ -0,0 +1,44 @@
+import queue
+import unittest
+
+from carreralib import ControlUnit
+from carreralib.connection import TimeoutError
+
+from .test_cu import FakeConnection, RESPONSES
+
+TIMER1 = b"?2003037?>1="
+TIMER2 = b"?20030:9211<"
+
+
+class PollerTest(unittest.TestCase):
+    def test_events(self):
+        responses = [TIMER1, TIMER1, RESPONSES[b"?"], TIMER2, RESPONSES[b"?"]]
+        cu = ControlUnit(FakeConnection(responses))
+        with cu.events(rate=1000) as events:
+            self.assertEqual(events.get(1.0), ControlUnit.Timer(1, 226287, 1))
+            self.assertIsInstance(events.get(1.0), ControlUnit.Status)
+            self.assertEqual(events.get(1.0), ControlUnit.Timer(1, 236050, 1))
+            # repeated status responses are not reported
+            with self.assertRaises(queue.Empty):
+                events.get(0.1)
+        self.assertIsNone(events.get())
+
+    def test_backpressure(self):
+        conn = FakeConnection([TIMER1, TIMER2, b"?200301<?618"])
+        cu = ControlUnit(conn)
+        events = cu.events(rate=1000, maxsize=1)
+        self.assertEqual(events.get(1.0).timestamp, 226287)
+        self.assertEqual(events.get(1.0).timestamp, 236050)
+        self.assertEqual(events.get(1.0).timestamp, 246127)
+        events.close()
+
+    def test_error(self):
+        class TimeoutConnection(FakeConnection):
+            def recv(self, maxlength=None):
+                raise TimeoutError("Timeout waiting for data")
+
+        cu = ControlUnit(TimeoutConnection())
+        events = cu.events()
+        with self.assertRaises(TimeoutError):
+            list(events)
+        self.assertIsNone(events.get())
@@ -1,8 +1,30 @@
 from __future__ import unicode_literals
 
+import random
 import unittest
 
-from carreralib.protocol import chksum, pack, unpack
+from carreralib.protocol import Checksum, ProtocolError, Struct, chksum, pack, unpack
+
+# reference implementations for nibble-encoded values
+
+
+def ref_pack_B(value):
+    return bytes([0x30 + (value & 0xF), 0x30 + (value >> 4)])
+
+
+def ref_pack_I(value):
+    return bytes(0x30 + ((value >> n) & 0xF) for n in (24, 28, 16, 20, 8, 12, 0, 4))
+
+
+def ref_unpack_B(buf):
+    return (buf[0] & 0xF) | (buf[1] & 0xF) << 4
+
+
+def ref_unpack_I(buf):
+    n = 0
+    for b, shift in zip(buf, (24, 28, 16, 20, 8, 12, 0, 4)):
+        n |= (b & 0xF) << shift
+    return n
 
 
 class ProtocolTest(unittest.TestCase):
@@ -21,6 +43,22 @@ class ProtocolTest(unittest.TestCase):
             ([b"6091"], 0),
         ):
             self.assertEqual(chksum(*args), res)
+            self.assertEqual(Checksum(*args).digest(), res)
+        self.assertEqual(chksum(bytearray(b":5321:"), 1, 4), 0xB)
+        self.assertEqual(chksum(memoryview(b":5321:")[1:], 0, 4), 0xB)
+        for args in ([b"", -1], [b"", 1], [b"0", 0, -1], [b"0", 0, 2]):
+            with self.assertRaises(ValueError):
+                chksum(*args)
+
+    def test_checksum(self):
+        c = Checksum()
+        self.assertEqual(c.digest(), 0)
+        c.update(b":53", 1)
+        c.update_byte(ord("2"))
+        c.update(memoryview(b"1:"), 0, 1)
+        self.assertEqual(c.digest(), 0xB)
+        c.reset()
+        self.assertEqual(c.digest(), 0)
 
     def test_pack(self):
         for fmt, args, res in (
@@ -42,3 +80,61 @@ class ProtocolTest(unittest.TestCase):
             ("rr3r", b"\0\1\xff\xff\xff", (0, 1, 255, 255, 255)),
         ):
             self.assertEqual(unpack(fmt, buf), res)
+            self.assertEqual(unpack(fmt, bytearray(buf)), res)
+            self.assertEqual(unpack(fmt, memoryview(buf)), res)
+
+    def test_struct(self):
+        for fmt, args, buf in (
+            ("cBYYC", [b"J", 6, 9, 1], b"J60910"),
+            ("cYIYC", [b"?", 2, 226287, 1], b"?2003037?>1="),
+            ("c4sC", [b"0", b"5321"], b"05321;"),
+            ("rr3r", [0, 1, 255, 255, 255], b"\0\1\xff\xff\xff"),
+        ):
+            s = Struct(fmt)
+            self.assertEqual(s.format, fmt)
+            self.assertEqual(s.size, len(buf))
+            self.assertEqual(s.pack(*args), buf)
+            self.assertEqual(s.unpack(buf), tuple(args))
+        with self.assertRaises(ValueError):
+            Struct("cZC")
+
+    def test_unpack_short(self):
+        with self.assertRaises(ProtocolError):
+            unpack("cYIYC", b"?2003037?>1")
+
+    def test_nibbles_B(self):
+        for value in range(256):
+            buf = ref_pack_B(value)
+            self.assertEqual(pack("B", value), buf)
+            self.assertEqual(unpack("B", buf), (value,))
+        for lo in range(256):
+            for hi in range(256):
+                buf = bytes([lo, hi])
+                self.assertEqual(unpack("B", buf), (ref_unpack_B(buf),))
+        self.assertEqual(unpack("3B", b"0010?>"), (0, 1, 0xEF))
+        with self.assertRaises(ValueError):
+            pack("B", 256)
+
+    def test_nibbles_I(self):
+        values = [0, 1, 0xF, 0x10, 0xFFFFFFFE, 0xFFFFFFFF]
+        values.extend(n << shift for n in range(16) for shift in range(0, 32, 4))
+        rng = random.Random(42)
+        values.extend(rng.getrandbits(32) for _ in range(10000))
+        for value in values:
+            buf = ref_pack_I(value)
+            self.assertEqual(pack("I", value), buf)
+            self.assertEqual(unpack("I", buf), (value,))
+        for _ in range(10000):
+            buf = bytes(rng.getrandbits(8) for _ in range(8))
+            self.assertEqual(unpack("I", buf), (ref_unpack_I(buf),))
+        self.assertEqual(unpack("2I", ref_pack_I(1) + ref_pack_I(2)), (1, 2))
+        with self.assertRaises(ValueError):
+            pack("I", 0x100000000)
+
+    def test_nibbles_Y(self):
+        for value in range(16):
+            self.assertEqual(pack("Y", value), bytes([0x30 + value]))
+        for b in range(256):
+            self.assertEqual(unpack("Y", bytes([b])), (b & 0xF,))
+        self.assertEqual(unpack("Y", bytearray(b"?")), (15,))
+        self.assertEqual(unpack("Y", memoryview(b"?")), (15,))
@@ -0,0 +1,114 @@
+import unittest
+
+from carreralib import ControlUnit, connection, protocol
+from carreralib.metrics import Metrics
+from carreralib.reconnect import ReconnectingConnection
+
+from .test_cu import RESPONSES
+
+
+class ScriptedConnection(connection.Connection):
+    def __init__(self, script):
+        self.script = script
+        self.sent = []
+        self.discarded = 0
+
+    def discard(self):
+        self.discarded += 1
+
+    def recv(self, maxlength=None):
+        if self.script:
+            item = self.script.pop(0)
+            if isinstance(item, Exception):
+                raise item
+            return item
+        cmd = self.sent[-1][0:1]
+        return RESPONSES.get(cmd, cmd)
+
+    def send(self, buf, offset=0, size=None):
+        self.sent.append(bytes(buf))
+
+
+class Factory(object):
+    def __init__(self, *scripts):
+        self.scripts = list(scripts)
+        self.connections = []
+
+    def __call__(self):
+        script = self.scripts.pop(0)
+        if isinstance(script, Exception):
+            raise script
+        conn = ScriptedConnection(script)
+        self.connections.append(conn)
+        return conn
+
+
+def timer(timestamp):
+    return protocol.pack("cYIYC", b"?", 1, timestamp, 1)
+
+
+class ReconnectingConnectionTest(unittest.TestCase):
+    def test_reconnect(self):
+        error = connection.ConnectionError("Connection lost")
+        script = [b"J", b":", b"J", error]
+        factory = Factory(script, connection.TimeoutError("Timeout"), [])
+        metrics = Metrics()
+        cu = ControlUnit(ReconnectingConnection(factory, retry=0, metrics=metrics))
+        cu.setspeed(0, 8)
+        cu.ignore(4)
+        cu.setpos(0, 1)
+        self.assertEqual(cu.version(), "5337")
+        first, second = factory.connections
+        # speed and ignore mask restored, position not
+        self.assertEqual(second.sent, first.sent[:2] + [b"0"])
+        self.assertEqual(metrics.counters["retries"], 2)
+
+    def test_timeout(self):
+        factory = Factory([connection.TimeoutError("Timeout")])
+        cu = ControlUnit(ReconnectingConnection(factory, retry=0))
+        self.assertEqual(cu.version(), "5337")
+        (conn,) = factory.connections
+        self.assertEqual(conn.sent, [b"0", b"0"])
+        self.assertEqual(conn.discarded, 1)
+
+    def test_idempotent(self):
+        error = connection.ConnectionError("Connection lost")
+        factory = Factory([error], [])
+        cu = ControlUnit(ReconnectingConnection(factory, retry=0))
+        with self.assertRaises(connection.ConnectionError):
+            cu.start()
+        self.assertEqual(factory.connections[1].sent, [])
+        self.assertEqual(cu.version(), "5337")
+
+    def test_attempts(self):
+        error = connection.ConnectionError("Cannot connect")
+        factory = Factory([connection.ConnectionError("Connection lost")], error)
+        conn = ReconnectingConnection(factory, retry=0, attempts=1)
+        conn.send(b"0")
+        with self.assertRaises(connection.ConnectionError) as cm:
+            conn.recv()
+        self.assertIs(cm.exception, error)
+
+    def test_timer_discontinuity(self):
+        error = connection.ConnectionError("Connection lost")
+        script = [timer(500), timer(1500), b"=", timer(200)]
+        factory = Factory([timer(100000), error], script)
+        cu = ControlUnit(ReconnectingConnection(factory, retry=0))
+        self.assertEqual(cu.poll().timestamp, 100000)
+        t1 = cu.poll().timestamp
+        t2 = cu.poll().timestamp
+        self.assertGreaterEqual(t1, 100000)
+        self.assertLess(t1, 101000)
+        self.assertEqual(t2 - t1, 1000)
+        # CU timer reset on purpose
+        cu.reset()
+        self.assertEqual(cu.poll().timestamp, 200)
+
+    def test_simulator(self):
+        conn = ReconnectingConnection("sim://", retry=0)
+        self.assertIsInstance(conn.fileno(), type(None))
+        cu = ControlUnit(conn)
+        cu.setbrake(1, 5)
+        self.assertEqual(cu.version(), "5337")
+        self.assertIsNone(conn.max_fwu_block_size)
+        cu.close()
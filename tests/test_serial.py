@@ -0,0 +1,176 @@
+import asyncio
+import os
+import selectors
+import unittest
+
+from carreralib.connection import BufferTooShort, TimeoutError
+from carreralib.protocol import chksum
+from carreralib.serial import AsyncSerialConnection, SerialConnection, _FrameReader
+
+
+class SerialConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = SerialConnection("loop://", timeout=0.1)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_recv(self):
+        self.conn.send(b"?2003037?>1=")
+        self.conn.send(b"J")
+        self.assertEqual(self.conn.recv(), b'"?2003037?>1=')
+        self.assertEqual(self.conn.recv(), b'"J')
+        with self.assertRaises(TimeoutError):
+            self.conn.recv()
+
+    def test_recv_into(self):
+        buf = bytearray(8)
+        self.conn.send(b"053372")
+        self.assertEqual(self.conn.recv_into(buf, 1), 7)
+        self.assertEqual(buf, b'\0"053372')
+        self.conn.send(b"053372")
+        with self.assertRaises(BufferTooShort):
+            self.conn.recv_into(buf, 2)
+        self.conn.send(b"J")
+        self.assertEqual(self.conn.recv_into(buf), 2)
+        self.assertEqual(buf[:2], b'"J')
+
+    def test_fileno(self):
+        self.assertIsNone(self.conn.fileno())
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "requires pty")
+    def test_select(self):
+        master, slave = os.openpty()
+        conn = SerialConnection(os.ttyname(slave), timeout=0.1)
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(conn.fileno(), selectors.EVENT_READ)
+                self.assertEqual(selector.select(0), [])
+                os.write(master, b"053372$")
+                self.assertEqual(len(selector.select(1.0)), 1)
+                self.assertEqual(conn.recv(), b"053372")
+        finally:
+            conn.close()
+            os.close(master)
+            os.close(slave)
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "requires pty")
+    def test_overflow(self):
+        master, slave = os.openpty()
+        conn = SerialConnection(os.ttyname(slave), timeout=0.1)
+        try:
+            os.write(master, b"0123456789")
+            with self.assertRaises(TimeoutError):
+                conn.recv(4)
+            os.write(master, b"0123456789$J$")
+            with self.assertRaises(BufferTooShort):
+                conn.recv(4)
+            self.assertEqual(conn.recv(4), b"J")
+            buf = bytearray(4)
+            os.write(master, b"01234")
+            with self.assertRaises(TimeoutError):
+                conn.recv_into(buf)
+            os.write(master, b"56789$T$")
+            with self.assertRaises(BufferTooShort):
+                conn.recv_into(buf)
+            self.assertEqual(conn.recv_into(buf), 1)
+            self.assertEqual(buf[:1], b"T")
+        finally:
+            conn.close()
+            os.close(master)
+            os.close(slave)
+
+    def test_send_many(self):
+        self.conn.send_many([b"J0:420", b"J1:320"])
+        self.assertEqual(self.conn.recv(), b'"J0:420')
+        self.assertEqual(self.conn.recv(), b'"J1:320')
+
+    def test_cork(self):
+        self.conn.cork()
+        self.conn.send(b"J0:420")
+        self.conn.cork()
+        self.conn.send(memoryview(b"xJ1:320x")[1:-1])
+        self.conn.uncork()
+        self.conn.send(b"?", 0, 1)
+        self.conn.uncork()
+        self.assertEqual(self.conn.recv(), b'"J0:420')
+        self.assertEqual(self.conn.recv(), b'"J1:320')
+        self.assertEqual(self.conn.recv(), b'"?')
+
+    def test_cork_recv(self):
+        self.conn.cork()
+        self.conn.send(b"J")
+        # queued messages are sent before waiting for data
+        self.assertEqual(self.conn.recv(), b'"J')
+        self.conn.uncork()
+
+
+class AsyncSerialConnectionTest(unittest.TestCase):
+    def test_recv(self):
+        async def run():
+            conn = AsyncSerialConnection("loop://", timeout=0.1)
+            try:
+                await conn.send(b"?2003037?>1=")
+                await conn.send(b"J")
+                res = [await conn.recv(), await conn.recv()]
+                with self.assertRaises(TimeoutError):
+                    await conn.recv()
+                return res
+            finally:
+                await conn.close()
+
+        self.assertEqual(asyncio.run(run()), [b'"?2003037?>1=', b'"J'])
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "requires pty")
+    def test_send_blocking(self):
+        master, slave = os.openpty()
+        os.set_blocking(master, False)
+        # more than the pty will buffer, so writing blocks until read
+        data = b"0" * 0x40000
+
+        async def drain(size):
+            received = bytearray()
+            while len(received) < size:
+                try:
+                    received += os.read(master, size)
+                except BlockingIOError:
+                    await asyncio.sleep(0.001)
+            return received
+
+        async def run():
+            conn = AsyncSerialConnection(os.ttyname(slave))
+            try:
+                send = asyncio.ensure_future(conn.send(data))
+                received = await asyncio.wait_for(drain(len(data) + 2), 10.0)
+                await send
+                return received
+            finally:
+                await conn.close()
+
+        try:
+            self.assertEqual(asyncio.run(run()), b'"' + data + b"$")
+        finally:
+            os.close(master)
+            os.close(slave)
+
+
+class FrameReaderTest(unittest.TestCase):
+    def test_checksum(self):
+        reader = _FrameReader()
+        reader.feed(b"?:>>>>>>")
+        self.assertEqual(reader.find(), -1)
+        reader.feed(b"0006008<$053")
+        size = reader.find()
+        self.assertEqual(size, 16)
+        # the first and last byte are not part of the message checksum
+        frame = reader.buffer[:size]
+        digest = reader.checksum.digest() - frame[0] - frame[-1]
+        self.assertEqual(digest & 0x0F, chksum(frame, 1, size - 2))
+        self.assertEqual(digest & 0x0F, frame[-1] & 0x0F)
+        self.assertEqual(reader.find(), size)
+        self.assertEqual(reader.checksum.digest(), chksum(frame))
+        reader.consume(size)
+        self.assertEqual(reader.checksum.digest(), 0)
+        reader.feed(b"37$")
+        self.assertEqual(reader.find(), 5)
+        self.assertEqual(reader.checksum.digest(), chksum(b"05337"))
@@ -0,0 +1,85 @@
+import unittest
+
+from carreralib import ControlUnit, connection, protocol
+from carreralib.session import Connected, Disconnected, SessionManager
+from carreralib.sim import SimulatorConnection
+
+
+class FlakyConnection(SimulatorConnection):
+    def __init__(self, url, npolls):
+        SimulatorConnection.__init__(self, url)
+        self.npolls = npolls
+
+    def send(self, buf, offset=0, size=None):
+        if buf[0:1] == b"?":
+            if not self.npolls:
+                raise connection.TimeoutError("Timeout")
+            self.npolls -= 1
+        SimulatorConnection.send(self, buf, offset, size)
+
+
+class GarbledConnection(SimulatorConnection):
+    def recv(self, maxlength=None):
+        res = SimulatorConnection.recv(self, maxlength)
+        if res.startswith(b"?:"):
+            res = res[:-1] + bytes([res[-1] ^ 1])
+        return res
+
+
+class SessionManagerTest(unittest.TestCase):
+    def test_events(self):
+        devices = {"a": "sim://?version=5337", "b": "sim://?version=5336"}
+        with SessionManager(devices, rate=100) as session:
+            events = {}
+            while len(events) < 4:
+                unit, event = session.get(timeout=1.0)
+                events.setdefault((unit, type(event)), event)
+            self.assertEqual(events[("a", Connected)].version, "5337")
+            self.assertEqual(events[("b", Connected)].version, "5336")
+            self.assertIsInstance(events[("a", ControlUnit.Status)].fuel, tuple)
+            self.assertIsInstance(session["a"], ControlUnit)
+            self.assertEqual(set(session.units), {"a", "b"})
+        self.assertIsNone(session.get())
+
+    def test_reconnect(self):
+        attempts = []
+
+        def factory():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise connection.ConnectionError("Cannot connect")
+            return FlakyConnection("sim://", npolls=1)
+
+        with SessionManager({"a": factory}, retry=0.01) as session:
+            events = [session.get(timeout=1.0).event for _ in range(5)]
+        self.assertIsInstance(events[0], Disconnected)
+        self.assertIsInstance(events[1], Connected)
+        self.assertIsInstance(events[2], ControlUnit.Status)
+        self.assertIsInstance(events[3], Disconnected)
+        self.assertIsInstance(events[4], Connected)
+        with self.assertRaises(connection.ConnectionError):
+            session["a"]
+
+    def test_protocol_error(self):
+        devices = {"a": lambda: GarbledConnection("sim://"), "b": "sim://"}
+        with SessionManager(devices, rate=100, retry=0.01) as session:
+            events = {}
+            keys = {("a", Disconnected), ("b", ControlUnit.Status)}
+            while not keys.issubset(events):
+                unit, event = session.get(timeout=1.0)
+                events.setdefault((unit, type(event)), event)
+                if isinstance(event, ControlUnit.Status):
+                    self.assertEqual(unit, "b")
+            error = events[("a", Disconnected)].error
+            self.assertIsInstance(error, protocol.ProtocolError)
+
+    def test_error(self):
+        def factory():
+            raise RuntimeError("error")
+
+        session = SessionManager(["a"], rate=100)
+        session.close()
+        self.assertIsNone(session.get())
+        session = SessionManager({"a": factory})
+        with self.assertRaises(RuntimeError):
+            session.get(timeout=1.0)
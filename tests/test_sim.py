@@ -0,0 +1,74 @@
+import unittest
+
+from carreralib import ControlUnit
+from carreralib.sim import SimulatorConnection
+
+
+def race(cu, nevents):
+    cu.start()
+    cu.start()
+    events = []
+    while len(events) < nevents:
+        event = cu.poll()
+        if isinstance(event, ControlUnit.Timer):
+            events.append(event)
+    return events
+
+
+class SimulatorTest(unittest.TestCase):
+    def test_open(self):
+        cu = ControlUnit("sim://?version=5345")
+        self.assertEqual(cu.version(), "5345")
+        status = cu.poll()
+        self.assertIsInstance(status, ControlUnit.Status)
+        self.assertEqual(status.fuel, (15, 15, 0, 0, 0, 0, 0, 0))
+        self.assertEqual(status.start, 0)
+        self.assertEqual(status.mode, 6)
+
+    def test_start(self):
+        cu = ControlUnit("sim://")
+        cu.start()
+        self.assertEqual(cu.poll().start, 1)
+        cu.start()
+        lights = set()
+        while True:
+            status = cu.poll()
+            if status.start == 0:
+                break
+            lights.add(status.start)
+        self.assertEqual(lights, {1, 2, 3, 4, 5, 6})
+
+    def test_race(self):
+        url = "sim://?cars=3&laptime=4000,5000,6000&seed=1"
+        events = race(ControlUnit(url), 30)
+        self.assertEqual(events, race(ControlUnit(url), 30))
+        timestamps = [event.timestamp for event in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+        laps = [0, 0, 0]
+        for event in events:
+            laps[event.address] += 1
+        self.assertGreater(laps[0], laps[1])
+        self.assertGreater(laps[1], laps[2])
+
+    def test_fuel(self):
+        cu = ControlUnit("sim://?cars=1&jitter=0")
+        race(cu, 10)
+        status = cu.poll()
+        self.assertLess(status.fuel[0], 15)
+
+    def test_setword(self):
+        conn = SimulatorConnection("sim://")
+        cu = ControlUnit(conn)
+        cu.setwords([(0, address, 7, 2) for address in range(8)])
+        cu.setfuel(3, 12)
+        self.assertEqual(conn.settings[(0, 5)], 7)
+        self.assertEqual(conn.settings[(2, 3)], 12)
+
+    def test_firmware(self):
+        for url in ("sim://", "sim://?blocksize=18"):
+            conn = SimulatorConnection(url)
+            cu = ControlUnit(conn)
+            cu.fwu_start()
+            cu.fwu_write(b"0123456789" * 5)
+            cu.fwu_write(b"ABCDEF")
+            self.assertEqual(conn.firmware, b"0123456789" * 5 + b"ABCDEF")
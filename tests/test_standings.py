@@ -0,0 +1,80 @@
+import unittest
+
+from carreralib import ControlUnit
+from carreralib.standings import PositionChange, Standings
+
+from .test_cu import FakeConnection
+
+
+def timer(address, timestamp, sector=1):
+    return ControlUnit.Timer(address, timestamp, sector)
+
+
+class StandingsTest(unittest.TestCase):
+    def test_update(self):
+        standings = Standings()
+        self.assertIsNone(standings.leader())
+        self.assertEqual(standings.update(timer(0, 1000)), [PositionChange(0, None, 1)])
+        self.assertEqual(standings.update(timer(1, 1100)), [PositionChange(1, None, 2)])
+        self.assertEqual(standings.update(timer(0, 6000)), [])
+        self.assertEqual(standings.update(timer(1, 6100)), [])
+        self.assertEqual(
+            standings.update(timer(1, 10800)),
+            [PositionChange(1, 2, 1), PositionChange(0, 1, 2)],
+        )
+        self.assertEqual(
+            standings.update(timer(2, 11000)), [PositionChange(2, None, 3)]
+        )
+        self.assertEqual(standings.leader(), 1)
+        self.assertEqual(standings.position(0), 2)
+        self.assertEqual(standings.position(2), 3)
+        self.assertIsNone(standings.position(3))
+        self.assertEqual(len(standings), 3)
+        self.assertEqual(standings.update(timer(0, 11000, 2)), [])
+
+    def test_overtake(self):
+        standings = Standings()
+        for address in range(3):
+            standings.update(timer(address, 1000 + address))
+        changes = standings.update(timer(2, 5000))
+        self.assertEqual(
+            changes,
+            [
+                PositionChange(2, 3, 1),
+                PositionChange(0, 1, 2),
+                PositionChange(1, 2, 3),
+            ],
+        )
+        self.assertEqual([e.address for e in standings], [2, 0, 1])
+
+    def test_entries(self):
+        standings = Standings()
+        for t in (1000, 6000, 11000):
+            standings.update(timer(0, t))
+        for t in (1200, 6500):
+            standings.update(timer(1, t))
+        for t in (1100, 6400):
+            standings.update(timer(2, t))
+        entries = standings.entries()
+        self.assertEqual([e.address for e in entries], [0, 2, 1])
+        self.assertEqual(entries[0].gap, (0, 0))
+        self.assertEqual(entries[1].laps, 1)
+        self.assertEqual(entries[1].gap[0], 1)
+        self.assertEqual(entries[2].interval, (0, 100))
+        standings.reset()
+        self.assertEqual(standings.entries(), [])
+
+    def test_position_tower(self):
+        conn = FakeConnection()
+        standings = Standings(ControlUnit(conn))
+        standings.update(timer(0, 1000))
+        standings.update(timer(1, 1100))
+        self.assertEqual(len(conn.sent), 2)
+        conn.sent.clear()
+        standings.update(timer(0, 6000))
+        # leader lap count only
+        self.assertEqual([buf[:2] for buf in conn.sent], [b"J1", b"J2"])
+        conn.sent.clear()
+        standings.update(timer(1, 6100))
+        # positions unchanged
+        self.assertEqual(conn.sent, [])
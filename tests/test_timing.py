@@ -0,0 +1,70 @@
+import unittest
+
+from carreralib import ControlUnit
+from carreralib.timing import LapStore
+
+
+class LapStoreTest(unittest.TestCase):
+    def test_laps(self):
+        store = LapStore()
+        for t in (1000, 6000, 10500, 15500):
+            store.append(0, t)
+        store.add(ControlUnit.Timer(1, 2000, 1))
+        self.assertEqual(store.laps(0), 3)
+        self.assertEqual(store.laps(1), 0)
+        self.assertEqual(list(store.laptimes(0)), [5000, 4500, 5000])
+        self.assertEqual(list(store.laptimes(0, -2)), [4500, 5000])
+        self.assertEqual(list(store.timestamps(0)), [1000, 6000, 10500, 15500])
+        self.assertEqual(list(store.sectortimes(0, 1)), [5000, 4500, 5000])
+        self.assertEqual(store.last(0), 5000)
+        self.assertIsNone(store.last(1))
+        store.clear()
+        self.assertEqual(store.laps(0), 0)
+
+    def test_wraparound(self):
+        store = LapStore()
+        store.append(0, 0xFFFFF000)
+        store.append(0, 0x00001000)
+        self.assertEqual(list(store.laptimes(0)), [0x2000])
+
+    def test_sectors(self):
+        store = LapStore(nsectors=3)
+        events = [
+            (0, 3),  # before first lap, ignored
+            (1000, 1),
+            (2000, 2),
+            (3500, 3),
+            (6000, 1),
+            (7200, 2),
+            # missing Check Lane for sector 3
+            (11000, 1),
+        ]
+        for t, sector in events:
+            store.append(0, t, sector)
+        self.assertEqual(list(store.laptimes(0)), [5000, 5000])
+        self.assertEqual(list(store.sectortimes(0, 1)), [1000, 1200])
+        self.assertEqual(list(store.sectortimes(0, 2)), [1500, 0])
+        self.assertEqual(list(store.sectortimes(0, 3)), [2500, 0])
+        self.assertEqual(store.best(0, 2, sector=2), [(0, 1500)])
+        with self.assertRaises(ValueError):
+            store.sectortimes(0, 4)
+
+    def test_analytics(self):
+        store = LapStore()
+        t = 0
+        for laptime in (0, 5200, 4800, 5000, 5100, 4900):
+            t += laptime
+            store.append(2, t)
+        self.assertEqual(store.best(2), [(1, 4800)])
+        self.assertEqual(store.best(2, 3), [(1, 4800), (4, 4900), (2, 5000)])
+        self.assertEqual(store.rolling(2, 2), [5000, 4900, 5050, 5000])
+        self.assertEqual(store.rolling(2, 10), [])
+        stats = store.stats(2)
+        self.assertEqual(stats.count, 5)
+        self.assertEqual(stats.best, 4800)
+        self.assertEqual(stats.worst, 5200)
+        self.assertEqual(stats.mean, 5000)
+        self.assertAlmostEqual(stats.stdev, 141.42, places=2)
+        self.assertEqual(store.stats(2, last=2).mean, 5000)
+        self.assertIsNone(store.stats(2, last=0))
+        self.assertIsNone(store.stats(0))
@@ -0,0 +1,35 @@
+import logging
+import unittest
+
+from carreralib import ControlUnit
+from carreralib.trace import LogTrace, RECEIVED, SENT, TraceBuffer
+
+from .test_cu import FakeConnection
+
+
+class TraceTest(unittest.TestCase):
+    def test_buffer(self):
+        cu = ControlUnit(FakeConnection([b"?2003037?>1="]))
+        cu.trace = TraceBuffer(maxlen=3)
+        cu.poll()
+        cu.version()
+        entries = cu.trace.entries()
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(
+            [(e.direction, e.data) for e in entries],
+            [(RECEIVED, b"?2003037?>1="), (SENT, b"0"), (RECEIVED, b"053372")],
+        )
+        timestamps = [e.timestamp for e in entries]
+        self.assertEqual(timestamps, sorted(timestamps))
+        cu.trace.clear()
+        self.assertEqual(len(cu.trace), 0)
+
+    def test_log(self):
+        cu = ControlUnit(FakeConnection())
+        logger = logging.getLogger("carreralib.test")
+        cu.trace = LogTrace(logger)
+        with self.assertLogs(logger, logging.DEBUG) as cm:
+            cu.version()
+        self.assertEqual(len(cm.output), 2)
+        self.assertIn("b'0'", cm.output[0])
+        self.assertIn("b'053372'", cm.output[1])